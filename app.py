@@ -1,29 +1,43 @@
 import os
+import atexit
 import contextlib
 import glob
 import tempfile
+import subprocess
+import tracemalloc
 import threading
 import time
 import base64
 import mimetypes
 import hashlib
+import itertools
+import math
+import queue
+import random
 import ssl
 from datetime import datetime, timedelta, timezone
 import re
 import json
+import csv
+import io
 from io import BytesIO
 import urllib.request
 from urllib.error import URLError, HTTPError
 from urllib.parse import urljoin, urlsplit, urlunsplit
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, send_from_directory, abort, jsonify
+import click
+from functools import wraps
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, send_from_directory, abort, jsonify, make_response, session, has_request_context, has_app_context, g
+from flask import before_render_template, template_rendered
+from flask.globals import request_ctx
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from collections import Counter
-from sqlalchemy.orm import selectinload, load_only
-from sqlalchemy import or_, func, text, inspect
-from sqlalchemy.exc import IntegrityError
+from collections import Counter, OrderedDict, namedtuple
+from sqlalchemy.orm import selectinload, load_only, Session as OrmSession
+from sqlalchemy import and_, or_, not_, func, text, inspect, bindparam
+from sqlalchemy.exc import IntegrityError, OperationalError
 from flask_migrate import Migrate
 from markupsafe import Markup, escape
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
@@ -45,6 +59,21 @@ try:
 except ImportError:
     oss2 = None
 
+try:
+    from openpyxl import load_workbook
+except ImportError:  # pragma: no cover - XLSX import is optional, CSV always works
+    load_workbook = None
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depletion forecasting is skipped without NumPy
+    np = None
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - resource is Unix-only, benchmark skips RSS elsewhere
+    resource = None
+
 try:
     from zoneinfo import ZoneInfo
 except ImportError:  # pragma: no cover - Python < 3.9 fallback
@@ -171,6 +200,33 @@ try:
 except (TypeError, ValueError):
     cleanup_grace_seconds = 86400
 app.config['ATTACHMENTS_CLEANUP_GRACE_SECONDS'] = max(0, cleanup_grace_seconds)
+# 附件删除队列：删除物品/位置/事项时只登记待删文件，由后台线程批量清理
+try:
+    attachment_delete_interval = int(os.getenv('ATTACHMENT_DELETE_INTERVAL_SECONDS', '30'))
+except (TypeError, ValueError):
+    attachment_delete_interval = 30
+app.config['ATTACHMENT_DELETE_INTERVAL_SECONDS'] = max(1, attachment_delete_interval)
+try:
+    attachment_delete_batch = int(os.getenv('ATTACHMENT_DELETE_BATCH', '500'))
+except (TypeError, ValueError):
+    attachment_delete_batch = 500
+app.config['ATTACHMENT_DELETE_BATCH'] = min(1000, max(1, attachment_delete_batch))
+try:
+    attachment_delete_max_attempts = int(os.getenv('ATTACHMENT_DELETE_MAX_ATTEMPTS', '8'))
+except (TypeError, ValueError):
+    attachment_delete_max_attempts = 8
+app.config['ATTACHMENT_DELETE_MAX_ATTEMPTS'] = max(1, attachment_delete_max_attempts)
+try:
+    attachment_delete_retry_seconds = int(os.getenv('ATTACHMENT_DELETE_RETRY_SECONDS', '60'))
+except (TypeError, ValueError):
+    attachment_delete_retry_seconds = 60
+app.config['ATTACHMENT_DELETE_RETRY_SECONDS'] = max(1, attachment_delete_retry_seconds)
+# 服务端接收多个附件时并发上传的线程数（进程内共享）；1 表示逐个上传
+try:
+    upload_parallelism = int(os.getenv('UPLOAD_PARALLELISM', '4'))
+except (TypeError, ValueError):
+    upload_parallelism = 4
+app.config['UPLOAD_PARALLELISM'] = max(1, upload_parallelism)
 db_backup_source = (os.getenv('DB_BACKUP_SOURCE_PATH') or '').strip()
 if not db_backup_source:
     db_backup_source = os.path.join(app.instance_path, 'lab.db')
@@ -191,6 +247,127 @@ try:
 except (TypeError, ValueError):
     db_backup_retention_days = 0
 app.config['DB_BACKUP_RETENTION_DAYS'] = max(0, db_backup_retention_days)
+try:
+    log_archive_after_days = int(os.getenv('LOG_ARCHIVE_AFTER_DAYS', '365'))
+except (TypeError, ValueError):
+    log_archive_after_days = 365
+app.config['LOG_ARCHIVE_AFTER_DAYS'] = max(0, log_archive_after_days)
+try:
+    log_archive_interval = int(os.getenv('LOG_ARCHIVE_INTERVAL_SECONDS', '86400'))
+except (TypeError, ValueError):
+    log_archive_interval = 86400
+app.config['LOG_ARCHIVE_INTERVAL_SECONDS'] = max(0, log_archive_interval)
+try:
+    depletion_forecast_interval = int(os.getenv('DEPLETION_FORECAST_INTERVAL_SECONDS', '86400'))
+except (TypeError, ValueError):
+    depletion_forecast_interval = 86400
+app.config['DEPLETION_FORECAST_INTERVAL_SECONDS'] = max(0, depletion_forecast_interval)
+try:
+    depletion_forecast_window = int(os.getenv('DEPLETION_FORECAST_WINDOW_DAYS', '90'))
+except (TypeError, ValueError):
+    depletion_forecast_window = 90
+app.config['DEPLETION_FORECAST_WINDOW_DAYS'] = max(1, depletion_forecast_window)
+try:
+    depletion_alert_days = int(os.getenv('DEPLETION_ALERT_DAYS', '14'))
+except (TypeError, ValueError):
+    depletion_alert_days = 14
+app.config['DEPLETION_ALERT_DAYS'] = max(0, depletion_alert_days)
+# 写入合并队列：开启后经 run_write 的写操作（新增物品、事项留言、关注、离线回写）交给后台线程合并成批提交，减少 SQLite 写锁争抢
+app.config['SQLITE_WRITE_QUEUE'] = _parse_env_flag(os.getenv('SQLITE_WRITE_QUEUE'), default=False)
+try:
+    write_queue_batch = int(os.getenv('SQLITE_WRITE_QUEUE_BATCH', '64'))
+except (TypeError, ValueError):
+    write_queue_batch = 64
+app.config['SQLITE_WRITE_QUEUE_BATCH'] = max(1, write_queue_batch)
+try:
+    write_queue_linger_ms = int(os.getenv('SQLITE_WRITE_QUEUE_LINGER_MS', '5'))
+except (TypeError, ValueError):
+    write_queue_linger_ms = 5
+app.config['SQLITE_WRITE_QUEUE_LINGER_MS'] = max(0, write_queue_linger_ms)
+try:
+    write_queue_timeout = int(os.getenv('SQLITE_WRITE_QUEUE_TIMEOUT_SECONDS', '30'))
+except (TypeError, ValueError):
+    write_queue_timeout = 30
+app.config['SQLITE_WRITE_QUEUE_TIMEOUT_SECONDS'] = max(1, write_queue_timeout)
+# 审计日志异步写入：提交后先落到暂存文件，再由后台线程按条数/时间批量入库
+app.config['AUDIT_LOG_ASYNC'] = _parse_env_flag(os.getenv('AUDIT_LOG_ASYNC'), default=True)
+try:
+    audit_log_batch_size = int(os.getenv('AUDIT_LOG_BATCH_SIZE', '200'))
+except (TypeError, ValueError):
+    audit_log_batch_size = 200
+app.config['AUDIT_LOG_BATCH_SIZE'] = max(1, audit_log_batch_size)
+try:
+    audit_log_flush_interval_ms = int(os.getenv('AUDIT_LOG_FLUSH_INTERVAL_MS', '1000'))
+except (TypeError, ValueError):
+    audit_log_flush_interval_ms = 1000
+app.config['AUDIT_LOG_FLUSH_INTERVAL_MS'] = max(50, audit_log_flush_interval_ms)
+app.config['AUDIT_LOG_SPOOL_DIR'] = (
+    (os.getenv('AUDIT_LOG_SPOOL_DIR') or '').strip() or os.path.join(app.instance_path, 'audit-spool')
+)
+app.config['AUDIT_LOG_SPOOL_FSYNC'] = _parse_env_flag(os.getenv('AUDIT_LOG_SPOOL_FSYNC'), default=False)
+try:
+    notification_retention_days = int(os.getenv('NOTIFICATION_RETENTION_DAYS', '180'))
+except (TypeError, ValueError):
+    notification_retention_days = 180
+app.config['NOTIFICATION_RETENTION_DAYS'] = max(0, notification_retention_days)
+try:
+    rich_text_cache_size = int(os.getenv('RICH_TEXT_CACHE_SIZE', '4096'))
+except (TypeError, ValueError):
+    rich_text_cache_size = 4096
+_RICH_TEXT_CACHE_SIZE = max(0, rich_text_cache_size)
+response_cache_backend = (os.getenv('RESPONSE_CACHE_BACKEND') or 'memory').strip().lower()
+if response_cache_backend not in {'memory', 'sqlite', 'off'}:
+    response_cache_backend = 'memory'
+app.config['RESPONSE_CACHE_BACKEND'] = response_cache_backend
+app.config['RESPONSE_CACHE_PATH'] = (
+    (os.getenv('RESPONSE_CACHE_PATH') or '').strip()
+    or os.path.join(app.instance_path, 'response-cache.sqlite3')
+)
+try:
+    response_cache_max_entries = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '512'))
+except (TypeError, ValueError):
+    response_cache_max_entries = 512
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = max(1, response_cache_max_entries)
+try:
+    response_cache_ttl = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '300'))
+except (TypeError, ValueError):
+    response_cache_ttl = 300
+app.config['RESPONSE_CACHE_TTL_SECONDS'] = max(1, response_cache_ttl)
+try:
+    fragment_cache_max_entries = int(os.getenv('FRAGMENT_CACHE_MAX_ENTRIES', '2048'))
+except (TypeError, ValueError):
+    fragment_cache_max_entries = 2048
+app.config['FRAGMENT_CACHE_MAX_ENTRIES'] = max(0, fragment_cache_max_entries)
+app.config['BENLAB_PROFILING'] = _parse_env_flag(os.getenv('BENLAB_PROFILING'), default=False)
+try:
+    profiling_slow_ms = int(os.getenv('PROFILING_SLOW_REQUEST_MS', '500'))
+except (TypeError, ValueError):
+    profiling_slow_ms = 500
+app.config['PROFILING_SLOW_REQUEST_MS'] = max(0, profiling_slow_ms)
+try:
+    profiling_sample_rate = float(os.getenv('PROFILING_SLOW_SAMPLE_RATE', '1.0'))
+except (TypeError, ValueError):
+    profiling_sample_rate = 1.0
+app.config['PROFILING_SLOW_SAMPLE_RATE'] = min(1.0, max(0.0, profiling_sample_rate))
+app.config['PROFILING_SLOW_LOG_PATH'] = (
+    (os.getenv('PROFILING_SLOW_LOG_PATH') or '').strip()
+    or os.path.join(app.instance_path, 'slow-requests.jsonl')
+)
+try:
+    profiling_n_plus_one = int(os.getenv('PROFILING_N_PLUS_ONE_THRESHOLD', '10'))
+except (TypeError, ValueError):
+    profiling_n_plus_one = 10
+app.config['PROFILING_N_PLUS_ONE_THRESHOLD'] = max(2, profiling_n_plus_one)
+app.config['METRICS_TOKEN'] = (os.getenv('METRICS_TOKEN') or '').strip()
+lazy_load_guard_mode = (os.getenv('LAZY_LOAD_GUARD') or 'off').strip().lower()
+if lazy_load_guard_mode not in {'off', 'warn', 'raise'}:
+    lazy_load_guard_mode = 'off'
+app.config['LAZY_LOAD_GUARD'] = lazy_load_guard_mode
+try:
+    lazy_load_guard_limit = int(os.getenv('LAZY_LOAD_GUARD_LIMIT', '20'))
+except (TypeError, ValueError):
+    lazy_load_guard_limit = 20
+app.config['LAZY_LOAD_GUARD_LIMIT'] = max(1, lazy_load_guard_limit)
 REMOTE_FIELD_SUFFIX = '_remote_keys'
 _oss_bucket = None
 _db_backup_lock = threading.Lock()
@@ -737,6 +914,107 @@ def _parse_coordinate(raw_value):
         return None
 
 
+# Geohash 空间索引：locations.geohash 上的前缀区间查询近似二维索引 ----------------
+_GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_GEOHASH_PRECISION = 9  # 约 4.8m x 4.8m
+_GEOHASH_MAX_COVER_CELLS = 16
+_EARTH_RADIUS_METERS = 6371008.8
+
+
+def _geohash_encode(latitude, longitude, precision=_GEOHASH_PRECISION):
+    """Encode a coordinate pair into a base32 geohash string."""
+    if latitude is None or longitude is None:
+        return None
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lng_lo = mid
+            else:
+                bits <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_lo = mid
+            else:
+                bits <<= 1
+                lat_hi = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def _geohash_cell_size(precision):
+    """Return (lat_degrees, lng_degrees) spanned by one geohash cell."""
+    total_bits = precision * 5
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+
+def _geohash_cover_prefixes(min_lat, min_lng, max_lat, max_lng):
+    """Return geohash prefixes whose cells cover the bounding box."""
+    min_lat, max_lat = max(-90.0, min_lat), min(90.0, max_lat)
+    min_lng, max_lng = max(-180.0, min_lng), min(180.0, max_lng)
+    if min_lat > max_lat or min_lng > max_lng:
+        return []
+    precision = _GEOHASH_PRECISION
+    while precision > 1:
+        cell_lat, cell_lng = _geohash_cell_size(precision)
+        rows = int((max_lat - min_lat) / cell_lat) + 2
+        cols = int((max_lng - min_lng) / cell_lng) + 2
+        if rows * cols <= _GEOHASH_MAX_COVER_CELLS:
+            break
+        precision -= 1
+    cell_lat, cell_lng = _geohash_cell_size(precision)
+    prefixes = set()
+    lat = min_lat
+    while True:
+        lng = min_lng
+        while True:
+            prefixes.add(_geohash_encode(lat, lng, precision))
+            if lng >= max_lng:
+                break
+            lng = min(lng + cell_lng, max_lng)
+        if lat >= max_lat:
+            break
+        lat = min(lat + cell_lat, max_lat)
+    return sorted(prefixes)
+
+
+def _bounding_box_for_radius(latitude, longitude, radius_meters):
+    """Return (min_lat, min_lng, max_lat, max_lng) enclosing a circle."""
+    lat_delta = math.degrees(radius_meters / _EARTH_RADIUS_METERS)
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-6:
+        lng_delta = 180.0
+    else:
+        lng_delta = min(180.0, lat_delta / cos_lat)
+    return latitude - lat_delta, longitude - lng_delta, latitude + lat_delta, longitude + lng_delta
+
+
+def _haversine_meters(lat1, lng1, lat2, lng2):
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * _EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+
 _EXTERNAL_MEDIA_PREFIXES = ('http://', 'https://', '//')
 
 
@@ -784,11 +1062,21 @@ def determine_media_kind(ref):
         return 'image'
     return 'file'
 
-_LINK_PATTERN = re.compile(r'(?P<url>https?://[^\s<>"\'`]+)', re.IGNORECASE)
-_HASHTAG_PATTERN = re.compile(r'(?<![\w#])#(?P<tag>[\w\u4e00-\u9fa5-]+)')
-_MENTION_PATTERN = re.compile(r'(?<![\w@])@(?P<handle>[\w\u4e00-\u9fa5-]+)')
-_SENTIMENT_GOOD_TOKEN = '__SENT_POS__'
-_SENTIMENT_DOUBT_TOKEN = '__SENT_QUEST__'
+# 富文本单次扫描：链接优先，其余 token 不会在链接内部被二次替换
+_RICH_TEXT_TOKEN_PATTERN = re.compile(
+    r'(?P<url>https?://[^\s<>"\'`]+)'
+    r'|(?<![\w#])#(?P<tag>[\w\u4e00-\u9fa5-]+)'
+    r'|(?<![\w@])@(?P<handle>[\w\u4e00-\u9fa5-]+)'
+    r'|(?P<good>!!)'
+    r'|(?P<doubt>\?\?)'
+    r'|(?P<newline>\n)',
+    re.IGNORECASE
+)
+_RICH_TEXT_STATIC_HTML = {
+    'good': '<span class="sentiment-chip sentiment-good">!!</span>',
+    'doubt': '<span class="sentiment-chip sentiment-doubt">??</span>',
+    'newline': '<br>',
+}
 _ALLOWED_ITEM_FEATURES = {'公共', '私人'}
 _ITEM_FEATURE_INTENTS = {
     '公共': 'public',
@@ -1388,42 +1676,68 @@ def _build_event_summary(events, recent_past_limit=5):
     }
 
 
-def render_rich_text(raw_text, mention_lookup=None):
-    """Convert plain text into HTML with clickable links, tags, and mentions."""
-    if not raw_text:
-        return Markup('')
-    safe_text = escape(raw_text)
-    html = str(safe_text)
-    html = html.replace('!!', _SENTIMENT_GOOD_TOKEN).replace('??', _SENTIMENT_DOUBT_TOKEN)
-
-    def link_repl(match):
-        url = match.group('url')
-        return f'<a href="{escape(url)}" class="link-chip" target="_blank" rel="noopener">{escape(url)}</a>'
+def _rich_text_profile_url(mention_lookup, member_id):
+    if isinstance(mention_lookup, MentionLookup):
+        return mention_lookup.profile_url(member_id)
+    return url_for('profile', member_id=member_id)
 
-    html = _LINK_PATTERN.sub(link_repl, html)
 
-    def hashtag_repl(match):
-        tag = match.group('tag')
-        return f'<span class="tag-chip">#{escape(tag)}</span>'
+def _render_rich_text_html(raw_text, mention_lookup):
+    parts = []
+    position = 0
+    for match in _RICH_TEXT_TOKEN_PATTERN.finditer(raw_text):
+        start = match.start()
+        if start > position:
+            parts.append(str(escape(raw_text[position:start])))
+        position = match.end()
+        kind = match.lastgroup
+        if kind == 'url':
+            url = escape(match.group('url'))
+            parts.append(f'<a href="{url}" class="link-chip" target="_blank" rel="noopener">{url}</a>')
+        elif kind == 'tag':
+            parts.append(f'<span class="tag-chip">#{escape(match.group("tag"))}</span>')
+        elif kind == 'handle':
+            handle = match.group('handle')
+            label = escape(handle)
+            member_id = mention_lookup.get(handle.lower()) if mention_lookup else None
+            if member_id:
+                href = escape(_rich_text_profile_url(mention_lookup, member_id))
+                parts.append(f'<a href="{href}" class="mention-chip">@{label}</a>')
+            else:
+                parts.append(f'<span class="mention-chip">@{label}</span>')
+        else:
+            parts.append(_RICH_TEXT_STATIC_HTML[kind])
+    if position < len(raw_text):
+        parts.append(str(escape(raw_text[position:])))
+    return ''.join(parts)
 
-    html = _HASHTAG_PATTERN.sub(hashtag_repl, html)
 
-    def mention_repl(match):
-        handle = match.group('handle')
-        key = handle.lower()
-        member_id = None
-        if mention_lookup:
-            member_id = mention_lookup.get(key)
-        label = escape(handle)
-        if member_id:
-            href = url_for('profile', member_id=member_id)
-            return f'<a href="{escape(href)}" class="mention-chip">@{label}</a>'
-        return f'<span class="mention-chip">@{label}</span>'
+def render_rich_text(raw_text, mention_lookup=None):
+    """Convert plain text into HTML with clickable links, tags, and mentions.
 
-    html = _MENTION_PATTERN.sub(mention_repl, html)
-    html = html.replace(_SENTIMENT_GOOD_TOKEN, '<span class="sentiment-chip sentiment-good">!!</span>')
-    html = html.replace(_SENTIMENT_DOUBT_TOKEN, '<span class="sentiment-chip sentiment-doubt">??</span>')
-    return Markup(html.replace('\n', '<br>'))
+    Text is tokenized once and escaped per token. Results are cached by content
+    hash and mention-map version; a plain dict lookup has no version and bypasses
+    the cache.
+    """
+    if not raw_text:
+        return Markup('')
+    cache_key = None
+    if mention_lookup is None or isinstance(mention_lookup, MentionLookup):
+        version = mention_lookup.version if mention_lookup is not None else None
+        digest = hashlib.sha1(raw_text.encode('utf-8')).hexdigest()
+        cache_key = (digest, version)
+        with _rich_text_cache_lock:
+            cached = _rich_text_cache.get(cache_key)
+            if cached is not None:
+                _rich_text_cache.move_to_end(cache_key)
+                return cached
+    html = Markup(_render_rich_text_html(raw_text, mention_lookup))
+    if cache_key is not None:
+        with _rich_text_cache_lock:
+            _rich_text_cache[cache_key] = html
+            while len(_rich_text_cache) > _RICH_TEXT_CACHE_SIZE:
+                _rich_text_cache.popitem(last=False)
+    return html
 
 
 def load_feedback_stream(raw_text):
@@ -1483,7 +1797,7 @@ def prepare_feedback_entries(raw_text, member_index, mention_lookup):
         sender_url = None
         if member:
             display_name = member.name or member.username
-            sender_url = url_for('profile', member_id=member.id)
+            sender_url = _rich_text_profile_url(mention_lookup, member.id)
         else:
             display_name = sender_name or '匿名'
         sentiment = None
@@ -1508,17 +1822,74 @@ def prepare_feedback_entries(raw_text, member_index, mention_lookup):
     return entries
 
 
+MemberRef = namedtuple('MemberRef', ('id', 'name', 'username'))
+_MEMBER_LOOKUP_CACHE_KEY = 'member_lookup'
+_DEPLETION_FORECAST_CACHE_KEY = 'depletion_forecast'
+_member_lookup_cache = {'version': None, 'value': None}
+_member_lookup_cache_lock = threading.Lock()
+_rich_text_cache = OrderedDict()
+_rich_text_cache_lock = threading.Lock()
+
+
+class MentionLookup(dict):
+    """Lowercased name/username -> member id, tagged with the cache generation it was built from."""
+
+    def __init__(self, *args, version=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = version
+        self.profile_urls = {}
+
+    def profile_url(self, member_id):
+        """Memoized `url_for('profile')`; lives as long as this cached lookup generation."""
+        url = self.profile_urls.get(member_id)
+        if url is None:
+            url = url_for('profile', member_id=member_id)
+            self.profile_urls[member_id] = url
+        return url
+
+
+def _read_cache_version(name):
+    version = db.session.execute(
+        db.select(CacheVersion.version).where(CacheVersion.name == name)
+    ).scalar()
+    return version or 0
+
+
+def _bump_cache_version(connection, name):
+    """Increment a shared cache generation inside the caller's transaction."""
+    table = CacheVersion.__table__
+    result = connection.execute(
+        table.update().where(table.c.name == name).values(version=table.c.version + 1)
+    )
+    if not result.rowcount:
+        connection.execute(table.insert().values(name=name, version=1))
+
+
 def build_member_lookup():
-    """Return dictionaries for quick member lookup and mention resolution."""
-    members = Member.query.options(load_only(Member.id, Member.name, Member.username)).all()
-    member_index = {m.id: m for m in members}
-    mention_lookup = {}
-    for m in members:
-        if m.name:
-            mention_lookup[m.name.lower()] = m.id
-        if m.username:
-            mention_lookup[m.username.lower()] = m.id
-    return member_index, mention_lookup
+    """Return dictionaries for quick member lookup and mention resolution.
+
+    The maps are cached per process and rebuilt only when the shared
+    `member_lookup` generation in cache_versions changes (members created,
+    renamed or deleted), so every worker sees renames without a full scan per page.
+    Values in `member_index` are lightweight MemberRef tuples, not ORM objects.
+    """
+    version = _read_cache_version(_MEMBER_LOOKUP_CACHE_KEY)
+    cached = _member_lookup_cache
+    if cached['version'] == version and cached['value'] is not None:
+        return cached['value']
+    rows = db.session.execute(db.select(Member.id, Member.name, Member.username)).all()
+    member_index = {row.id: MemberRef(row.id, row.name, row.username) for row in rows}
+    mention_lookup = MentionLookup(version=version)
+    for ref in member_index.values():
+        if ref.name:
+            mention_lookup[ref.name.lower()] = ref.id
+        if ref.username:
+            mention_lookup[ref.username.lower()] = ref.id
+    value = (member_index, mention_lookup)
+    with _member_lookup_cache_lock:
+        _member_lookup_cache['version'] = version
+        _member_lookup_cache['value'] = value
+    return value
 
 def _get_oss_bucket():
     """Lazy initialise and return OSS bucket instance when启用."""
@@ -1658,8 +2029,16 @@ def _generate_stored_filename(original_name):
     return f"{timestamp}_{sanitized}"
 
 
-def save_uploaded_media(file_storage):
-    """Persist an uploaded media file and return the stored object key."""
+class MediaUploadError(RuntimeError):
+    """Raised when an uploaded file cannot be written to storage."""
+
+
+def _store_uploaded_media(file_storage):
+    """Persist one uploaded file and return its stored key (None when skipped).
+
+    Raises MediaUploadError instead of aborting, so it can run off the request
+    thread and callers decide how to report the failure.
+    """
     if not file_storage or file_storage.filename == '':
         return None
     if not allowed_file(file_storage.filename):
@@ -1668,7 +2047,7 @@ def save_uploaded_media(file_storage):
     if app.config.get('USE_OSS'):
         bucket = _get_oss_bucket()
         if not bucket:
-            abort(503, description='OSS 存储未启用或不可用，无法上传。')
+            raise MediaUploadError('OSS 存储未启用或不可用，无法上传。')
         prefix = app.config.get('OSS_PREFIX')
         object_key = f"{prefix}/{stored_name}" if prefix else stored_name
         try:
@@ -1686,42 +2065,85 @@ def save_uploaded_media(file_storage):
         except Exception as exc:
             # OSS mode is OSS-only: do not fall back to local storage.
             app.logger.warning('OSS 上传失败: %s', exc)
-            abort(503, description='OSS 上传失败，请稍后重试。')
+            raise MediaUploadError('OSS 上传失败，请稍后重试。') from exc
     attachments_root = app.config.get('ATTACHMENTS_FOLDER')
     if not attachments_root:
         return None
     os.makedirs(attachments_root, exist_ok=True)
     filepath = os.path.join(attachments_root, stored_name)
-    file_storage.save(filepath)
+    try:
+        file_storage.save(filepath)
+    except OSError as exc:
+        raise MediaUploadError('附件保存失败，请稍后重试。') from exc
     return stored_name
 
 
-def remove_uploaded_file(filename):
-    """Delete a previously saved attachment file if it still exists."""
-    if not filename or _is_external_media(filename):
-        return
-    for root in _attachment_storage_roots():
-        if not root or not os.path.isdir(root):
-            continue
-        local_path = _safe_attachment_path(root, filename)
-        if not local_path or not os.path.exists(local_path):
-            continue
-        try:
-            os.remove(local_path)
-        except OSError:
-            pass
-    if not app.config.get('USE_OSS'):
-        return
-    bucket = _get_oss_bucket()
-    if not bucket:
-        return
-    key = filename
+def save_uploaded_media(file_storage):
+    """Persist an uploaded media file and return the stored object key."""
     try:
-        bucket.delete_object(key)
-    except oss2.exceptions.NoSuchKey:  # type: ignore[attr-defined]
-        pass
-    except Exception:
-        pass
+        return _store_uploaded_media(file_storage)
+    except MediaUploadError as exc:
+        abort(503, description=str(exc))
+
+
+_upload_executor = None
+_upload_executor_lock = threading.Lock()
+
+
+def _get_upload_executor():
+    global _upload_executor
+    if _upload_executor is None:
+        with _upload_executor_lock:
+            if _upload_executor is None:
+                _upload_executor = ThreadPoolExecutor(
+                    max_workers=app.config['UPLOAD_PARALLELISM'],
+                    thread_name_prefix='media-upload'
+                )
+    return _upload_executor
+
+
+def save_uploaded_media_batch(file_storages):
+    """Upload several files concurrently; returns (stored keys, failures).
+
+    Keys keep the order of file_storages (skipped files are left out) and
+    failures is a list of (original filename, message). The shared pool caps
+    concurrent uploads per process at UPLOAD_PARALLELISM.
+    """
+    files = [fs for fs in file_storages or () if fs and fs.filename]
+    if not files:
+        return [], []
+    if len(files) == 1 or app.config['UPLOAD_PARALLELISM'] <= 1:
+        outcomes = []
+        for file_storage in files:
+            try:
+                outcomes.append((file_storage, _store_uploaded_media(file_storage), None))
+            except MediaUploadError as exc:
+                outcomes.append((file_storage, None, exc))
+    else:
+        # 预先初始化 OSS 客户端，避免多个上传线程并发创建
+        _get_oss_bucket()
+
+        def upload(file_storage):
+            with app.app_context():
+                return _store_uploaded_media(file_storage)
+
+        executor = _get_upload_executor()
+        futures = [(file_storage, executor.submit(upload, file_storage)) for file_storage in files]
+        outcomes = []
+        for file_storage, future in futures:
+            try:
+                outcomes.append((file_storage, future.result(), None))
+            except MediaUploadError as exc:
+                outcomes.append((file_storage, None, exc))
+    stored = [key for _file_storage, key, error in outcomes if key]
+    failures = [(file_storage.filename, str(error)) for file_storage, _key, error in outcomes if error]
+    return stored, failures
+
+
+def _flash_upload_failures(failures):
+    if failures:
+        names = '、'.join(name for name, _message in failures)
+        flash(f'以下附件上传失败，未保存：{names}（{failures[0][1]}）', 'warning')
 
 
 def _sign_oss_get_url(key):
@@ -1737,7 +2159,8 @@ def _sign_oss_get_url(key):
         expires_in = 900
     expires_in = max(60, expires_in)
     try:
-        signed_url = bucket.sign_url('GET', key, expires_in)
+        with _profile_oss_signing():
+            signed_url = bucket.sign_url('GET', key, expires_in)
     except Exception:
         return None
     return _finalize_signed_upload_url(signed_url)
@@ -1934,6 +2357,181 @@ def _start_attachment_housekeeping():
     thread.start()
 
 
+# ---------------------------------------------------------------------------
+# 附件删除队列：请求内只登记待删文件，后台线程用 OSS 批量删除接口清理
+# ---------------------------------------------------------------------------
+# OSS DeleteMultipleObjects 单次最多 1000 个键
+_OSS_BATCH_DELETE_LIMIT = 1000
+_attachment_deletion_wakeup = threading.Event()
+_attachment_deletion_lock = threading.Lock()
+_ATTACHMENT_DELETION_WAKE_KEY = '_attachment_deletions_enqueued'
+
+
+def enqueue_attachment_deletions(refs):
+    """Queue stored files for deletion once the current transaction commits.
+
+    External URLs and blanks are ignored. Returns the number of rows queued.
+    """
+    now = datetime.utcnow()
+    queued = 0
+    for ref in dict.fromkeys(refs or ()):
+        if not ref or _is_external_media(ref):
+            continue
+        db.session.add(AttachmentDeletion(ref=ref, created_at=now, next_attempt_at=now))
+        queued += 1
+    if queued:
+        db.session.info[_ATTACHMENT_DELETION_WAKE_KEY] = True
+    return queued
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def _wake_attachment_deletion_worker(session):
+    if session.info.pop(_ATTACHMENT_DELETION_WAKE_KEY, False):
+        _attachment_deletion_wakeup.set()
+
+
+@event.listens_for(OrmSession, 'after_soft_rollback')
+def _forget_attachment_deletion_wakeup(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop(_ATTACHMENT_DELETION_WAKE_KEY, None)
+
+
+def _remove_local_attachment_copies(ref):
+    for root in _attachment_storage_roots():
+        if not root or not os.path.isdir(root):
+            continue
+        local_path = _safe_attachment_path(root, ref)
+        if not local_path or not os.path.exists(local_path):
+            continue
+        os.remove(local_path)
+
+
+def _delete_attachment_refs(refs):
+    """Delete stored copies of refs; returns {ref: error message} for failures."""
+    errors = {}
+    for ref in refs:
+        try:
+            _remove_local_attachment_copies(ref)
+        except OSError as exc:
+            errors[ref] = f'本地删除失败: {exc}'
+    if not app.config.get('USE_OSS'):
+        return errors
+    bucket = _get_oss_bucket()
+    if not bucket:
+        return {ref: 'OSS 存储不可用' for ref in refs}
+    keys = [ref for ref in refs if ref not in errors]
+    for start in range(0, len(keys), _OSS_BATCH_DELETE_LIMIT):
+        chunk = keys[start:start + _OSS_BATCH_DELETE_LIMIT]
+        try:
+            # 对象不存在时 OSS 同样视为删除成功
+            bucket.batch_delete_objects(chunk)
+        except Exception as exc:
+            for key in chunk:
+                errors[key] = f'OSS 批量删除失败: {exc}'
+    return errors
+
+
+def drain_attachment_deletions(limit=None):
+    """Process due rows of the deletion queue; returns counters for this pass.
+
+    Files that are referenced again (by an attachment or avatar) are dropped
+    from the queue without touching storage. Failures are retried with
+    exponential backoff and move to the dead letter after
+    ATTACHMENT_DELETE_MAX_ATTEMPTS. Deleting is idempotent, so a concurrent
+    drain in another process at worst repeats a delete.
+    """
+    batch_size = limit or app.config['ATTACHMENT_DELETE_BATCH']
+    max_attempts = app.config['ATTACHMENT_DELETE_MAX_ATTEMPTS']
+    base_delay = app.config['ATTACHMENT_DELETE_RETRY_SECONDS']
+    stats = {'deleted': 0, 'skipped': 0, 'retrying': 0, 'dead': 0}
+    table = AttachmentDeletion.__table__
+    with _attachment_deletion_lock:
+        now = datetime.utcnow()
+        rows = db.session.execute(
+            db.select(table.c.id, table.c.ref, table.c.attempts)
+            .where(table.c.dead_at.is_(None), table.c.next_attempt_at <= now)
+            .order_by(table.c.next_attempt_at, table.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            db.session.rollback()
+            return stats
+        refs = list(dict.fromkeys(row.ref for row in rows))
+        still_used = set(db.session.execute(
+            db.select(Attachment.filename).where(Attachment.filename.in_(refs))
+        ).scalars())
+        still_used.update(db.session.execute(
+            db.select(Member.photo).where(Member.photo.in_(refs))
+        ).scalars())
+        # 释放读事务，存储往返期间不占用 SQLite 快照
+        db.session.rollback()
+        errors = _delete_attachment_refs([ref for ref in refs if ref not in still_used])
+        finished_ids = []
+        failures = []
+        for row in rows:
+            error = None if row.ref in still_used else errors.get(row.ref)
+            if error is None:
+                finished_ids.append(row.id)
+                stats['skipped' if row.ref in still_used else 'deleted'] += 1
+                continue
+            attempts = row.attempts + 1
+            failure = {'row_id': row.id, 'attempts': attempts, 'last_error': error[:1000],
+                       'next_attempt_at': now, 'dead_at': None}
+            if attempts >= max_attempts:
+                failure['dead_at'] = now
+                stats['dead'] += 1
+                app.logger.warning('附件 %s 删除失败 %s 次，已移入死信: %s', row.ref, attempts, error)
+            else:
+                delay = min(base_delay * (2 ** (attempts - 1)), 6 * 3600)
+                failure['next_attempt_at'] = now + timedelta(seconds=delay)
+                stats['retrying'] += 1
+            failures.append(failure)
+        if finished_ids:
+            db.session.execute(table.delete().where(table.c.id.in_(finished_ids)))
+        if failures:
+            db.session.execute(
+                table.update().where(table.c.id == bindparam('row_id')).values(
+                    attempts=bindparam('attempts'),
+                    last_error=bindparam('last_error'),
+                    next_attempt_at=bindparam('next_attempt_at'),
+                    dead_at=bindparam('dead_at'),
+                ),
+                failures
+            )
+        db.session.commit()
+    return stats
+
+
+def attachment_deletion_counts():
+    pending, dead = db.session.query(
+        func.count(AttachmentDeletion.id).filter(AttachmentDeletion.dead_at.is_(None)),
+        func.count(AttachmentDeletion.id).filter(AttachmentDeletion.dead_at.isnot(None)),
+    ).one()
+    return {'pending': pending or 0, 'dead': dead or 0}
+
+
+def _start_attachment_deletion_worker():
+    interval_seconds = app.config['ATTACHMENT_DELETE_INTERVAL_SECONDS']
+    if os.environ.get('FLASK_DEBUG') == '1' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return
+
+    def runner():
+        with app.app_context():
+            while True:
+                try:
+                    # 一轮处理满一批说明还有积压，立即继续
+                    while sum(drain_attachment_deletions().values()) >= app.config['ATTACHMENT_DELETE_BATCH']:
+                        pass
+                except Exception as exc:
+                    db.session.rollback()
+                    app.logger.warning('附件删除任务失败: %s', exc)
+                _attachment_deletion_wakeup.wait(interval_seconds)
+                _attachment_deletion_wakeup.clear()
+
+    thread = threading.Thread(target=runner, name='attachment-deletion-worker', daemon=True)
+    thread.start()
+
+
 def _resolve_db_backup_source_path():
     source = app.config.get('DB_BACKUP_SOURCE_PATH') or ''
     source = source.strip()
@@ -2096,6 +2694,93 @@ def _start_db_backup_worker():
     thread = threading.Thread(target=runner, name='db-backup-worker', daemon=True)
     thread.start()
 
+_LOG_ARCHIVE_BATCH_SIZE = 5000
+_LOG_ARCHIVE_COLUMNS = ('id', 'timestamp', 'user_id', 'item_id', 'location_id', 'event_id', 'action_type', 'details')
+_log_archive_lock = threading.Lock()
+
+
+def _archive_old_logs(older_than_days=None, batch_size=_LOG_ARCHIVE_BATCH_SIZE):
+    """Move logs older than the cutoff into logs_archive in short batches.
+
+    Each batch copies and deletes in its own transaction so writers are only
+    blocked briefly. Returns the number of rows moved.
+    """
+    days = app.config.get('LOG_ARCHIVE_AFTER_DAYS', 0) if older_than_days is None else older_than_days
+    if not days or days <= 0:
+        return 0
+    if not _log_archive_lock.acquire(blocking=False):
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    logs_table = Log.__table__
+    archive_table = LogArchive.__table__
+    moved = 0
+    try:
+        while True:
+            with db.engine.begin() as conn:
+                ids = conn.execute(
+                    db.select(logs_table.c.id)
+                    .where(logs_table.c.timestamp < cutoff)
+                    .order_by(logs_table.c.timestamp)
+                    .limit(batch_size)
+                ).scalars().all()
+                if not ids:
+                    break
+                conn.execute(
+                    archive_table.insert().from_select(
+                        _LOG_ARCHIVE_COLUMNS,
+                        db.select(*[logs_table.c[name] for name in _LOG_ARCHIVE_COLUMNS])
+                        .where(logs_table.c.id.in_(ids))
+                    )
+                )
+                conn.execute(logs_table.delete().where(logs_table.c.id.in_(ids)))
+            moved += len(ids)
+            if len(ids) < batch_size:
+                break
+    finally:
+        _log_archive_lock.release()
+    return moved
+
+
+def _purge_expired_notifications(retention_days=None):
+    """Delete inbox rows older than NOTIFICATION_RETENTION_DAYS; returns rows removed."""
+    days = app.config.get('NOTIFICATION_RETENTION_DAYS', 0) if retention_days is None else retention_days
+    if not days or days <= 0:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    table = Notification.__table__
+    with db.engine.begin() as conn:
+        result = conn.execute(table.delete().where(table.c.timestamp < cutoff))
+    return result.rowcount or 0
+
+
+def _start_log_archive_worker():
+    if not app.config.get('LOG_ARCHIVE_AFTER_DAYS') and not app.config.get('NOTIFICATION_RETENTION_DAYS'):
+        return
+    interval_seconds = app.config.get('LOG_ARCHIVE_INTERVAL_SECONDS', 0)
+    if os.environ.get('FLASK_DEBUG') == '1' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return
+
+    def runner():
+        with app.app_context():
+            while True:
+                try:
+                    moved = _archive_old_logs()
+                    if moved:
+                        app.logger.info('已归档 %s 条历史日志', moved)
+                except Exception as exc:
+                    app.logger.warning('日志归档任务失败: %s', exc)
+                try:
+                    _purge_expired_notifications()
+                except Exception as exc:
+                    app.logger.warning('通知清理任务失败: %s', exc)
+                if not interval_seconds:
+                    break
+                time.sleep(interval_seconds)
+
+    thread = threading.Thread(target=runner, name='log-archive-worker', daemon=True)
+    thread.start()
+
+
 def _finalize_signed_upload_url(url):
     """Rewrite signed OSS URL to desired domain/scheme for front-end direct uploads."""
     if not url:
@@ -2593,29 +3278,36 @@ def _chatanywhere_chat_completion(messages, max_tokens=900):
     return text_content, request_payload['model']
 
 
+_direct_upload_config_cache = {}
+
+
 def _build_direct_upload_config():
     enabled = bool(app.config.get('DIRECT_OSS_UPLOAD_ENABLED'))
+    max_size = app.config.get('MAX_CONTENT_LENGTH')
+    cache_key = (enabled, max_size, request.script_root if has_request_context() else '')
+    cached = _direct_upload_config_cache.get(cache_key)
+    if cached is not None:
+        return cached
     config = {
         'enabled': enabled,
         'field_suffix': REMOTE_FIELD_SUFFIX
     }
-    if not enabled:
-        return config
-    max_size = app.config.get('MAX_CONTENT_LENGTH')
-    if max_size and max_size > 0:
-        if max_size >= 1024 * 1024:
-            human_size = f"{max_size / (1024 * 1024):.1f} MB"
+    if enabled:
+        if max_size and max_size > 0:
+            if max_size >= 1024 * 1024:
+                human_size = f"{max_size / (1024 * 1024):.1f} MB"
+            else:
+                human_size = f"{max_size / 1024:.0f} KB"
         else:
-            human_size = f"{max_size / 1024:.0f} KB"
-    else:
-        human_size = None
-    config.update({
-        'presign_url': url_for('create_direct_oss_upload'),
-        'verify_url': url_for('verify_direct_oss_upload'),
-        'max_size': max_size,
-        'max_size_label': human_size,
-        'storage': 'oss'
-    })
+            human_size = None
+        config.update({
+            'presign_url': url_for('create_direct_oss_upload'),
+            'verify_url': url_for('verify_direct_oss_upload'),
+            'max_size': max_size,
+            'max_size_label': human_size,
+            'storage': 'oss'
+        })
+    _direct_upload_config_cache[cache_key] = config
     return config
 
 # 数据模型定义
@@ -2629,7 +3321,7 @@ class Member(UserMixin, db.Model):
     photo = db.Column(db.String(200))                            # 头像图片路径
     notes = db.Column(db.Text)                                   # 备注/个人展示板
     feedback_log = db.Column(db.Text, default='')                # 他人评价/留言流（JSON lines）
-    last_modified = db.Column(db.DateTime, default=datetime.utcnow)  # 最后修改时间
+    last_modified = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # 最后修改时间
     # 关系：成员负责的物品，以及发送/收到的消息和日志
     items = db.relationship(
         'Item',
@@ -2677,7 +3369,7 @@ class Item(db.Model):
     unit = db.Column(db.String(20))                # ✅ 单位（例如：瓶、包）
     purchase_date = db.Column(db.Date)             # ✅ 购入时间
     notes = db.Column(db.Text)                          # 备注说明
-    last_modified = db.Column(db.DateTime, default=datetime.utcnow)  # 最后修改时间
+    last_modified = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # 最后修改时间
     purchase_link = db.Column(db.String(200), default='')           # 购买链接
     # 多对多：一个物品可出现在多个位置
     locations = db.relationship(
@@ -2734,11 +3426,10 @@ class Item(db.Model):
 
     @property
     def primary_responsible(self):
-        members = list(self.responsible_members or [])
+        members = self.responsible_members
         if not members:
             return None
-        members.sort(key=_member_display_key)
-        return members[0]
+        return min(members, key=_member_display_key)
 
     def __repr__(self):
         return f'<Item {self.name}>'
@@ -2751,6 +3442,7 @@ class Location(db.Model):
     status = db.Column(db.String(20))
     latitude = db.Column(db.Float, index=True)
     longitude = db.Column(db.Float, index=True)
+    geohash = db.Column(db.String(12), index=True)       # 由经纬度派生的空间索引键
     coordinate_source = db.Column(db.String(20))
     children = db.relationship('Location',
                             backref=db.backref('parent', remote_side=[id]),
@@ -2760,7 +3452,7 @@ class Location(db.Model):
     notes = db.Column(db.Text)                          # 备注（纯文本）
     is_public = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
     detail_refs_raw = db.Column('detail_refs', db.Text)  # 参考信息集合（字符串）
-    last_modified = db.Column(db.DateTime, default=datetime.utcnow)  # 最后修改时间
+    last_modified = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # 最后修改时间
     logs = db.relationship('Log', backref='location', lazy=True)     # 操作日志
     detail_link = db.Column(db.String(200))
 
@@ -2801,6 +3493,11 @@ class Location(db.Model):
     def detail_refs_without_usage_tags(self):
         return _strip_usage_tag_refs(self.detail_refs)
 
+    def refresh_geohash(self):
+        """Recompute the geohash index key from latitude/longitude."""
+        self.geohash = _geohash_encode(self.latitude, self.longitude)
+        return self.geohash
+
     def __repr__(self):
         return f'<Location {self.name}>'
 # 多对多：位置-成员负责人表
@@ -2820,25 +3517,393 @@ class Log(db.Model):
     event_id = db.Column(db.Integer, db.ForeignKey('events.id'), nullable=True)
     action_type = db.Column(db.String(50))       # 操作类型描述（如 新增物品/修改位置 等）
     details = db.Column(db.Text)                 # 详情备注
+    # 时间线与通知都是“某实体按时间倒序”的访问模式，复合索引让其只扫描命中的尾部
+    __table_args__ = (
+        db.Index('ix_logs_timestamp', 'timestamp'),
+        db.Index('ix_logs_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_logs_item_timestamp', 'item_id', 'timestamp'),
+        db.Index('ix_logs_location_timestamp', 'location_id', 'timestamp'),
+        db.Index('ix_logs_event_timestamp', 'event_id', 'timestamp'),
+    )
+
     def __repr__(self):
         return f'<Log {self.action_type} by {self.user_id}>'
 
-class Message(db.Model):
-    __tablename__ = 'messages'
+
+class LogArchive(db.Model):
+    """Cold storage for logs older than LOG_ARCHIVE_AFTER_DAYS (same columns, ids preserved).
+
+    No foreign keys: archived rows may outlive the entities they mention.
+    """
+    __tablename__ = 'logs_archive'
     id = db.Column(db.Integer, primary_key=True)
-    sender_id = db.Column(db.Integer, db.ForeignKey('members.id'))    # 发送者用户ID
-    receiver_id = db.Column(db.Integer, db.ForeignKey('members.id'))  # 接收者用户ID
-    content = db.Column(db.Text, nullable=False)     # 留言内容
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)  # 留言时间
+    timestamp = db.Column(db.DateTime)
+    user_id = db.Column(db.Integer)
+    item_id = db.Column(db.Integer)
+    location_id = db.Column(db.Integer)
+    event_id = db.Column(db.Integer)
+    action_type = db.Column(db.String(50))
+    details = db.Column(db.Text)
+    __table_args__ = (
+        db.Index('ix_logs_archive_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_logs_archive_item_timestamp', 'item_id', 'timestamp'),
+        db.Index('ix_logs_archive_location_timestamp', 'location_id', 'timestamp'),
+        db.Index('ix_logs_archive_event_timestamp', 'event_id', 'timestamp'),
+    )
+
     def __repr__(self):
-        return f'<Message from {self.sender_id} to {self.receiver_id}>'
+        return f'<LogArchive {self.action_type} by {self.user_id}>'
 
+class Notification(db.Model):
+    """Per-member inbox row, fanned out when a Log touches an item/location they are responsible for.
 
-class EventParticipant(db.Model):
-    __tablename__ = 'event_participants'
-    event_id = db.Column(db.Integer, db.ForeignKey('events.id'), primary_key=True)
-    member_id = db.Column(db.Integer, db.ForeignKey('members.id'), primary_key=True)
-    role = db.Column(db.String(20), default='participant', nullable=False)
+    Log fields are copied so the inbox stays readable after the log is archived
+    and the item/location is deleted; the relationships are view-only for templates.
+    """
+    __tablename__ = 'notifications'
+    id = db.Column(db.Integer, primary_key=True)
+    member_id = db.Column(db.Integer, db.ForeignKey('members.id'), nullable=False)  # 接收人
+    log_id = db.Column(db.Integer)                                                  # 来源日志（可能已归档）
+    user_id = db.Column(db.Integer)                                                 # 操作人
+    item_id = db.Column(db.Integer)
+    location_id = db.Column(db.Integer)
+    event_id = db.Column(db.Integer)
+    action_type = db.Column(db.String(50))
+    details = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    read_at = db.Column(db.DateTime)
+    user = db.relationship('Member', primaryjoin='foreign(Notification.user_id) == Member.id', viewonly=True)
+    item = db.relationship('Item', primaryjoin='foreign(Notification.item_id) == Item.id', viewonly=True)
+    location = db.relationship('Location', primaryjoin='foreign(Notification.location_id) == Location.id', viewonly=True)
+    event = db.relationship('Event', primaryjoin='foreign(Notification.event_id) == Event.id', viewonly=True)
+    __table_args__ = (
+        db.Index('ix_notifications_member_timestamp', 'member_id', 'timestamp'),
+        db.Index('ix_notifications_member_read', 'member_id', 'read_at'),
+    )
+
+    def __repr__(self):
+        return f'<Notification {self.action_type} for {self.member_id}>'
+
+
+_NOTIFICATION_LOG_FIELDS = ('user_id', 'item_id', 'location_id', 'event_id', 'action_type', 'details')
+
+
+def _insert_notifications_for_logs(connection, log_rows):
+    """Fan out log rows (dicts with id/timestamp and Log columns) to responsible members.
+
+    Recipients are resolved with one query per association table for the whole
+    batch; the actor never notifies themselves.
+    """
+    item_ids = {row['item_id'] for row in log_rows if row.get('item_id')}
+    location_ids = {row['location_id'] for row in log_rows if row.get('location_id')}
+    if not item_ids and not location_ids:
+        return 0
+    item_owners = {}
+    if item_ids:
+        for item_id, member_id in connection.execute(
+            db.select(item_members.c.item_id, item_members.c.member_id)
+            .where(item_members.c.item_id.in_(item_ids))
+        ):
+            item_owners.setdefault(item_id, set()).add(member_id)
+    location_owners = {}
+    if location_ids:
+        for location_id, member_id in connection.execute(
+            db.select(location_members.c.location_id, location_members.c.member_id)
+            .where(location_members.c.location_id.in_(location_ids))
+        ):
+            location_owners.setdefault(location_id, set()).add(member_id)
+    notifications = []
+    for row in log_rows:
+        recipients = set(item_owners.get(row.get('item_id'), ()))
+        recipients |= location_owners.get(row.get('location_id'), set())
+        recipients.discard(row.get('user_id'))
+        for member_id in sorted(recipients):
+            entry = {field: row.get(field) for field in _NOTIFICATION_LOG_FIELDS}
+            entry.update({
+                'member_id': member_id,
+                'log_id': row.get('id'),
+                'timestamp': row.get('timestamp') or datetime.utcnow(),
+                'read_at': None,
+            })
+            notifications.append(entry)
+    if notifications:
+        connection.execute(Notification.__table__.insert(), notifications)
+    return len(notifications)
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def _fan_out_log_notifications(session, flush_context):
+    new_logs = [obj for obj in session.new if isinstance(obj, Log)]
+    if not new_logs:
+        return
+    rows = []
+    for log in new_logs:
+        row = {field: getattr(log, field) for field in _NOTIFICATION_LOG_FIELDS}
+        row.update({'id': log.id, 'timestamp': log.timestamp})
+        rows.append(row)
+    _insert_notifications_for_logs(session.connection(), rows)
+
+
+# ---------------------------------------------------------------------------
+# 审计日志异步写入：提交后的日志先追加到本进程的 JSONL 暂存文件，再由后台线程批量入库
+# ---------------------------------------------------------------------------
+_AUDIT_PENDING_KEY = '_pending_audit_logs'
+_AUDIT_LOG_FIELDS = ('user_id', 'item_id', 'location_id', 'event_id', 'action_type', 'details')
+# 无 flock 时，超过该时长未更新的其他进程暂存文件视为遗留
+_AUDIT_SPOOL_ORPHAN_SECONDS = 600
+
+
+class _AuditLogWriter:
+    """Buffer committed audit-log records and bulk-insert them from a flusher thread.
+
+    Every record is appended to a per-process JSONL spool segment before it is
+    buffered, and a segment is deleted only after its records are committed, so
+    records survive a crash and are replayed on the next start. Delivery is
+    at-least-once: a crash between the insert and the unlink replays a segment.
+    """
+
+    def __init__(self, spool_dir, batch_size, interval_seconds, fsync=False):
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = []
+        self._segment = None
+        self._unflushed_segments = []
+        self._thread = None
+
+    def _open_segment(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = os.path.join(self.spool_dir, f'{os.getpid()}-{time.time_ns()}.jsonl')
+        handle = open(path, 'a', encoding='utf-8')
+        if fcntl:
+            # 持有期间其他进程的回放会跳过该文件
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return path, handle
+
+    def owns(self, path):
+        with self._lock:
+            segments = list(self._unflushed_segments) + ([self._segment] if self._segment else [])
+        return any(os.path.abspath(seg_path) == os.path.abspath(path) for seg_path, _handle in segments)
+
+    def enqueue(self, records):
+        if not records:
+            return
+        with self._lock:
+            if self._segment is None:
+                self._segment = self._open_segment()
+            handle = self._segment[1]
+            for record in records:
+                handle.write(json.dumps(_audit_record_to_json(record), ensure_ascii=False) + '\n')
+            handle.flush()
+            if self.fsync:
+                os.fsync(handle.fileno())
+            self._pending.extend(records)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='audit-log-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as exc:
+                app.logger.warning('审计日志写入失败，稍后重试: %s', exc)
+
+    def flush(self):
+        """Insert everything buffered so far; returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                records, self._pending = self._pending, []
+                if self._segment is not None:
+                    self._unflushed_segments.append(self._segment)
+                    self._segment = None
+                segments = list(self._unflushed_segments)
+            if not records:
+                return 0
+            try:
+                with app.app_context():
+                    try:
+                        _bulk_insert_logs(records)
+                        db.session.commit()
+                    except Exception:
+                        db.session.rollback()
+                        raise
+                    finally:
+                        db.session.remove()
+            except Exception:
+                # 暂存文件保留，记录放回缓冲区等待下一轮
+                with self._lock:
+                    self._pending[:0] = records
+                raise
+            with self._lock:
+                self._unflushed_segments = [seg for seg in self._unflushed_segments if seg not in segments]
+            for path, handle in segments:
+                handle.close()
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+            return len(records)
+
+
+def _audit_record_to_json(record):
+    data = {field: record.get(field) for field in _AUDIT_LOG_FIELDS}
+    data['timestamp'] = record['timestamp'].isoformat() if record.get('timestamp') else None
+    return data
+
+
+def _audit_record_from_json(data):
+    record = {field: data.get(field) for field in _AUDIT_LOG_FIELDS}
+    record['timestamp'] = datetime.fromisoformat(data['timestamp']) if data.get('timestamp') else datetime.utcnow()
+    return record
+
+
+_audit_log_writer = (
+    _AuditLogWriter(
+        app.config['AUDIT_LOG_SPOOL_DIR'],
+        app.config['AUDIT_LOG_BATCH_SIZE'],
+        app.config['AUDIT_LOG_FLUSH_INTERVAL_MS'] / 1000,
+        fsync=app.config['AUDIT_LOG_SPOOL_FSYNC']
+    )
+    if app.config['AUDIT_LOG_ASYNC'] else None
+)
+if _audit_log_writer is not None:
+    # 正常退出时把缓冲区写完；异常退出则由下次启动回放暂存文件
+    atexit.register(lambda: _audit_log_writer.flush())
+
+
+def record_log(**fields):
+    """Record an audit Log row that is written once the current transaction commits.
+
+    With AUDIT_LOG_ASYNC off the row is simply added to the session. Otherwise
+    it is held on the session and handed to the background writer after commit,
+    so a rolled-back request never logs and the hot path skips the Log insert.
+    """
+    fields.setdefault('timestamp', datetime.utcnow())
+    if _audit_log_writer is None:
+        db.session.add(Log(**fields))
+        return
+    db.session.info.setdefault(_AUDIT_PENDING_KEY, []).append(fields)
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def _enqueue_committed_audit_logs(session):
+    records = session.info.pop(_AUDIT_PENDING_KEY, None)
+    if records and _audit_log_writer is not None:
+        _audit_log_writer.enqueue(records)
+
+
+@event.listens_for(OrmSession, 'after_soft_rollback')
+def _discard_rolled_back_audit_logs(session, previous_transaction):
+    # SAVEPOINT 回滚由调用方（写队列）自行截断；这里只处理整个事务的回滚
+    if not previous_transaction.nested:
+        session.info.pop(_AUDIT_PENDING_KEY, None)
+
+
+def replay_audit_spool():
+    """Insert records from spool segments left behind by crashed processes.
+
+    A segment is replayed only when no live process holds its lock (or, without
+    flock support, when it has not been touched for a while). Returns the number
+    of log rows restored.
+    """
+    spool_dir = app.config['AUDIT_LOG_SPOOL_DIR']
+    if not os.path.isdir(spool_dir):
+        return 0
+    restored = 0
+    for path in sorted(glob.glob(os.path.join(spool_dir, '*.jsonl'))):
+        if _audit_log_writer is not None and _audit_log_writer.owns(path):
+            continue
+        try:
+            handle = open(path, 'r+', encoding='utf-8')
+        except OSError:
+            continue
+        with handle:
+            if fcntl:
+                try:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+            elif time.time() - os.path.getmtime(path) < _AUDIT_SPOOL_ORPHAN_SECONDS:
+                continue
+            records = []
+            for line in handle:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(_audit_record_from_json(json.loads(line)))
+                except (ValueError, TypeError):
+                    # 崩溃时写了一半的末行
+                    continue
+            if records:
+                try:
+                    _bulk_insert_logs(records)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+            restored += len(records)
+        with contextlib.suppress(OSError):
+            os.remove(path)
+    return restored
+
+
+class CacheVersion(db.Model):
+    """Generation counters shared by all workers for process-level caches."""
+    __tablename__ = 'cache_versions'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
+
+
+@event.listens_for(OrmSession, 'before_flush')
+def _invalidate_member_lookup_on_change(session, flush_context, instances):
+    changed = any(isinstance(obj, Member) for obj in session.new) or any(
+        isinstance(obj, Member) for obj in session.deleted
+    )
+    if not changed:
+        for obj in session.dirty:
+            if not isinstance(obj, Member):
+                continue
+            state = inspect(obj)
+            if state.attrs.name.history.has_changes() or state.attrs.username.history.has_changes():
+                changed = True
+                break
+    if changed:
+        _bump_cache_version(session.connection(), _MEMBER_LOOKUP_CACHE_KEY)
+
+
+class Message(db.Model):
+    __tablename__ = 'messages'
+    id = db.Column(db.Integer, primary_key=True)
+    sender_id = db.Column(db.Integer, db.ForeignKey('members.id'))    # 发送者用户ID
+    receiver_id = db.Column(db.Integer, db.ForeignKey('members.id'))  # 接收者用户ID
+    content = db.Column(db.Text, nullable=False)     # 留言内容
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)  # 留言时间
+    def __repr__(self):
+        return f'<Message from {self.sender_id} to {self.receiver_id}>'
+
+
+class EventParticipant(db.Model):
+    __tablename__ = 'event_participants'
+    event_id = db.Column(db.Integer, db.ForeignKey('events.id'), primary_key=True)
+    member_id = db.Column(db.Integer, db.ForeignKey('members.id'), primary_key=True)
+    role = db.Column(db.String(20), default='participant', nullable=False)
     status = db.Column(db.String(20), default='confirmed', nullable=False)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -2861,8 +3926,10 @@ class Event(db.Model):
     detail_link = db.Column(db.String(255))
     feedback_log = db.Column(db.Text, default='')
     allow_participant_edit = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+    recurrence_rule = db.Column(db.String(200))                 # RRULE 子集，如 FREQ=WEEKLY;BYDAY=MO,TH
+    recurrence_until = db.Column(db.DateTime, index=True)       # 系列最后一次开始时间（无限重复为空）
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     owner = db.relationship('Member', backref=db.backref('events_owned', lazy='dynamic'))
     participant_links = db.relationship(
@@ -2878,6 +3945,23 @@ class Event(db.Model):
         lazy='select',
         backref=db.backref('events_participating', lazy='select')
     )
+    reservations = db.relationship(
+        'Reservation',
+        back_populates='event',
+        cascade='all, delete-orphan',
+        lazy='select'
+    )
+    occurrence_overrides = db.relationship(
+        'EventOccurrenceOverride',
+        back_populates='event',
+        cascade='all, delete-orphan',
+        lazy='select'
+    )
+    # 日历/列表按时间窗口查询，复合索引同时覆盖可见性过滤
+    __table_args__ = (
+        db.Index('ix_events_start_visibility', 'start_time', 'visibility'),
+    )
+
     items = db.relationship(
         'Item',
         secondary=event_items,
@@ -2905,6 +3989,14 @@ class Event(db.Model):
     def attachment_filenames(self):
         return [att.filename for att in self.attachments if att.filename]
 
+    def _has_member(self, member):
+        member_id = getattr(member, 'id', None)
+        if member_id is None:
+            return False
+        if self.id is None or not has_request_context():
+            return any(link.member_id == member_id for link in self.participant_links)
+        return self.id in _member_event_ids(member_id)
+
     def can_view(self, member):
         if self.visibility == 'public':
             return True
@@ -2912,7 +4004,7 @@ class Event(db.Model):
             return False
         if member.id == self.owner_id:
             return True
-        return any(link.member_id == member.id for link in self.participant_links)
+        return self._has_member(member)
 
     def can_edit(self, member):
         if not member:
@@ -2921,7 +4013,7 @@ class Event(db.Model):
             return True
         allow_edit = getattr(self, 'allow_participant_edit', False)
         if self.visibility == 'internal' and allow_edit:
-            return any(link.member_id == member.id for link in self.participant_links)
+            return self._has_member(member)
         return False
 
     def can_join(self, member):
@@ -2929,12 +4021,16 @@ class Event(db.Model):
             return False
         if self.visibility != 'public':
             return False
-        return all(link.member_id != member.id for link in self.participant_links)
+        return not self._has_member(member)
 
     def is_participant(self, member):
         if not member:
             return False
-        return any(link.member_id == member.id for link in self.participant_links)
+        return self._has_member(member)
+
+    @property
+    def is_recurring(self):
+        return bool(self.recurrence_rule and self.start_time)
 
     def touch(self):
         self.updated_at = datetime.utcnow()
@@ -2946,6 +4042,48 @@ class Event(db.Model):
         return f'<Event {self.id} {self.title}>'
 
 
+def _member_event_ids(member_id):
+    """Return the IDs of events a member participates in, cached for the current request.
+
+    One query replaces the per-event scans of participant_links done by the
+    Event permission helpers; the cache is dropped whenever a flush touches
+    event_participants.
+    """
+    cache = g.setdefault('_event_membership_sets', {})
+    event_ids = cache.get(member_id)
+    if event_ids is None:
+        table = EventParticipant.__table__
+        event_ids = frozenset(
+            db.session.execute(
+                db.select(table.c.event_id).where(table.c.member_id == member_id)
+            ).scalars()
+        )
+        cache[member_id] = event_ids
+    return event_ids
+
+
+def _event_visibility_clause(member_id):
+    """SQL filter matching events the member may view (mirrors Event.can_view)."""
+    participant_table = EventParticipant.__table__
+    return or_(
+        Event.visibility == 'public',
+        Event.owner_id == member_id,
+        Event.id.in_(
+            db.select(participant_table.c.event_id).where(participant_table.c.member_id == member_id)
+        )
+    )
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def _invalidate_event_membership_sets(session, flush_context):
+    if not has_request_context() or '_event_membership_sets' not in g:
+        return
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, EventParticipant):
+            g.pop('_event_membership_sets', None)
+            return
+
+
 def parse_datetime_local(raw_value):
     if not raw_value:
         return None
@@ -3048,22 +4186,21 @@ def grant_internal_event_access(event, member, source='share-link'):
         EventParticipant(member_id=member.id, role='participant', status='confirmed')
     )
     event.touch()
-    log = Log(
+    record_log(
         user_id=member.id,
         event_id=event.id,
         action_type="扫码加入事项",
         details=f"Auto-joined via {source}"
     )
-    db.session.add(log)
     db.session.commit()
     return True
 
 
 def add_event_attachments(event, file_storages):
-    for attachment_file in file_storages:
-        stored_name = save_uploaded_media(attachment_file)
-        if stored_name:
-            event.attachments.append(Attachment(filename=stored_name))
+    stored_names, failures = save_uploaded_media_batch(file_storages)
+    for stored_name in stored_names:
+        event.attachments.append(Attachment(filename=stored_name))
+    _flash_upload_failures(failures)
 
 
 class Attachment(db.Model):
@@ -3090,128 +4227,1313 @@ class Attachment(db.Model):
         return f'<Attachment {self.filename}>'
 
 
-def _inspector_column_names(inspector, table_name):
-    try:
-        return {col['name'] for col in inspector.get_columns(table_name)}
-    except Exception:
-        return set()
+class AttachmentDeletion(db.Model):
+    """Durable queue of stored files to delete, drained by a background worker.
 
+    Rows are written in the same transaction that drops the attachment, so a
+    file is never orphaned by a crash between commit and delete. Rows whose
+    attempts are exhausted stay with dead_at set until retried by hand.
+    """
+    __tablename__ = 'attachment_deletions'
+    id = db.Column(db.Integer, primary_key=True)
+    ref = db.Column(db.String(255), nullable=False)             # 本地相对路径或 OSS 对象键
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    dead_at = db.Column(db.DateTime)                            # 超过重试次数后进入死信
 
-def _migrate_legacy_attachments(inspector, table_names):
-    """Migrate legacy media columns/tables into the unified attachments table.
+    __table_args__ = (
+        db.Index('ix_attachment_deletions_due', 'dead_at', 'next_attempt_at'),
+    )
 
-    Target ordering is "first uploaded first shown", so we preserve legacy table `id` ordering when migrating.
-    """
-    if 'attachments' not in (table_names or []):
-        return
+    def __repr__(self):
+        return f'<AttachmentDeletion {self.ref}>'
 
-    try:
-        existing_items = set()
-        existing_locations = set()
-        existing_events = set()
-        for item_id, filename in (
-            db.session.query(Attachment.item_id, Attachment.filename)
-            .filter(Attachment.item_id.isnot(None), Attachment.filename.isnot(None), Attachment.filename != '')
-            .all()
-        ):
-            existing_items.add((int(item_id), filename))
-        for location_id, filename in (
-            db.session.query(Attachment.location_id, Attachment.filename)
-            .filter(Attachment.location_id.isnot(None), Attachment.filename.isnot(None), Attachment.filename != '')
-            .all()
-        ):
-            existing_locations.add((int(location_id), filename))
-        for event_id, filename in (
-            db.session.query(Attachment.event_id, Attachment.filename)
-            .filter(Attachment.event_id.isnot(None), Attachment.filename.isnot(None), Attachment.filename != '')
-            .all()
-        ):
-            existing_events.add((int(event_id), filename))
 
-        sources = {}
-        inserted = 0
+class EventOccurrenceOverride(db.Model):
+    """Per-occurrence exception of a recurring event: cancelled or moved/renamed."""
+    __tablename__ = 'event_occurrence_overrides'
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('events.id'), nullable=False)
+    original_start = db.Column(db.DateTime, nullable=False)     # 按规则推算出的原开始时间
+    cancelled = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+    start_time = db.Column(db.DateTime)                         # 调整后的时间（为空表示沿用原时间）
+    end_time = db.Column(db.DateTime)
+    title = db.Column(db.String(150))
 
-        def get_source(name, owner_field):
-            entry = sources.get(name)
-            if entry is None:
-                entry = {'ok': False, 'owner_field': owner_field, 'keys': set()}
-                sources[name] = entry
-            entry['owner_field'] = owner_field
-            return entry
+    __table_args__ = (
+        db.UniqueConstraint('event_id', 'original_start', name='uq_event_occurrence_override'),
+    )
 
-        def normalize_key(owner_id, filename):
-            if owner_id is None or filename is None:
-                return None
-            try:
-                owner_id_int = int(owner_id)
-            except (TypeError, ValueError):
-                return None
-            fname = _ensure_string(filename).strip()
-            if not fname:
-                return None
-            return owner_id_int, fname
+    event = db.relationship('Event', back_populates='occurrence_overrides')
 
-        def normalize_created_at(value):
-            if not value:
-                return None
-            if isinstance(value, datetime):
-                return value
-            token = _ensure_string(value).strip()
-            if not token:
-                return None
-            token = token.replace('T', ' ')
-            if token.endswith('Z'):
-                token = token[:-1]
+    def __repr__(self):
+        return f'<EventOccurrenceOverride event={self.event_id} {self.original_start}>'
+
+
+# ---------------------------------------------------------------------------
+# 重复事项：事项只存一行规则，按需在时间窗口内展开为具体场次
+# ---------------------------------------------------------------------------
+_RECURRENCE_FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY')
+_RECURRENCE_FREQUENCY_LABELS = {'DAILY': '天', 'WEEKLY': '周', 'MONTHLY': '月'}
+_RECURRENCE_WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+_RECURRENCE_WEEKDAY_LABELS = ('一', '二', '三', '四', '五', '六', '日')
+_RECURRENCE_MAX_COUNT = 1000
+# 单次展开最多返回的场次，防止超大窗口拖垮请求
+_RECURRENCE_MAX_EXPANSION = 2000
+# 未设置结束时间的事项，每场按该时长计算重叠
+_OCCURRENCE_DEFAULT_DURATION = timedelta(hours=1)
+# 保存重复事项时检查资源冲突的时间范围
+_RECURRENCE_CONFLICT_HORIZON_DAYS = 90
+
+RecurrenceRule = namedtuple('RecurrenceRule', 'freq interval weekdays count until')
+EventOccurrence = namedtuple('EventOccurrence', 'event start_time end_time original_start title')
+
+
+def parse_recurrence_rule(raw):
+    """Parse the supported RRULE subset (FREQ, INTERVAL, BYDAY, COUNT, UNTIL).
+
+    Returns None for an empty rule and raises ValueError with a user-facing
+    message for anything unsupported.
+    """
+    text_value = _ensure_string(raw).strip()
+    if not text_value:
+        return None
+    if text_value.upper().startswith('RRULE:'):
+        text_value = text_value[6:]
+    parts = {}
+    for chunk in text_value.split(';'):
+        if not chunk.strip():
+            continue
+        key, sep, value = chunk.partition('=')
+        if not sep:
+            raise ValueError(f'无法解析重复规则片段：{chunk}')
+        parts[key.strip().upper()] = value.strip().upper()
+    unknown = set(parts) - {'FREQ', 'INTERVAL', 'BYDAY', 'COUNT', 'UNTIL'}
+    if unknown:
+        raise ValueError('暂不支持的重复规则字段：' + '、'.join(sorted(unknown)))
+    freq = parts.get('FREQ')
+    if freq not in _RECURRENCE_FREQUENCIES:
+        raise ValueError('重复频率仅支持每天、每周或每月')
+    try:
+        interval = int(parts.get('INTERVAL') or 1)
+        count = int(parts['COUNT']) if parts.get('COUNT') else None
+    except ValueError:
+        raise ValueError('重复间隔与次数必须是整数')
+    if interval < 1 or interval > 366:
+        raise ValueError('重复间隔需在 1 到 366 之间')
+    if count is not None and not 1 <= count <= _RECURRENCE_MAX_COUNT:
+        raise ValueError(f'重复次数需在 1 到 {_RECURRENCE_MAX_COUNT} 之间')
+    weekdays = ()
+    if parts.get('BYDAY'):
+        if freq != 'WEEKLY':
+            raise ValueError('仅每周重复可以指定星期')
+        tokens = [token.strip() for token in parts['BYDAY'].split(',') if token.strip()]
+        if any(token not in _RECURRENCE_WEEKDAYS for token in tokens):
+            raise ValueError('星期需为 MO/TU/WE/TH/FR/SA/SU')
+        weekdays = tuple(sorted({_RECURRENCE_WEEKDAYS.index(token) for token in tokens}))
+    until = None
+    if parts.get('UNTIL'):
+        raw_until = parts['UNTIL'].rstrip('Z')
+        for fmt in ('%Y%m%dT%H%M%S', '%Y%m%d'):
             try:
-                return datetime.fromisoformat(token)
+                until = datetime.strptime(raw_until, fmt)
+                break
             except ValueError:
-                return None
+                continue
+        if until is None:
+            raise ValueError('UNTIL 需为 YYYYMMDD 或 YYYYMMDDTHHMMSSZ')
+        if fmt == '%Y%m%d':
+            until = until.replace(hour=23, minute=59, second=59)
+    return RecurrenceRule(freq, interval, weekdays, count, until)
+
+
+def format_recurrence_rule(rule):
+    parts = [f'FREQ={rule.freq}']
+    if rule.interval != 1:
+        parts.append(f'INTERVAL={rule.interval}')
+    if rule.weekdays:
+        parts.append('BYDAY=' + ','.join(_RECURRENCE_WEEKDAYS[day] for day in rule.weekdays))
+    if rule.count:
+        parts.append(f'COUNT={rule.count}')
+    if rule.until:
+        parts.append('UNTIL=' + rule.until.strftime('%Y%m%dT%H%M%SZ'))
+    return ';'.join(parts)
+
+
+def describe_recurrence(raw):
+    """Human readable summary such as “每 2 周（一、四），共 10 次”."""
+    try:
+        rule = parse_recurrence_rule(raw)
+    except ValueError:
+        return ''
+    if rule is None:
+        return ''
+    unit = _RECURRENCE_FREQUENCY_LABELS[rule.freq]
+    label = f'每{unit}' if rule.interval == 1 else f'每 {rule.interval} {unit}'
+    if rule.weekdays:
+        label += '（' + '、'.join(_RECURRENCE_WEEKDAY_LABELS[day] for day in rule.weekdays) + '）'
+    if rule.count:
+        label += f'，共 {rule.count} 次'
+    if rule.until:
+        label += f"，至 {rule.until.strftime('%Y-%m-%d')}"
+    return label
 
-        def insert(owner_field, key, created_at=None):
-            nonlocal inserted
-            if not key:
+
+app.jinja_env.filters['recurrence_label'] = describe_recurrence
+
+
+def _add_months(value, months):
+    """Shift by whole months; returns None when the day does not exist (e.g. 31st)."""
+    month_index = value.month - 1 + months
+    year = value.year + month_index // 12
+    month = month_index % 12 + 1
+    try:
+        return value.replace(year=year, month=month)
+    except ValueError:
+        return None
+
+
+def iter_occurrence_starts(dtstart, rule, window_start=None, window_end=None):
+    """Yield occurrence start times in [window_start, window_end) in order.
+
+    Daily/weekly series jump straight to the window arithmetically, so the cost
+    depends on the window size, not on how long the series has been running.
+    COUNT and UNTIL are honoured exactly.
+    """
+    if dtstart is None or rule is None:
+        return
+    lower = window_start or dtstart
+    if rule.freq == 'DAILY':
+        step = timedelta(days=rule.interval)
+        index = max(0, (lower - dtstart) // step - 1) if lower > dtstart else 0
+        while True:
+            if rule.count is not None and index >= rule.count:
                 return
-            owner_id_int, fname = key
-            if owner_field == 'item_id':
-                if key in existing_items:
+            start = dtstart + step * index
+            if (rule.until and start > rule.until) or (window_end and start >= window_end):
+                return
+            index += 1
+            if start >= lower:
+                yield start
+    elif rule.freq == 'WEEKLY':
+        weekdays = rule.weekdays or (dtstart.weekday(),)
+        week_zero = dtstart - timedelta(days=dtstart.weekday())
+        period = timedelta(weeks=rule.interval)
+        skipped_in_first = sum(1 for day in weekdays if day < dtstart.weekday())
+        period_index = max(0, (lower - week_zero) // period - 1) if lower > week_zero else 0
+        emitted = period_index * len(weekdays) - skipped_in_first if period_index else 0
+        while True:
+            week_start = week_zero + period * period_index
+            for day in weekdays:
+                start = week_start + timedelta(days=day)
+                if start < dtstart:
+                    continue
+                if rule.count is not None and emitted >= rule.count:
                     return
-                att = Attachment(item_id=owner_id_int, filename=fname)
-                existing_items.add(key)
-            elif owner_field == 'location_id':
-                if key in existing_locations:
+                if (rule.until and start > rule.until) or (window_end and start >= window_end):
                     return
-                att = Attachment(location_id=owner_id_int, filename=fname)
-                existing_locations.add(key)
-            elif owner_field == 'event_id':
-                if key in existing_events:
+                emitted += 1
+                if start >= lower:
+                    yield start
+            period_index += 1
+    else:
+        months = 0
+        emitted = 0
+        if rule.count is None and lower > dtstart:
+            # 无 COUNT 时可直接跳到窗口附近的月份
+            months = max(0, ((lower.year - dtstart.year) * 12 + lower.month - dtstart.month - 1)
+                         // rule.interval * rule.interval)
+        while True:
+            start = _add_months(dtstart, months)
+            months += rule.interval
+            if start is None:
+                if months > (_RECURRENCE_MAX_COUNT + 1) * 12:
                     return
-                att = Attachment(event_id=owner_id_int, filename=fname)
-                existing_events.add(key)
-            else:
+                continue
+            if rule.count is not None and emitted >= rule.count:
+                return
+            if (rule.until and start > rule.until) or (window_end and start >= window_end):
                 return
+            emitted += 1
+            if start >= lower:
+                yield start
+
+
+def _recurrence_last_start(dtstart, rule):
+    """Last occurrence start of a finite series; None when it repeats forever."""
+    if rule is None:
+        return dtstart
+    if rule.count is None:
+        return rule.until
+    last = None
+    for last in iter_occurrence_starts(dtstart, rule):
+        pass
+    return last
 
-            normalized = normalize_created_at(created_at)
-            if normalized:
-                att.created_at = normalized
-            db.session.add(att)
-            inserted += 1
 
-        def migrate_table(table_name, owner_field):
-            if table_name not in table_names:
-                return
-            cols = _inspector_column_names(inspector, table_name)
-            if 'filename' not in cols or owner_field not in cols:
-                return
-            source = get_source(table_name, owner_field)
-            has_created_at = 'created_at' in cols
-            select_cols = f"{owner_field}, filename" + (", created_at" if has_created_at else "")
-            try:
-                rows = db.session.execute(
-                    text(
-                        f"SELECT {select_cols} FROM {table_name} "
-                        "WHERE filename IS NOT NULL AND filename != '' "
-                        "ORDER BY id"
-                    )
+def apply_event_recurrence(event, rule):
+    """Store a parsed rule (or None) on the event, keeping recurrence_until in sync."""
+    if rule is None or not event.start_time:
+        event.recurrence_rule = None
+        event.recurrence_until = None
+        return
+    event.recurrence_rule = format_recurrence_rule(rule)
+    event.recurrence_until = _recurrence_last_start(event.start_time, rule)
+
+
+def _occurrence_duration(event):
+    if event.start_time and event.end_time and event.end_time > event.start_time:
+        return event.end_time - event.start_time
+    return _OCCURRENCE_DEFAULT_DURATION
+
+
+def _load_occurrence_overrides(event_ids, window_start, window_end):
+    """Overrides whose original or adjusted slot touches the window, keyed by event id."""
+    if not event_ids:
+        return {}
+    lookbehind = timedelta(days=_EVENT_RANGE_LOOKBEHIND_DAYS)
+    rows = EventOccurrenceOverride.query.filter(
+        EventOccurrenceOverride.event_id.in_(event_ids),
+        or_(
+            and_(
+                EventOccurrenceOverride.original_start >= window_start - lookbehind,
+                EventOccurrenceOverride.original_start < window_end
+            ),
+            and_(
+                EventOccurrenceOverride.start_time >= window_start - lookbehind,
+                EventOccurrenceOverride.start_time < window_end
+            )
+        )
+    ).all()
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row.event_id, {})[row.original_start] = row
+    return grouped
+
+
+def expand_event_occurrences(events, window_start, window_end):
+    """Expand events into EventOccurrence tuples overlapping [window_start, window_end).
+
+    One-off events yield at most one occurrence; recurring series are expanded
+    lazily with their per-occurrence overrides applied. Results are sorted by
+    start time and capped at _RECURRENCE_MAX_EXPANSION.
+    """
+    events = list(events)
+    overrides = _load_occurrence_overrides(
+        [ev.id for ev in events if ev.is_recurring], window_start, window_end
+    )
+    occurrences = []
+
+    def add(ev, start, end, original_start, title):
+        if start < window_end and end > window_start:
+            occurrences.append(EventOccurrence(ev, start, end, original_start, title))
+
+    for ev in events:
+        if not ev.start_time:
+            continue
+        duration = _occurrence_duration(ev)
+        if not ev.is_recurring:
+            add(ev, ev.start_time, ev.start_time + duration, ev.start_time, ev.title)
+            continue
+        try:
+            rule = parse_recurrence_rule(ev.recurrence_rule)
+        except ValueError:
+            continue
+        series_overrides = dict(overrides.get(ev.id, {}))
+        generated = 0
+        for start in iter_occurrence_starts(ev.start_time, rule, window_start - duration, window_end):
+            generated += 1
+            if generated > _RECURRENCE_MAX_EXPANSION:
+                break
+            override = series_overrides.pop(start, None)
+            if override is None:
+                add(ev, start, start + duration, start, ev.title)
+            elif not override.cancelled:
+                moved_start = override.start_time or start
+                add(ev, moved_start, override.end_time or moved_start + duration, start, override.title or ev.title)
+        # 原时间在窗口外、但被调整进窗口的场次
+        for original_start, override in series_overrides.items():
+            if override.cancelled or not override.start_time:
+                continue
+            if window_start - duration <= original_start < window_end:
+                continue
+            add(ev, override.start_time, override.end_time or override.start_time + duration,
+                original_start, override.title or ev.title)
+    occurrences.sort(key=lambda occurrence: (occurrence.start_time, occurrence.event.id))
+    return occurrences[:_RECURRENCE_MAX_EXPANSION]
+
+
+def event_occurrence_schedule(event, after=None, limit=8, horizon_days=_RECURRENCE_CONFLICT_HORIZON_DAYS):
+    """Upcoming occurrences of a series including cancelled ones, for the detail page."""
+    if not event.is_recurring:
+        return []
+    after = after or datetime.utcnow()
+    rule = parse_recurrence_rule(event.recurrence_rule)
+    window_end = after + timedelta(days=horizon_days)
+    duration = _occurrence_duration(event)
+    overrides = _load_occurrence_overrides([event.id], after - duration, window_end).get(event.id, {})
+    schedule = []
+    for start in iter_occurrence_starts(event.start_time, rule, after - duration, window_end):
+        if start + duration <= after:
+            continue
+        override = overrides.get(start)
+        moved_start = (override.start_time if override else None) or start
+        schedule.append({
+            'original_start': start,
+            'start_time': moved_start,
+            'end_time': (override.end_time if override else None) or moved_start + duration,
+            'title': (override.title if override else None) or event.title,
+            'cancelled': bool(override and override.cancelled),
+            'modified': override is not None and not override.cancelled,
+        })
+        if len(schedule) >= limit:
+            break
+    return schedule
+
+
+def _is_active_series(event, now):
+    return event.is_recurring and (event.recurrence_until is None or event.recurrence_until >= now)
+
+
+_RESERVATION_RESOURCE_TYPES = ('item', 'location')
+# 未填写结束时间的事项按该时长占用资源
+_RESERVATION_DEFAULT_DURATION = timedelta(hours=1)
+
+
+class Reservation(db.Model):
+    """Time interval during which an event occupies an item or location.
+
+    Rows are derived from events (start/end time plus linked items and
+    locations) by `_sync_event_reservations`; the composite index lets
+    overlap checks read only reservations ending after the window start.
+    """
+    __tablename__ = 'reservations'
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('events.id'), nullable=False, index=True)
+    resource_type = db.Column(db.String(20), nullable=False)   # item / location
+    resource_id = db.Column(db.Integer, nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_reservations_resource_end', 'resource_type', 'resource_id', 'end_time', 'start_time'),
+    )
+
+    event = db.relationship('Event', back_populates='reservations')
+
+    def __repr__(self):
+        return f'<Reservation {self.resource_type}:{self.resource_id} event={self.event_id}>'
+
+
+def _event_reservation_window(event):
+    if not event.start_time:
+        return None, None
+    end_time = event.end_time if event.end_time and event.end_time > event.start_time else None
+    return event.start_time, end_time or event.start_time + _RESERVATION_DEFAULT_DURATION
+
+
+def _event_resource_keys(event):
+    keys = [('item', item.id) for item in event.items]
+    keys += [('location', loc.id) for loc in event.locations]
+    return keys
+
+
+def _sync_event_reservations(event):
+    """Make event.reservations match the event's time window and linked resources.
+
+    Recurring events keep no reservation rows: their occurrences are expanded
+    on demand by _find_reservation_conflicts.
+    """
+    start_time, end_time = _event_reservation_window(event)
+    desired = set()
+    if start_time and not event.is_recurring:
+        desired.update(('item', item.id) for item in event.items)
+        desired.update(('location', loc.id) for loc in event.locations)
+    existing = {}
+    for reservation in list(event.reservations):
+        key = (reservation.resource_type, reservation.resource_id)
+        if key not in desired or key in existing:
+            event.reservations.remove(reservation)
+            continue
+        reservation.start_time = start_time
+        reservation.end_time = end_time
+        existing[key] = reservation
+    for resource_type, resource_id in desired - set(existing):
+        event.reservations.append(Reservation(
+            resource_type=resource_type,
+            resource_id=resource_id,
+            start_time=start_time,
+            end_time=end_time
+        ))
+
+
+ReservationSlot = namedtuple('ReservationSlot', 'event event_id resource_type resource_id start_time end_time')
+
+
+def _recurring_series_in_window(start_time, end_time):
+    """SQL filter for recurring series that may have occurrences in [start, end)."""
+    return and_(
+        Event.recurrence_rule.isnot(None),
+        Event.start_time < end_time,
+        or_(
+            Event.recurrence_until.is_(None),
+            Event.recurrence_until >= start_time - timedelta(days=_EVENT_RANGE_LOOKBEHIND_DAYS)
+        )
+    )
+
+
+def _find_reservation_conflicts(resources, start_time, end_time, exclude_event_id=None):
+    """Return ReservationSlots of the given (type, id) resources overlapping [start, end).
+
+    Combines stored reservations of one-off events with the expanded
+    occurrences of recurring events linked to the same resources.
+    """
+    resources = list(resources)
+    if not resources or not start_time or not end_time:
+        return []
+    by_type = {}
+    for resource_type, resource_id in resources:
+        by_type.setdefault(resource_type, set()).add(resource_id)
+    query = Reservation.query.options(selectinload(Reservation.event)).filter(
+        or_(*[
+            and_(Reservation.resource_type == resource_type, Reservation.resource_id.in_(ids))
+            for resource_type, ids in by_type.items()
+        ]),
+        Reservation.end_time > start_time,
+        Reservation.start_time < end_time
+    )
+    if exclude_event_id:
+        query = query.filter(Reservation.event_id != exclude_event_id)
+    slots = [
+        ReservationSlot(r.event, r.event_id, r.resource_type, r.resource_id, r.start_time, r.end_time)
+        for r in query.all()
+    ]
+
+    linked = []
+    if by_type.get('item'):
+        linked.append(Event.items.any(Item.id.in_(by_type['item'])))
+    if by_type.get('location'):
+        linked.append(Event.locations.any(Location.id.in_(by_type['location'])))
+    if linked:
+        series_query = Event.query.options(
+            selectinload(Event.items), selectinload(Event.locations)
+        ).filter(_recurring_series_in_window(start_time, end_time), or_(*linked))
+        if exclude_event_id:
+            series_query = series_query.filter(Event.id != exclude_event_id)
+        for occurrence in expand_event_occurrences(series_query.all(), start_time, end_time):
+            for resource_type, resource_id in _event_resource_keys(occurrence.event):
+                if resource_id in by_type.get(resource_type, ()):
+                    slots.append(ReservationSlot(
+                        occurrence.event, occurrence.event.id, resource_type, resource_id,
+                        occurrence.start_time, occurrence.end_time
+                    ))
+    slots.sort(key=lambda slot: (slot.start_time, slot.event_id))
+    return slots
+
+
+def _flash_reservation_conflicts(event):
+    if event.is_recurring:
+        # 重复事项只检查近期场次，避免无限系列展开过多
+        now = datetime.utcnow()
+        own = expand_event_occurrences(
+            [event], max(now, event.start_time), now + timedelta(days=_RECURRENCE_CONFLICT_HORIZON_DAYS)
+        )
+        if not own:
+            return
+        candidates = _find_reservation_conflicts(
+            _event_resource_keys(event), own[0].start_time, own[-1].end_time, exclude_event_id=event.id
+        )
+        conflicts = [
+            slot for slot in candidates
+            if any(o.start_time < slot.end_time and o.end_time > slot.start_time for o in own)
+        ]
+    else:
+        start_time, end_time = _event_reservation_window(event)
+        conflicts = _find_reservation_conflicts(
+            _event_resource_keys(event), start_time, end_time, exclude_event_id=event.id
+        )
+    if not conflicts:
+        return
+    names = {('item', item.id): item.name for item in event.items}
+    names.update({('location', loc.id): loc.name for loc in event.locations})
+    details = []
+    for reservation in conflicts[:5]:
+        other = reservation.event
+        title = other.title if other and other.can_view(current_user) else '其他事项'
+        details.append(
+            f"{names.get((reservation.resource_type, reservation.resource_id), reservation.resource_id)}"
+            f"（{title} {format_china_time(reservation.start_time, '%m-%d %H:%M')}）"
+        )
+    suffix = f' 等 {len(conflicts)} 处' if len(conflicts) > 5 else ''
+    flash('以下资源在该时间段已被其他事项占用：' + '；'.join(details) + suffix, 'warning')
+
+
+@event.listens_for(OrmSession, 'before_flush')
+def _drop_reservations_of_deleted_resources(session, flush_context, instances):
+    targets = [
+        ('item' if isinstance(obj, Item) else 'location', obj.id)
+        for obj in session.deleted
+        if isinstance(obj, (Item, Location)) and obj.id is not None
+    ]
+    if not targets:
+        return
+    table = Reservation.__table__
+    session.connection().execute(
+        table.delete().where(or_(*[
+            and_(table.c.resource_type == resource_type, table.c.resource_id == resource_id)
+            for resource_type, resource_id in targets
+        ]))
+    )
+
+
+_LOAN_DEFAULT_DAYS = 14
+_LOAN_HISTORY_LIMIT = 10
+_LOAN_API_MAX_RESULTS = 500
+
+
+class ItemLoan(db.Model):
+    """Check-out ledger: one row per loan, returned_at stays NULL while the item is out."""
+    __tablename__ = 'item_loans'
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id'), nullable=False)
+    borrower_id = db.Column(db.Integer, db.ForeignKey('members.id'), nullable=False)
+    checked_out_by_id = db.Column(db.Integer, db.ForeignKey('members.id'))
+    checked_out_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    due_at = db.Column(db.DateTime)
+    returned_at = db.Column(db.DateTime)
+    checked_in_by_id = db.Column(db.Integer, db.ForeignKey('members.id'))
+    previous_stock_status = db.Column(db.String(50))            # 借出前的库存状态，归还时恢复
+    note = db.Column(db.String(200))
+
+    __table_args__ = (
+        # 未归还记录的部分索引：每件物品同一时间只有一条，"现在在谁手里"一次索引查找即可
+        db.Index('ix_item_loans_open_item', 'item_id', unique=True, sqlite_where=text('returned_at IS NULL')),
+        db.Index('ix_item_loans_open_due', 'due_at', sqlite_where=text('returned_at IS NULL')),
+        db.Index('ix_item_loans_borrower_open', 'borrower_id', 'returned_at'),
+        db.Index('ix_item_loans_item_history', 'item_id', 'checked_out_at'),
+    )
+
+    item = db.relationship('Item', backref=db.backref('loans', lazy='dynamic', cascade='all, delete-orphan'))
+    borrower = db.relationship('Member', foreign_keys=[borrower_id])
+    checked_out_by = db.relationship('Member', foreign_keys=[checked_out_by_id])
+    checked_in_by = db.relationship('Member', foreign_keys=[checked_in_by_id])
+
+    def is_overdue(self, now=None):
+        return self.returned_at is None and self.due_at is not None and self.due_at < (now or datetime.utcnow())
+
+    def __repr__(self):
+        return f'<ItemLoan item={self.item_id} borrower={self.borrower_id} returned={self.returned_at}>'
+
+
+def _open_loan_for_item(item_id):
+    return ItemLoan.query.options(selectinload(ItemLoan.borrower)).filter(
+        ItemLoan.item_id == item_id, ItemLoan.returned_at.is_(None)
+    ).first()
+
+
+def _open_loans_query():
+    return ItemLoan.query.options(
+        selectinload(ItemLoan.item), selectinload(ItemLoan.borrower)
+    ).filter(ItemLoan.returned_at.is_(None))
+
+
+def _overdue_loans_query(now=None):
+    return _open_loans_query().filter(
+        ItemLoan.due_at.isnot(None), ItemLoan.due_at < (now or datetime.utcnow())
+    )
+
+
+def _can_handle_loan(item, member):
+    """Private items may only be lent out by their responsible members."""
+    return item.features != '私人' or member in item.responsible_members
+
+
+def checkout_item(item, borrower, actor, due_at=None, note=None):
+    """Open a loan for the item and mark it 借出. Raises ValueError if it is already out."""
+    if _open_loan_for_item(item.id) is not None:
+        raise ValueError(f'{item.name} 已被借出，需先归还')
+    now = datetime.utcnow()
+    if due_at is not None and due_at <= now:
+        raise ValueError('归还期限必须晚于当前时间')
+    loan = ItemLoan(
+        item=item,
+        borrower_id=borrower.id,
+        checked_out_by_id=actor.id,
+        checked_out_at=now,
+        due_at=due_at,
+        previous_stock_status=item.stock_status,
+        note=(note or '').strip()[:200] or None
+    )
+    db.session.add(loan)
+    item.stock_status = '借出'
+    item.last_modified = now
+    record_log(
+        user_id=actor.id,
+        item_id=item.id,
+        action_type='借出物品',
+        details=f"Checked out {item.name} to {borrower.name or borrower.username}"
+                + (f" (due {due_at.strftime('%Y-%m-%d %H:%M')})" if due_at else '')
+    )
+    return loan
+
+
+def checkin_item(loan, actor):
+    """Close the loan and restore the item's previous stock status."""
+    now = datetime.utcnow()
+    loan.returned_at = now
+    loan.checked_in_by_id = actor.id
+    item = loan.item
+    if _normalize_item_stock_status(item.stock_status) == '借出':
+        previous = _normalize_item_stock_status(loan.previous_stock_status)
+        item.stock_status = previous if previous and previous != '借出' else '正常'
+    item.last_modified = now
+    record_log(
+        user_id=actor.id,
+        item_id=item.id,
+        action_type='归还物品',
+        details=f"Checked in {item.name} from {loan.borrower.name or loan.borrower.username}"
+    )
+    return loan
+
+
+class ItemQuantityChange(db.Model):
+    """Append-only ledger of Item.quantity changes, written by a flush listener."""
+    __tablename__ = 'item_quantity_changes'
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id'), nullable=False)
+    recorded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    quantity = db.Column(db.Float, nullable=False)               # 变更后的数量
+    delta = db.Column(db.Float, nullable=False)                  # 相对上一次的变化，负数为消耗
+    member_id = db.Column(db.Integer, db.ForeignKey('members.id'))
+
+    __table_args__ = (
+        db.Index('ix_item_quantity_changes_item_time', 'item_id', 'recorded_at'),
+        db.Index('ix_item_quantity_changes_recorded', 'recorded_at'),
+    )
+
+    item = db.relationship('Item')
+
+
+class ItemDepletionForecast(db.Model):
+    """Latest projected depletion per item, rebuilt in bulk by forecast_item_depletion()."""
+    __tablename__ = 'item_depletion_forecasts'
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id'), primary_key=True)
+    consumption_per_day = db.Column(db.Float, nullable=False)
+    projected_depletion_at = db.Column(db.DateTime, index=True)
+    sample_count = db.Column(db.Integer, nullable=False, default=0)
+    computed_at = db.Column(db.DateTime, nullable=False)
+
+    item = db.relationship('Item')
+
+
+# 至少需要这么多条消耗记录才拟合速率
+_DEPLETION_MIN_SAMPLES = 2
+# 预计用完时间超过该天数时不再记录日期
+_DEPLETION_MAX_HORIZON_DAYS = 3650
+
+
+def _current_actor_id():
+    if has_request_context() and current_user and current_user.is_authenticated:
+        return current_user.id
+    # 写队列线程没有请求上下文，操作人随写请求一起传入
+    return g.get('write_queue_actor_id') if has_app_context() else None
+
+
+@event.listens_for(OrmSession, 'before_flush')
+def _record_item_quantity_changes(session, flush_context, instances):
+    now = None
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Item) or obj.quantity is None:
+            continue
+        state = inspect(obj)
+        history = state.attrs.quantity.history
+        if not history.has_changes():
+            continue
+        if history.deleted:
+            previous = history.deleted[0]
+        elif state.persistent:
+            # 过期后直接赋值时没有旧值，flush 前库里仍是上一次的数量
+            table = Item.__table__
+            previous = session.connection().execute(
+                db.select(table.c.quantity).where(table.c.id == obj.id)
+            ).scalar()
+        else:
+            previous = None
+        if previous == obj.quantity:
+            continue
+        now = now or datetime.utcnow()
+        session.add(ItemQuantityChange(
+            item=obj,
+            recorded_at=now,
+            quantity=obj.quantity,
+            delta=obj.quantity - (previous or 0),
+            member_id=_current_actor_id()
+        ))
+
+
+@event.listens_for(OrmSession, 'before_flush')
+def _drop_quantity_history_of_deleted_items(session, flush_context, instances):
+    item_ids = [obj.id for obj in session.deleted if isinstance(obj, Item) and obj.id is not None]
+    if not item_ids:
+        return
+    connection = session.connection()
+    for table in (ItemQuantityChange.__table__, ItemDepletionForecast.__table__):
+        connection.execute(table.delete().where(table.c.item_id.in_(item_ids)))
+
+
+def forecast_item_depletion(now=None, window_days=None):
+    """Fit consumption rates for the whole catalogue in one vectorised pass.
+
+    For each item the cumulative consumption inside the window (plus an anchor
+    at `now`, so items that went quiet slow down) is fitted with a least-squares
+    line; the slope is the consumption per day and the current quantity divided
+    by it gives the projected depletion date. Replaces item_depletion_forecasts
+    and returns the number of forecasts written.
+    """
+    if np is None:
+        raise RuntimeError('需要安装 NumPy 才能计算消耗预测')
+    now = now or datetime.utcnow()
+    window_days = window_days or app.config.get('DEPLETION_FORECAST_WINDOW_DAYS', 90)
+    cutoff = now - timedelta(days=window_days)
+    ledger = ItemQuantityChange.__table__
+    rows = db.session.execute(
+        db.select(ledger.c.item_id, ledger.c.recorded_at, ledger.c.delta)
+        .where(ledger.c.recorded_at >= cutoff)
+        .order_by(ledger.c.item_id, ledger.c.recorded_at)
+    ).all()
+    records = []
+    if rows:
+        size = len(rows)
+        item_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=size)
+        days = np.fromiter(((row[1] - cutoff).total_seconds() / 86400 for row in rows), dtype=np.float64, count=size)
+        consumed = np.maximum(-np.fromiter((row[2] for row in rows), dtype=np.float64, count=size), 0.0)
+        groups, starts, counts = np.unique(item_ids, return_index=True, return_counts=True)
+        # 分组累计消耗：整体 cumsum 后减去各组起点之前的累计值
+        running = np.cumsum(consumed)
+        cumulative = running - np.repeat(running[starts] - consumed[starts], counts)
+        total = np.add.reduceat(consumed, starts)
+        horizon = (now - cutoff).total_seconds() / 86400
+        n = counts + 1.0
+        sum_t = np.add.reduceat(days, starts) + horizon
+        sum_c = np.add.reduceat(cumulative, starts) + total
+        sum_tt = np.add.reduceat(days * days, starts) + horizon * horizon
+        sum_tc = np.add.reduceat(days * cumulative, starts) + horizon * total
+        denom = n * sum_tt - sum_t * sum_t
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = np.where(denom > 0, (n * sum_tc - sum_t * sum_c) / denom, 0.0)
+        samples = np.add.reduceat((consumed > 0).astype(np.int64), starts)
+        valid = (samples >= _DEPLETION_MIN_SAMPLES) & (rates > 0)
+        candidate_ids = groups[valid].tolist()
+        quantities = {}
+        for start in range(0, len(candidate_ids), 500):
+            chunk = candidate_ids[start:start + 500]
+            quantities.update(db.session.execute(
+                db.select(Item.id, Item.quantity).where(Item.id.in_(chunk))
+            ).all())
+        for item_id, rate, sample_count in zip(candidate_ids, rates[valid].tolist(), samples[valid].tolist()):
+            quantity = quantities.get(item_id)
+            if quantity is None:
+                continue
+            days_left = max(quantity, 0) / rate
+            records.append({
+                'item_id': item_id,
+                'consumption_per_day': round(rate, 4),
+                'projected_depletion_at': (
+                    now + timedelta(days=days_left) if days_left <= _DEPLETION_MAX_HORIZON_DAYS else None
+                ),
+                'sample_count': sample_count,
+                'computed_at': now,
+            })
+    forecasts = ItemDepletionForecast.__table__
+    db.session.execute(forecasts.delete())
+    if records:
+        db.session.execute(forecasts.insert(), records)
+    # 预测表由 Core 整表重建，不会改动 last_modified；递增代号让缓存的物品详情页失效
+    _bump_cache_version(db.session.connection(), _DEPLETION_FORECAST_CACHE_KEY)
+    db.session.commit()
+    return len(records)
+
+
+def _start_depletion_forecast_worker():
+    interval_seconds = app.config.get('DEPLETION_FORECAST_INTERVAL_SECONDS', 0)
+    if not interval_seconds or np is None:
+        return
+    if os.environ.get('FLASK_DEBUG') == '1' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return
+
+    def runner():
+        with app.app_context():
+            while True:
+                try:
+                    written = forecast_item_depletion()
+                    app.logger.info('已更新 %s 个物品的消耗预测', written)
+                except Exception as exc:
+                    db.session.rollback()
+                    app.logger.warning('消耗预测任务失败: %s', exc)
+                finally:
+                    db.session.remove()
+                time.sleep(interval_seconds)
+
+    thread = threading.Thread(target=runner, name='depletion-forecast-worker', daemon=True)
+    thread.start()
+
+
+class StatusAlert(db.Model):
+    """One row per (responsible member, item/location) currently in an alert status.
+
+    Maintained by an after_flush listener and `_refresh_status_alerts()` for Core
+    writes, so alert counts and digests are plain indexed aggregates instead of
+    walking every member's items and locations.
+    """
+    __tablename__ = 'status_alerts'
+    id = db.Column(db.Integer, primary_key=True)
+    member_id = db.Column(db.Integer, db.ForeignKey('members.id'), nullable=False)
+    resource_type = db.Column(db.String(20), nullable=False)     # item / location
+    resource_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    priority = db.Column(db.Integer, nullable=False, default=0)  # 同类告警内的排序，越小越紧急
+    since = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('member_id', 'resource_type', 'resource_id', name='uq_status_alerts_member_resource'),
+        db.Index('ix_status_alerts_status_member', 'status', 'member_id'),
+    )
+
+
+_STATUS_ALERT_SOURCES = {
+    'item': (Item.__table__, item_members, 'item_id', 'stock_status',
+             _normalize_item_stock_status, _ITEM_ALERT_STATUS_PRIORITY),
+    'location': (Location.__table__, location_members, 'location_id', 'status',
+                 _normalize_location_status, _LOCATION_ALERT_STATUS_PRIORITY),
+}
+_ALERT_DIGEST_ACTION = '告警日报'
+
+
+def _refresh_status_alerts(connection, item_ids=None, location_ids=None):
+    """Recompute status_alerts for the given items/locations; None rebuilds that kind entirely.
+
+    Pass an empty collection to leave a kind untouched. Rows whose status did not
+    change keep their original `since`. Returns the number of rows written.
+    """
+    alerts = StatusAlert.__table__
+    now = datetime.utcnow()
+    written = 0
+    for resource_type, ids in (('item', item_ids), ('location', location_ids)):
+        if ids is not None and not ids:
+            continue
+        table, link, link_key, status_key, normalize, priorities = _STATUS_ALERT_SOURCES[resource_type]
+        scope = alerts.c.resource_type == resource_type
+        current = (
+            db.select(link.c[link_key], link.c.member_id, table.c[status_key])
+            .join(table, table.c.id == link.c[link_key])
+        )
+        if ids is not None:
+            ids = sorted(set(ids))
+            scope = scope & alerts.c.resource_id.in_(ids)
+            current = current.where(link.c[link_key].in_(ids))
+        since = {
+            (row.member_id, row.resource_id, row.status): row.since
+            for row in connection.execute(
+                db.select(alerts.c.member_id, alerts.c.resource_id, alerts.c.status, alerts.c.since).where(scope)
+            )
+        }
+        rows = []
+        for resource_id, member_id, raw_status in connection.execute(current):
+            status = normalize(raw_status)
+            if status not in priorities:
+                continue
+            rows.append({
+                'member_id': member_id,
+                'resource_type': resource_type,
+                'resource_id': resource_id,
+                'status': status,
+                'priority': priorities[status],
+                'since': since.get((member_id, resource_id, status), now),
+            })
+        connection.execute(alerts.delete().where(scope))
+        if rows:
+            connection.execute(alerts.insert(), rows)
+        written += len(rows)
+    return written
+
+
+def rebuild_status_alerts(connection=None):
+    """Recompute the whole status_alerts table (migration backfill, bulk generators)."""
+    return _refresh_status_alerts(connection or db.session.connection())
+
+
+def _link_history_ids(state, attr_name):
+    history = state.attrs[attr_name].history
+    return {obj.id for obj in list(history.added) + list(history.deleted) if obj.id is not None}
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def _sync_status_alerts(session, flush_context):
+    touched = {'item': set(), 'location': set()}
+    watched = {Item: ('item', 'stock_status'), Location: ('location', 'status')}
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Member) and obj in session.dirty:
+            state = inspect(obj)
+            touched['item'] |= _link_history_ids(state, 'items')
+            touched['location'] |= _link_history_ids(state, 'responsible_locations')
+            continue
+        spec = watched.get(type(obj))
+        if spec is None or obj.id is None:
+            continue
+        resource_type, status_attr = spec
+        if obj in session.dirty:
+            state = inspect(obj)
+            if not (state.attrs[status_attr].history.has_changes()
+                    or state.attrs.responsible_members.history.has_changes()):
+                continue
+        touched[resource_type].add(obj.id)
+    if touched['item'] or touched['location']:
+        _refresh_status_alerts(session.connection(), touched['item'], touched['location'])
+
+
+def _status_alert_counts(member_id=None):
+    """Return {'item': {status: n}, 'location': {status: n}} for one member or the whole lab.
+
+    Lab-wide counts are per resource, so an item with several responsible members
+    is counted once.
+    """
+    alerts = StatusAlert.__table__
+    if member_id is None:
+        counter = func.count(func.distinct(alerts.c.resource_id))
+    else:
+        counter = func.count()
+    stmt = db.select(alerts.c.resource_type, alerts.c.status, counter).group_by(
+        alerts.c.resource_type, alerts.c.status
+    )
+    if member_id is not None:
+        stmt = stmt.where(alerts.c.member_id == member_id)
+    counts = {resource_type: {} for resource_type in _STATUS_ALERT_SOURCES}
+    for resource_type, status, count in db.session.execute(stmt):
+        counts.setdefault(resource_type, {})[status] = count
+    return counts
+
+
+def _ordered_alert_counts(counts, statuses):
+    return {status: counts[status] for status in statuses if counts.get(status)}
+
+
+def build_alert_digest():
+    """Summarise every member's open alerts in one grouped query.
+
+    Returns {member_id: [(resource_type, status, count), ...]} ordered by priority.
+    """
+    alerts = StatusAlert.__table__
+    rows = db.session.execute(
+        db.select(alerts.c.member_id, alerts.c.resource_type, alerts.c.status, func.count())
+        .group_by(alerts.c.member_id, alerts.c.resource_type, alerts.c.status, alerts.c.priority)
+        .order_by(alerts.c.member_id, alerts.c.resource_type, alerts.c.priority)
+    ).all()
+    digest = {}
+    for member_id, resource_type, status, count in rows:
+        digest.setdefault(member_id, []).append((resource_type, status, count))
+    return digest
+
+
+def _format_alert_digest(entries):
+    parts = []
+    for resource_type, status, count in entries:
+        noun = '物品' if resource_type == 'item' else '位置'
+        parts.append(f'{status}{noun} {count} 个')
+    return '当前待处理告警：' + '，'.join(parts)
+
+
+def send_alert_digest(now=None):
+    """Write one inbox notification per member with open alerts; idempotent per day.
+
+    Members who already received a digest since midnight (UTC) are skipped, so a
+    retried cron run does not notify twice. Returns the number of digests sent.
+    """
+    now = now or datetime.utcnow()
+    digest = build_alert_digest()
+    if not digest:
+        return 0
+    day_start = datetime.combine(now.date(), datetime.min.time())
+    notifications = Notification.__table__
+    already_sent = set(db.session.execute(
+        db.select(notifications.c.member_id).where(
+            notifications.c.action_type == _ALERT_DIGEST_ACTION,
+            notifications.c.timestamp >= day_start
+        )
+    ).scalars())
+    rows = [{
+        'member_id': member_id,
+        'action_type': _ALERT_DIGEST_ACTION,
+        'details': _format_alert_digest(entries),
+        'timestamp': now,
+    } for member_id, entries in digest.items() if member_id not in already_sent]
+    if rows:
+        db.session.execute(notifications.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+
+class ChangeJournal(db.Model):
+    """Append-only change feed for offline sync clients; the id is the sync cursor.
+
+    AUTOINCREMENT keeps ids strictly increasing even after compaction deletes
+    the newest rows, so a client cursor never points at a reused id.
+    """
+    __tablename__ = 'change_journal'
+    id = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String(20), nullable=False)        # item / location / event / attachment
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)                 # upsert / delete
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    member_id = db.Column(db.Integer)                             # 操作人（后台任务为空）
+
+    __table_args__ = (
+        db.Index('ix_change_journal_entity', 'entity_type', 'entity_id', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+
+
+_SYNC_ENTITY_TYPES = {Item: 'item', Location: 'location', Event: 'event', Attachment: 'attachment'}
+_SYNC_ENTITY_MODELS = {entity_type: model for model, entity_type in _SYNC_ENTITY_TYPES.items()}
+# 关联集合变化时对端实体的同步载荷也随之变化（物品的负责人/位置 ID 列表等）
+_SYNC_LINKED_COLLECTIONS = {
+    Member: (('items', 'item'), ('responsible_locations', 'location')),
+    Location: (('items', 'item'),),
+}
+
+
+def _journal_changes(connection, entity_type, ids, op='upsert', member_id=None, now=None):
+    """Append one journal row per id; the caller owns the transaction."""
+    ids = sorted(set(ids or ()))
+    if not ids:
+        return 0
+    now = now or datetime.utcnow()
+    connection.execute(ChangeJournal.__table__.insert(), [{
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'op': op,
+        'changed_at': now,
+        'member_id': member_id,
+    } for entity_id in ids])
+    return len(ids)
+
+
+def _journal_existing_rows(connection, min_ids=None):
+    """Journal every row (or rows above `min_ids[entity_type]`) as an upsert with INSERT ... SELECT."""
+    journal = ChangeJournal.__table__
+    now = datetime.utcnow()
+    written = 0
+    for entity_type, model in _SYNC_ENTITY_MODELS.items():
+        table = model.__table__
+        source = db.select(
+            db.literal(entity_type), table.c.id, db.literal('upsert'), db.literal(now)
+        ).order_by(table.c.id)
+        if min_ids and min_ids.get(entity_type):
+            source = source.where(table.c.id > min_ids[entity_type])
+        result = connection.execute(
+            journal.insert().from_select(['entity_type', 'entity_id', 'op', 'changed_at'], source)
+        )
+        written += max(result.rowcount or 0, 0)
+    return written
+
+
+def _sync_entity_max_ids(connection):
+    return {
+        entity_type: connection.execute(db.select(func.max(model.__table__.c.id))).scalar() or 0
+        for entity_type, model in _SYNC_ENTITY_MODELS.items()
+    }
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def _journal_orm_changes(session, flush_context):
+    upserts = {entity_type: set() for entity_type in _SYNC_ENTITY_MODELS}
+    deletes = {entity_type: set() for entity_type in _SYNC_ENTITY_MODELS}
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        linked = _SYNC_LINKED_COLLECTIONS.get(type(obj))
+        if linked and obj in session.dirty:
+            state = inspect(obj)
+            for attr_name, entity_type in linked:
+                upserts[entity_type] |= _link_history_ids(state, attr_name)
+        entity_type = _SYNC_ENTITY_TYPES.get(type(obj))
+        if entity_type is None or obj.id is None:
+            continue
+        if obj in session.deleted:
+            deletes[entity_type].add(obj.id)
+        elif obj in session.new or session.is_modified(obj):
+            upserts[entity_type].add(obj.id)
+    if not any(upserts.values()) and not any(deletes.values()):
+        return
+    connection = session.connection()
+    member_id = _current_actor_id()
+    now = datetime.utcnow()
+    for entity_type in _SYNC_ENTITY_MODELS:
+        _journal_changes(connection, entity_type, upserts[entity_type] - deletes[entity_type],
+                         member_id=member_id, now=now)
+        _journal_changes(connection, entity_type, deletes[entity_type], op='delete',
+                         member_id=member_id, now=now)
+
+
+def compact_change_journal():
+    """Drop journal rows superseded by a later row for the same entity.
+
+    Payloads always carry current state, so only the newest row per entity
+    matters; tombstones are kept so offline clients still learn about deletions.
+    Returns the number of rows removed.
+    """
+    journal = ChangeJournal.__table__
+    latest = (
+        db.select(func.max(journal.c.id))
+        .group_by(journal.c.entity_type, journal.c.entity_id)
+    )
+    result = db.session.execute(journal.delete().where(journal.c.id.not_in(latest)))
+    db.session.commit()
+    return max(result.rowcount or 0, 0)
+
+
+def _backfill_reservations_from_events():
+    """Derive reservations for existing scheduled events linked to items or locations."""
+    duration_hours = int(_RESERVATION_DEFAULT_DURATION.total_seconds() // 3600)
+    end_expr = (
+        "CASE WHEN e.end_time IS NOT NULL AND e.end_time > e.start_time THEN e.end_time "
+        f"ELSE datetime(e.start_time, '+{duration_hours} hours') END"
+    )
+    statement = text(f"""
+        INSERT INTO reservations (event_id, resource_type, resource_id, start_time, end_time)
+        SELECT e.id, 'item', ei.item_id, e.start_time, {end_expr}
+        FROM events e JOIN event_items ei ON ei.event_id = e.id
+        WHERE e.start_time IS NOT NULL AND e.recurrence_rule IS NULL
+        UNION ALL
+        SELECT e.id, 'location', el.location_id, e.start_time, {end_expr}
+        FROM events e JOIN event_locations el ON el.event_id = e.id
+        WHERE e.start_time IS NOT NULL AND e.recurrence_rule IS NULL
+    """)
+    with db.engine.begin() as conn:
+        conn.execute(statement)
+
+
+def _inspector_column_names(inspector, table_name):
+    try:
+        return {col['name'] for col in inspector.get_columns(table_name)}
+    except Exception:
+        return set()
+
+
+def _migrate_legacy_attachments(inspector, table_names):
+    """Migrate legacy media columns/tables into the unified attachments table.
+
+    Target ordering is "first uploaded first shown", so we preserve legacy table `id` ordering when migrating.
+    """
+    if 'attachments' not in (table_names or []):
+        return
+
+    try:
+        existing_items = set()
+        existing_locations = set()
+        existing_events = set()
+        for item_id, filename in (
+            db.session.query(Attachment.item_id, Attachment.filename)
+            .filter(Attachment.item_id.isnot(None), Attachment.filename.isnot(None), Attachment.filename != '')
+            .all()
+        ):
+            existing_items.add((int(item_id), filename))
+        for location_id, filename in (
+            db.session.query(Attachment.location_id, Attachment.filename)
+            .filter(Attachment.location_id.isnot(None), Attachment.filename.isnot(None), Attachment.filename != '')
+            .all()
+        ):
+            existing_locations.add((int(location_id), filename))
+        for event_id, filename in (
+            db.session.query(Attachment.event_id, Attachment.filename)
+            .filter(Attachment.event_id.isnot(None), Attachment.filename.isnot(None), Attachment.filename != '')
+            .all()
+        ):
+            existing_events.add((int(event_id), filename))
+
+        sources = {}
+        inserted = 0
+
+        def get_source(name, owner_field):
+            entry = sources.get(name)
+            if entry is None:
+                entry = {'ok': False, 'owner_field': owner_field, 'keys': set()}
+                sources[name] = entry
+            entry['owner_field'] = owner_field
+            return entry
+
+        def normalize_key(owner_id, filename):
+            if owner_id is None or filename is None:
+                return None
+            try:
+                owner_id_int = int(owner_id)
+            except (TypeError, ValueError):
+                return None
+            fname = _ensure_string(filename).strip()
+            if not fname:
+                return None
+            return owner_id_int, fname
+
+        def normalize_created_at(value):
+            if not value:
+                return None
+            if isinstance(value, datetime):
+                return value
+            token = _ensure_string(value).strip()
+            if not token:
+                return None
+            token = token.replace('T', ' ')
+            if token.endswith('Z'):
+                token = token[:-1]
+            try:
+                return datetime.fromisoformat(token)
+            except ValueError:
+                return None
+
+        def insert(owner_field, key, created_at=None):
+            nonlocal inserted
+            if not key:
+                return
+            owner_id_int, fname = key
+            if owner_field == 'item_id':
+                if key in existing_items:
+                    return
+                att = Attachment(item_id=owner_id_int, filename=fname)
+                existing_items.add(key)
+            elif owner_field == 'location_id':
+                if key in existing_locations:
+                    return
+                att = Attachment(location_id=owner_id_int, filename=fname)
+                existing_locations.add(key)
+            elif owner_field == 'event_id':
+                if key in existing_events:
+                    return
+                att = Attachment(event_id=owner_id_int, filename=fname)
+                existing_events.add(key)
+            else:
+                return
+
+            normalized = normalize_created_at(created_at)
+            if normalized:
+                att.created_at = normalized
+            db.session.add(att)
+            inserted += 1
+
+        def migrate_table(table_name, owner_field):
+            if table_name not in table_names:
+                return
+            cols = _inspector_column_names(inspector, table_name)
+            if 'filename' not in cols or owner_field not in cols:
+                return
+            source = get_source(table_name, owner_field)
+            has_created_at = 'created_at' in cols
+            select_cols = f"{owner_field}, filename" + (", created_at" if has_created_at else "")
+            try:
+                rows = db.session.execute(
+                    text(
+                        f"SELECT {select_cols} FROM {table_name} "
+                        "WHERE filename IS NOT NULL AND filename != '' "
+                        "ORDER BY id"
+                    )
                 ).fetchall()
             except Exception:
                 return
@@ -3343,6 +5665,8 @@ except Exception:  # pragma: no cover - Windows or restricted env
 
 _startup_done = False
 _startup_once_lock = threading.Lock()
+_schema_ready = False
+_schema_once_lock = threading.Lock()
 _jobs_leader_lock_fh = None
 
 
@@ -3395,6 +5719,11 @@ def _run_schema_migrations_and_seed():
     if app.config.get('DIRECT_OSS_UPLOAD_ENABLED') and not _oss_direct_upload_ready():
         app.config['DIRECT_OSS_UPLOAD_ENABLED'] = False
 
+    try:
+        tables_before_create = set(inspect(db.engine).get_table_names())
+    except Exception:
+        tables_before_create = set()
+
     db.create_all()
 
     inspector = None
@@ -3432,6 +5761,9 @@ def _run_schema_migrations_and_seed():
             alter_statements.append('ALTER TABLE locations ADD COLUMN longitude REAL')
         if 'coordinate_source' not in existing_cols:
             alter_statements.append('ALTER TABLE locations ADD COLUMN coordinate_source VARCHAR(20)')
+        if 'geohash' not in existing_cols:
+            alter_statements.append('ALTER TABLE locations ADD COLUMN geohash VARCHAR(12)')
+            alter_statements.append('CREATE INDEX IF NOT EXISTS ix_locations_geohash ON locations (geohash)')
         if 'is_public' not in existing_cols:
             alter_statements.append('ALTER TABLE locations ADD COLUMN is_public BOOLEAN DEFAULT 0')
         if 'detail_refs' not in existing_cols:
@@ -3475,6 +5807,21 @@ def _run_schema_migrations_and_seed():
             migrated_locations = True
         if migrated_locations:
             db.session.commit()
+        # 回填 geohash：历史位置只有经纬度，补齐后 /api/locations/nearby 才能命中索引
+        missing_geohash = (
+            Location.query
+            .options(load_only(Location.id, Location.latitude, Location.longitude, Location.geohash))
+            .filter(
+                Location.latitude.isnot(None),
+                Location.longitude.isnot(None),
+                Location.geohash.is_(None)
+            )
+            .all()
+        )
+        if missing_geohash:
+            for loc in missing_geohash:
+                loc.refresh_geohash()
+            db.session.commit()
 
     if 'logs' in table_names:
         log_cols = {col['name'] for col in inspector.get_columns('logs')}
@@ -3494,6 +5841,12 @@ def _run_schema_migrations_and_seed():
         if 'allow_participant_edit' not in event_cols:
             with db.engine.begin() as conn:
                 conn.execute(text('ALTER TABLE events ADD COLUMN allow_participant_edit BOOLEAN DEFAULT 0'))
+        if 'recurrence_rule' not in event_cols:
+            with db.engine.begin() as conn:
+                conn.execute(text('ALTER TABLE events ADD COLUMN recurrence_rule VARCHAR(200)'))
+        if 'recurrence_until' not in event_cols:
+            with db.engine.begin() as conn:
+                conn.execute(text('ALTER TABLE events ADD COLUMN recurrence_until DATETIME'))
     if 'items' in table_names:
         item_cols = {col['name'] for col in inspector.get_columns('items')}
         item_alter_statements = []
@@ -3511,69 +5864,923 @@ def _run_schema_migrations_and_seed():
                     except Exception:
                         pass
 
-    _migrate_legacy_attachments(inspector, table_names)
+    # create_all 不会给已存在的表补索引，这里按模型中的名称补齐
+    with db.engine.begin() as conn:
+        for model in (Log, Item, Location, Member, Event):
+            if model.__tablename__ not in table_names:
+                continue
+            for index in model.__table__.indexes:
+                columns = ', '.join(col.name for col in index.columns)
+                conn.execute(text(
+                    f'CREATE INDEX IF NOT EXISTS {index.name} ON {model.__tablename__} ({columns})'
+                ))
+
+    if 'logs' in tables_before_create and 'notifications' not in tables_before_create:
+        _backfill_notifications_from_logs()
+    if 'events' in tables_before_create and 'reservations' not in tables_before_create:
+        _backfill_reservations_from_events()
+    if 'items' in tables_before_create and 'status_alerts' not in tables_before_create:
+        with db.engine.begin() as conn:
+            rebuild_status_alerts(conn)
+    if 'items' in tables_before_create and 'change_journal' not in tables_before_create:
+        # 旧库的现有数据作为首批 upsert，保证 since=0 的全量同步完整
+        with db.engine.begin() as conn:
+            _journal_existing_rows(conn)
+
+    _migrate_legacy_attachments(inspector, table_names)
+
+    # 仅在“全新库（members 为空）”时创建默认管理员；存在则跳过。
+    try:
+        has_any_member = db.session.query(Member.id).limit(1).first() is not None
+    except Exception:
+        has_any_member = True
+    if not has_any_member and not Member.query.filter_by(username="admin").first():
+        default_user = Member(
+            name="Admin User",
+            username="admin",
+            contact="admin@example.com",
+            notes="Default admin user",
+        )
+        default_user.set_password("admin")
+        db.session.add(default_user)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # 多 worker 并发或重复运行时，若已存在同名用户则忽略。
+            db.session.rollback()
+
+
+def _backfill_notifications_from_logs():
+    """Seed the new inbox from recent logs (within retention), marked as already read."""
+    days = app.config.get('NOTIFICATION_RETENTION_DAYS') or 30
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    columns = 'l.id, l.user_id, l.item_id, l.location_id, l.event_id, l.action_type, l.details, l.timestamp'
+    statement = text(f"""
+        INSERT INTO notifications
+            (member_id, log_id, user_id, item_id, location_id, event_id, action_type, details, timestamp, read_at)
+        SELECT member_id, id, user_id, item_id, location_id, event_id, action_type, details, timestamp, timestamp
+        FROM (
+            SELECT im.member_id AS member_id, {columns}
+            FROM logs l JOIN item_members im ON im.item_id = l.item_id
+            WHERE l.timestamp >= :cutoff AND (l.user_id IS NULL OR l.user_id != im.member_id)
+            UNION
+            SELECT lm.member_id AS member_id, {columns}
+            FROM logs l JOIN location_members lm ON lm.location_id = l.location_id
+            WHERE l.timestamp >= :cutoff AND (l.user_id IS NULL OR l.user_id != lm.member_id)
+        )
+    """)
+    with db.engine.begin() as conn:
+        conn.execute(statement, {'cutoff': cutoff})
+
+
+def _ensure_schema_ready():
+    """Run schema migrations and seeding once per process under the schema lock."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_once_lock:
+        if _schema_ready:
+            return
+        schema_lock_path = os.path.join(app.instance_path, 'benlab-startup-schema.lock')
+        with _exclusive_process_lock(schema_lock_path):
+            with app.app_context():
+                _run_schema_migrations_and_seed()
+        _schema_ready = True
+
+
+def cli_requires_schema(func):
+    """Make a CLI command bring the schema up to date first, without starting background jobs."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        _ensure_schema_ready()
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def _ensure_startup_initialized():
+    global _startup_done
+    if _startup_done:
+        return
+    with _startup_once_lock:
+        if _startup_done:
+            return
+
+        _ensure_schema_ready()
+        schema_lock_path = os.path.join(app.instance_path, 'benlab-startup-schema.lock')
+        with _exclusive_process_lock(schema_lock_path):
+            with app.app_context():
+                # 补写上次异常退出时尚未入库的审计日志
+                try:
+                    restored = replay_audit_spool()
+                except Exception as exc:
+                    app.logger.warning('审计日志暂存回放失败: %s', exc)
+                else:
+                    if restored:
+                        app.logger.info('已回放 %s 条暂存的审计日志', restored)
+
+        # 只允许一个 worker 启动后台线程（附件清理/DB 备份），避免重复跑。
+        jobs_lock_path = os.path.join(app.instance_path, 'benlab-startup-jobs.lock')
+        if _try_acquire_jobs_leader(jobs_lock_path):
+            _start_attachment_housekeeping()
+            _start_attachment_deletion_worker()
+            _start_db_backup_worker()
+            _start_log_archive_worker()
+            _start_depletion_forecast_worker()
+
+        _startup_done = True
+
+
+@app.before_request
+def _benlab_startup_before_request():
+    _ensure_startup_initialized()
+
+
+if hasattr(app, 'before_serving'):
+    @app.before_serving
+    def _benlab_startup_before_serving():
+        _ensure_startup_initialized()
+
+@login_manager.user_loader
+def load_user(user_id):
+    if not user_id:
+        return None
+    try:
+        return db.session.get(Member, int(user_id))
+    except (TypeError, ValueError):
+        return None
+
+# ---------------------------------------------------------------------------
+# 请求剖析（BENLAB_PROFILING=1 时启用）：记录 SQL、模板渲染与 OSS 签名耗时，
+# 提供 Prometheus 格式的 /metrics 与抽样慢请求日志
+# ---------------------------------------------------------------------------
+_PROFILE_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _RequestProfile:
+    """Timings accumulated while serving a single request."""
+
+    __slots__ = ('started', 'sql_count', 'sql_seconds', 'statements',
+                 'template_seconds', 'template_stack', 'oss_sign_count', 'oss_sign_seconds')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.statements = Counter()
+        self.template_seconds = 0.0
+        self.template_stack = []
+        self.oss_sign_count = 0
+        self.oss_sign_seconds = 0.0
+
+    def repeated_statements(self, threshold):
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+
+class _ProfilingMetrics:
+    """Process-wide counters rendered in Prometheus text exposition format."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._requests = Counter()
+        self._duration_sum = Counter()
+        self._duration_buckets = {}
+        self._sql_queries = Counter()
+        self._sql_seconds = Counter()
+        self._template_seconds = Counter()
+        self._oss_sign_seconds = Counter()
+        self._n_plus_one = Counter()
+        self._slow_requests = Counter()
+
+    def observe(self, endpoint, method, status, duration, profile, n_plus_one, slow):
+        key = (endpoint, method)
+        with self._lock:
+            self._requests[key + (str(status),)] += 1
+            self._duration_sum[key] += duration
+            counts = self._duration_buckets.setdefault(key, [0] * (len(self.buckets) + 1))
+            for index, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    counts[index] += 1
+            counts[-1] += 1
+            self._sql_queries[endpoint] += profile.sql_count
+            self._sql_seconds[endpoint] += profile.sql_seconds
+            self._template_seconds[endpoint] += profile.template_seconds
+            self._oss_sign_seconds[endpoint] += profile.oss_sign_seconds
+            if n_plus_one:
+                self._n_plus_one[endpoint] += 1
+            if slow:
+                self._slow_requests[endpoint] += 1
+
+    @staticmethod
+    def _labels(**labels):
+        parts = []
+        for name, value in labels.items():
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            parts.append(f'{name}="{value}"')
+        return '{' + ','.join(parts) + '}'
+
+    def render(self, extra_gauges=()):
+        lines = []
+
+        def counter(name, help_text, series, metric_type='counter'):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in series:
+                lines.append(f'{name}{self._labels(**labels)} {value}')
+
+        with self._lock:
+            counter('benlab_http_requests_total', 'HTTP requests served.', [
+                ({'endpoint': endpoint, 'method': method, 'status': status}, count)
+                for (endpoint, method, status), count in sorted(self._requests.items())
+            ])
+            lines.append('# HELP benlab_http_request_duration_seconds Request latency.')
+            lines.append('# TYPE benlab_http_request_duration_seconds histogram')
+            for (endpoint, method), counts in sorted(self._duration_buckets.items()):
+                for bound, count in zip(self.buckets, counts):
+                    labels = self._labels(endpoint=endpoint, method=method, le=bound)
+                    lines.append(f'benlab_http_request_duration_seconds_bucket{labels} {count}')
+                labels = self._labels(endpoint=endpoint, method=method, le='+Inf')
+                lines.append(f'benlab_http_request_duration_seconds_bucket{labels} {counts[-1]}')
+                labels = self._labels(endpoint=endpoint, method=method)
+                lines.append(f'benlab_http_request_duration_seconds_sum{labels} {self._duration_sum[(endpoint, method)]:.6f}')
+                lines.append(f'benlab_http_request_duration_seconds_count{labels} {counts[-1]}')
+            for name, help_text, values in (
+                ('benlab_sql_queries_total', 'SQL statements executed.', self._sql_queries),
+                ('benlab_sql_seconds_total', 'Time spent executing SQL.', self._sql_seconds),
+                ('benlab_template_render_seconds_total', 'Time spent rendering Jinja templates.', self._template_seconds),
+                ('benlab_oss_sign_seconds_total', 'Time spent signing OSS URLs.', self._oss_sign_seconds),
+                ('benlab_n_plus_one_requests_total', 'Requests that repeated one statement past the N+1 threshold.', self._n_plus_one),
+                ('benlab_slow_requests_total', 'Requests slower than PROFILING_SLOW_REQUEST_MS.', self._slow_requests),
+            ):
+                counter(name, help_text, [({'endpoint': endpoint}, value) for endpoint, value in sorted(values.items())])
+        for name, help_text, value in extra_gauges:
+            counter(name, help_text, [({}, value)], metric_type='gauge')
+        return '\n'.join(lines) + '\n'
+
+
+_profiling_metrics = _ProfilingMetrics(_PROFILE_DURATION_BUCKETS)
+_slow_log_lock = threading.Lock()
+
+
+def _current_profile():
+    if not app.config.get('BENLAB_PROFILING') or not has_request_context():
+        return None
+    return g.get('_benlab_profile')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _profile_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile() is not None:
+        conn.info.setdefault('_benlab_query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _profile_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile()
+    started = conn.info.get('_benlab_query_started')
+    if profile is None or not started:
+        return
+    profile.sql_seconds += time.perf_counter() - started.pop()
+    profile.sql_count += 1
+    profile.statements[statement] += 1
+
+
+@before_render_template.connect_via(app)
+def _profile_before_render(sender, template, context, **extra):
+    profile = _current_profile()
+    if profile is not None:
+        profile.template_stack.append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def _profile_template_rendered(sender, template, context, **extra):
+    profile = _current_profile()
+    if profile is not None and profile.template_stack:
+        profile.template_seconds += time.perf_counter() - profile.template_stack.pop()
+
+
+@contextlib.contextmanager
+def _profile_oss_signing():
+    profile = _current_profile()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.oss_sign_count += 1
+        profile.oss_sign_seconds += time.perf_counter() - started
+
+
+def _write_slow_request_log(entry):
+    path = app.config['PROFILING_SLOW_LOG_PATH']
+    line = json.dumps(entry, ensure_ascii=False)
+    try:
+        with _slow_log_lock:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as handle:
+                handle.write(line + '\n')
+    except OSError as exc:
+        app.logger.warning('写入慢请求日志失败: %s', exc)
+
+
+@app.before_request
+def _profile_request_start():
+    if app.config.get('BENLAB_PROFILING'):
+        g._benlab_profile = _RequestProfile()
+
+
+@app.after_request
+def _profile_request_finish(response):
+    profile = _current_profile()
+    if profile is None:
+        return response
+    duration = time.perf_counter() - profile.started
+    endpoint = request.endpoint or 'unknown'
+    repeated = profile.repeated_statements(app.config['PROFILING_N_PLUS_ONE_THRESHOLD'])
+    slow = duration * 1000 >= app.config['PROFILING_SLOW_REQUEST_MS']
+    _profiling_metrics.observe(endpoint, request.method, response.status_code, duration, profile, bool(repeated), slow)
+    response.headers['Server-Timing'] = ', '.join([
+        f'app;dur={duration * 1000:.1f}',
+        f'sql;desc="{profile.sql_count} queries";dur={profile.sql_seconds * 1000:.1f}',
+        f'tpl;dur={profile.template_seconds * 1000:.1f}',
+        f'oss;desc="{profile.oss_sign_count} signed";dur={profile.oss_sign_seconds * 1000:.1f}',
+    ])
+    if repeated:
+        app.logger.warning(
+            '疑似 N+1 查询 endpoint=%s 语句重复 %s 次: %s',
+            endpoint, repeated[0][1], ' '.join(repeated[0][0].split())[:200]
+        )
+    if slow and random.random() < app.config['PROFILING_SLOW_SAMPLE_RATE']:
+        _write_slow_request_log({
+            'at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'user_id': current_user.get_id() if current_user else None,
+            'duration_ms': round(duration * 1000, 1),
+            'sql_count': profile.sql_count,
+            'sql_ms': round(profile.sql_seconds * 1000, 1),
+            'template_ms': round(profile.template_seconds * 1000, 1),
+            'oss_sign_count': profile.oss_sign_count,
+            'oss_sign_ms': round(profile.oss_sign_seconds * 1000, 1),
+            'repeated_statements': [
+                {'statement': ' '.join(statement.split())[:500], 'count': count}
+                for statement, count in repeated[:5]
+            ],
+        })
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    if not app.config.get('BENLAB_PROFILING'):
+        abort(404)
+    token = app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization', '') != f'Bearer {token}':
+        abort(401)
+    fragment_stats = _fragment_cache.stats()
+    gauges = [
+        ('benlab_fragment_cache_entries', 'Rendered fragments held in the cache.', fragment_stats['entries']),
+        ('benlab_fragment_cache_hits', 'Fragment cache hits since start.', fragment_stats['hits']),
+        ('benlab_fragment_cache_misses', 'Fragment cache misses since start.', fragment_stats['misses']),
+        ('benlab_rich_text_cache_entries', 'Rendered rich text blocks held in the cache.', len(_rich_text_cache)),
+    ]
+    deletion_counts = attachment_deletion_counts()
+    gauges.extend((
+        ('benlab_attachment_deletions_pending', 'Stored files waiting for background deletion.', deletion_counts['pending']),
+        ('benlab_attachment_deletions_dead', 'Stored file deletions that exhausted their retries.', deletion_counts['dead']),
+    ))
+    if _write_queue is not None:
+        queue_stats = _write_queue.stats()
+        gauges.extend((
+            ('benlab_write_queue_pending', 'Mutations waiting for the SQLite writer.', queue_stats['pending']),
+            ('benlab_write_queue_batches', 'Write batches committed since start.', queue_stats['batches']),
+            ('benlab_write_queue_avg_batch', 'Average mutations per committed batch.', queue_stats['avg_batch']),
+            ('benlab_write_queue_avg_commit_ms', 'Average batch transaction time in milliseconds.', queue_stats['avg_commit_ms']),
+            ('benlab_write_queue_failed_writes', 'Queued mutations failed because their whole batch failed.', queue_stats['failed_writes']),
+        ))
+    body = _profiling_metrics.render(extra_gauges=gauges)
+    response = make_response(body)
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+# ---------------------------------------------------------------------------
+# 懒加载守卫：单个请求内同一关系懒加载次数超过上限时告警或抛错，用于发现 N+1
+# ---------------------------------------------------------------------------
+class LazyLoadLimitExceeded(RuntimeError):
+    """Raised when one relationship is lazy-loaded too often within a request."""
+
+
+@event.listens_for(OrmSession, 'do_orm_execute')
+def _guard_lazy_loads(orm_execute_state):
+    mode = app.config.get('LAZY_LOAD_GUARD')
+    if (
+        mode == 'off'
+        or not orm_execute_state.is_select
+        or orm_execute_state.lazy_loaded_from is None
+        or not has_request_context()
+    ):
+        return
+    relationship = str(orm_execute_state.loader_strategy_path[-1])
+    counts = g.setdefault('_lazy_load_counts', Counter())
+    counts[relationship] += 1
+    limit = app.config['LAZY_LOAD_GUARD_LIMIT']
+    if counts[relationship] != limit + 1:
+        return
+    message = f'{request.endpoint} 懒加载 {relationship} 超过 {limit} 次，请改用 selectinload/joinedload 预加载'
+    if mode == 'raise':
+        raise LazyLoadLimitExceeded(message)
+    app.logger.warning(message)
+
+
+@app.before_request
+def _reset_lazy_load_counts():
+    # CLI 审计在同一应用上下文内连续发请求，g 会被复用，需逐请求清零
+    if app.config.get('LAZY_LOAD_GUARD') != 'off':
+        g._lazy_load_counts = Counter()
+
+
+# 审计时为路由参数挑选样本 ID 的模型映射；其余带参数的路由跳过
+_AUDIT_ROUTE_ARGUMENT_MODELS = {
+    'item_id': 'Item',
+    'loc_id': 'Location',
+    'location_id': 'Location',
+    'member_id': 'Member',
+    'event_id': 'Event',
+}
+_AUDIT_SKIPPED_ENDPOINTS = {
+    'static', 'uploaded_attachment', 'logout', 'export_data', 'metrics',
+    'event_share_poster', 'event_share_entry', 'login', 'register',
+}
+
+
+def _audit_route_urls(sample_count):
+    """Yield (endpoint, url) for every parameterless or ID-only GET route."""
+    samples = {}
+    for argument, model_name in _AUDIT_ROUTE_ARGUMENT_MODELS.items():
+        model = globals()[model_name]
+        samples[argument] = [
+            row_id for (row_id,) in
+            db.session.query(model.id).order_by(model.id.desc()).limit(sample_count)
+        ]
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if 'GET' not in rule.methods or rule.endpoint in _AUDIT_SKIPPED_ENDPOINTS:
+            continue
+        arguments = sorted(rule.arguments)
+        if not arguments:
+            yield rule.endpoint, url_for(rule.endpoint)
+            continue
+        if len(arguments) != 1 or arguments[0] not in samples:
+            continue
+        for row_id in samples[arguments[0]]:
+            yield rule.endpoint, url_for(rule.endpoint, **{arguments[0]: row_id})
+
+
+@app.cli.command('audit-queries')
+@click.option('--user', 'username', default='admin', show_default=True, help='以该成员身份访问各页面')
+@click.option('--limit', type=int, default=None, help='同一关系允许的懒加载次数（默认读取 LAZY_LOAD_GUARD_LIMIT）')
+@click.option('--samples', type=int, default=3, show_default=True, help='每个详情路由抽取的实体数')
+@cli_requires_schema
+def audit_queries_command(username, limit, samples):
+    """Request every GET page and fail if any relationship is lazy-loaded past the limit."""
+    member = Member.query.filter_by(username=username).first()
+    if member is None:
+        raise click.ClickException(f'成员 {username} 不存在')
+    with app.test_request_context():
+        targets = list(_audit_route_urls(max(1, samples)))
+    previous = {
+        key: app.config.get(key)
+        for key in ('LAZY_LOAD_GUARD', 'LAZY_LOAD_GUARD_LIMIT', 'RESPONSE_CACHE_BACKEND', 'PROPAGATE_EXCEPTIONS')
+    }
+    app.config.update(LAZY_LOAD_GUARD='raise', RESPONSE_CACHE_BACKEND='off', PROPAGATE_EXCEPTIONS=True)
+    if limit is not None:
+        app.config['LAZY_LOAD_GUARD_LIMIT'] = max(1, limit)
+    failures = 0
+    try:
+        client = app.test_client()
+        with client.session_transaction() as flask_session:
+            flask_session['_user_id'] = str(member.id)
+            flask_session['_fresh'] = True
+        for endpoint, url in targets:
+            with client:
+                try:
+                    response = client.get(url)
+                except LazyLoadLimitExceeded as exc:
+                    failures += 1
+                    click.echo(f'FAIL {url}: {exc}')
+                    db.session.remove()
+                    continue
+                counts = g.get('_lazy_load_counts') or Counter()
+                # CLI 的应用上下文跨请求复用，已加载的集合会掩盖后续请求的懒加载
+                db.session.remove()
+                worst = ', '.join(f'{name}×{count}' for name, count in counts.most_common(3))
+                if response.status_code >= 500:
+                    failures += 1
+                    click.echo(f'ERROR {url}: HTTP {response.status_code}')
+                else:
+                    click.echo(f'ok   {url} [{response.status_code}] 懒加载 {sum(counts.values())} 次 {worst}'.rstrip())
+    finally:
+        app.config.update(previous)
+    if failures:
+        raise click.ClickException(f'{failures} 个页面存在懒加载超限或错误')
+    click.echo(f'已检查 {len(targets)} 个页面，未发现懒加载超限')
+
+
+# ---------------------------------------------------------------------------
+# 响应缓存：按用户缓存只读页面，ETag 由数据水位线计算，命中时可直接 304
+# ---------------------------------------------------------------------------
+class _MemoryResponseCache:
+    """Per-process LRU of rendered responses."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires_at'] < time.time():
+                self._entries.pop(key, None)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class _SQLiteResponseCache:
+    """Response store in a local SQLite file so every worker on the host shares hits."""
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS response_cache ('
+                ' key TEXT PRIMARY KEY, etag TEXT NOT NULL, body BLOB NOT NULL,'
+                ' mimetype TEXT, expires_at REAL NOT NULL, stored_at REAL NOT NULL)'
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT etag, body, mimetype, expires_at FROM response_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or row[3] < time.time():
+            return None
+        return {'etag': row[0], 'body': row[1], 'mimetype': row[2], 'expires_at': row[3]}
+
+    def set(self, key, entry):
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            'INSERT OR REPLACE INTO response_cache (key, etag, body, mimetype, expires_at, stored_at)'
+            ' VALUES (?, ?, ?, ?, ?, ?)',
+            (key, entry['etag'], entry['body'], entry['mimetype'], entry['expires_at'], now)
+        )
+        # 简单的容量控制：偶尔清理过期项与最旧的条目
+        if int(now * 1000) % 50 == 0:
+            conn.execute('DELETE FROM response_cache WHERE expires_at < ?', (now,))
+            conn.execute(
+                'DELETE FROM response_cache WHERE key NOT IN '
+                '(SELECT key FROM response_cache ORDER BY stored_at DESC LIMIT ?)',
+                (self.max_entries,)
+            )
+
+
+_response_cache_backend = None
+_response_cache_backend_lock = threading.Lock()
+
+
+def _get_response_cache():
+    global _response_cache_backend
+    kind = app.config.get('RESPONSE_CACHE_BACKEND')
+    if kind == 'off':
+        return None
+    if _response_cache_backend is None:
+        with _response_cache_backend_lock:
+            if _response_cache_backend is None:
+                max_entries = app.config.get('RESPONSE_CACHE_MAX_ENTRIES', 512)
+                if kind == 'sqlite':
+                    _response_cache_backend = _SQLiteResponseCache(app.config['RESPONSE_CACHE_PATH'], max_entries)
+                else:
+                    _response_cache_backend = _MemoryResponseCache(max_entries)
+    return _response_cache_backend
+
+
+def _signed_url_window_seconds():
+    """Half the OSS signed-URL lifetime when rendered HTML embeds signed URLs, else None."""
+    if app.config.get('USE_OSS') and not app.config.get('OSS_ASSUME_PUBLIC'):
+        signed_expiry = max(60, int(app.config.get('DIRECT_UPLOAD_URL_EXPIRATION', 900) or 900))
+        return signed_expiry // 2
+    return None
+
+
+def _response_cache_window_seconds():
+    """Cache lifetime; with private OSS the page embeds signed URLs, so stay well inside their expiry."""
+    window = app.config.get('RESPONSE_CACHE_TTL_SECONDS', 300)
+    signed_window = _signed_url_window_seconds()
+    if signed_window:
+        window = min(window, signed_window)
+    return max(1, window)
+
+
+def _response_cache_watermark():
+    """Return `(token, last_modified)` summarizing the data the cached pages render.
+
+    One round trip of indexed aggregates: row counts catch inserts/deletes,
+    max(last_modified/updated_at) catches edits, association counts catch link changes,
+    and the depletion_forecast generation catches forecast rebuilds.
+    """
+    aggregates = []
+    for table, stamp_column in (
+        (Item.__table__, Item.__table__.c.last_modified),
+        (Location.__table__, Location.__table__.c.last_modified),
+        (Member.__table__, Member.__table__.c.last_modified),
+        (Event.__table__, Event.__table__.c.updated_at),
+    ):
+        aggregates.append(db.select(func.count()).select_from(table).scalar_subquery())
+        aggregates.append(db.select(func.max(stamp_column)).scalar_subquery())
+    for table in (
+        Attachment.__table__, item_locations, item_members, location_members,
+        member_follows, event_items, event_locations, EventParticipant.__table__
+    ):
+        aggregates.append(db.select(func.count()).select_from(table).scalar_subquery())
+    aggregates.append(
+        db.select(CacheVersion.version).where(CacheVersion.name == _DEPLETION_FORECAST_CACHE_KEY).scalar_subquery()
+    )
+    values = db.session.execute(db.select(*aggregates)).one()
+    stamps = [value for value in values if isinstance(value, datetime)]
+    last_modified = max(stamps) if stamps else None
+    token = '|'.join('' if value is None else str(value) for value in values)
+    return token, last_modified
+
 
-    # 仅在“全新库（members 为空）”时创建默认管理员；存在则跳过。
-    try:
-        has_any_member = db.session.query(Member.id).limit(1).first() is not None
-    except Exception:
-        has_any_member = True
-    if not has_any_member and not Member.query.filter_by(username="admin").first():
-        default_user = Member(
-            name="Admin User",
-            username="admin",
-            contact="admin@example.com",
-            notes="Default admin user",
-        )
-        default_user.set_password("admin")
-        db.session.add(default_user)
-        try:
-            db.session.commit()
-        except IntegrityError:
-            # 多 worker 并发或重复运行时，若已存在同名用户则忽略。
-            db.session.rollback()
+def cached_view(view):
+    """Per-user response cache with ETag/Last-Modified validators for read-only GET pages.
 
+    The ETag hashes the user, the full path, the data watermark and the current
+    cache window, so any data change or window rollover produces a new tag.
+    Requests with pending flash messages bypass the cache entirely.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        backend = _get_response_cache()
+        if (
+            backend is None
+            or request.method != 'GET'
+            or not current_user.is_authenticated
+            or session.get('_flashes')
+        ):
+            return view(*args, **kwargs)
+        window = _response_cache_window_seconds()
+        watermark, last_modified = _response_cache_watermark()
+        cache_key = f"{current_user.id}:{request.full_path}"
+        etag = hashlib.sha1(
+            f"{cache_key}|{watermark}|{int(time.time() // window)}".encode('utf-8')
+        ).hexdigest()
+
+        def finalize(response):
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified.replace(tzinfo=UTC)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+        if request.if_none_match.contains(etag):
+            return finalize(app.response_class(status=304))
+        cached = backend.get(cache_key)
+        if cached and cached['etag'] == etag:
+            return finalize(app.response_class(cached['body'], mimetype=cached['mimetype']))
+        response = make_response(view(*args, **kwargs))
+        # 视图内 flash 并已渲染的页面带有一次性消息，不能缓存
+        if (
+            response.status_code != 200
+            or response.direct_passthrough
+            or session.get('_flashes')
+            or getattr(request_ctx, 'flashes', None)
+        ):
+            return response
+        backend.set(cache_key, {
+            'etag': etag,
+            'body': response.get_data(),
+            'mimetype': response.mimetype,
+            'expires_at': time.time() + window,
+        })
+        return finalize(response)
 
-def _ensure_startup_initialized():
-    global _startup_done
-    if _startup_done:
-        return
-    with _startup_once_lock:
-        if _startup_done:
-            return
+    return wrapper
 
-        schema_lock_path = os.path.join(app.instance_path, 'benlab-startup-schema.lock')
-        with _exclusive_process_lock(schema_lock_path):
-            with app.app_context():
-                _run_schema_migrations_and_seed()
 
-        # 只允许一个 worker 启动后台线程（附件清理/DB 备份），避免重复跑。
-        jobs_lock_path = os.path.join(app.instance_path, 'benlab-startup-jobs.lock')
-        if _try_acquire_jobs_leader(jobs_lock_path):
-            _start_attachment_housekeeping()
-            _start_db_backup_worker()
+# ---------------------------------------------------------------------------
+# SQLite 单写者队列：写操作交给一个后台线程，按批在同一事务内提交
+# ---------------------------------------------------------------------------
+_WriteRequest = namedtuple('_WriteRequest', 'label func args actor_id future enqueued_at')
 
-        _startup_done = True
 
+class _SQLiteWriteQueue:
+    """One writer thread per process that commits queued mutations in batches.
 
-@app.before_request
-def _benlab_startup_before_request():
-    _ensure_startup_initialized()
+    Only mutations submitted through run_write are queued; every other write
+    path still commits on its own connection and competes for the lock.
 
+    The batch opens with BEGIN IMMEDIATE so the write lock is taken once up
+    front, each mutation runs in its own SAVEPOINT (a failing one is rolled back
+    and reported on its future without affecting the others), and the whole
+    batch is committed together. Futures resolve only after that commit.
+    """
 
-if hasattr(app, 'before_serving'):
-    @app.before_serving
-    def _benlab_startup_before_serving():
-        _ensure_startup_initialized()
+    def __init__(self, max_batch, linger_seconds):
+        self.max_batch = max_batch
+        self.linger_seconds = linger_seconds
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._totals = Counter()
+        self._labels = {}
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sqlite-write-queue', daemon=True)
+                self._thread.start()
+
+    def submit(self, label, func, *args, actor_id=None):
+        future = Future()
+        self.start()
+        self._queue.put(_WriteRequest(label, func, args, actor_id, future, time.perf_counter()))
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.linger_seconds
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
 
-@login_manager.user_loader
-def load_user(user_id):
-    if not user_id:
-        return None
+    def _run(self):
+        with app.app_context():
+            while True:
+                batch = self._next_batch()
+                try:
+                    self._commit_batch(batch)
+                except Exception as exc:  # keep the writer alive
+                    app.logger.exception('写队列批次处理失败: %s', exc)
+                    with contextlib.suppress(Exception):
+                        db.session.rollback()
+                    self._fail_unresolved(batch, exc)
+                finally:
+                    g.pop('write_queue_actor_id', None)
+                    db.session.remove()
+
+    def _commit_batch(self, batch):
+        started = time.perf_counter()
+        db.session.connection().exec_driver_sql('BEGIN IMMEDIATE')
+        done = []
+        for write in batch:
+            if not write.future.set_running_or_notify_cancel():
+                continue
+            g.write_queue_actor_id = write.actor_id
+            wait = time.perf_counter() - write.enqueued_at
+            pending_logs = db.session.info.setdefault(_AUDIT_PENDING_KEY, [])
+            logged_before = len(pending_logs)
+            try:
+                with db.session.begin_nested():
+                    result = write.func(*write.args)
+            except Exception as exc:
+                # 回滚到 SAVEPOINT 的写入不应留下审计日志
+                del pending_logs[logged_before:]
+                self._observe(write, wait, failed=True)
+                write.future.set_exception(exc)
+                continue
+            done.append((write, wait, result))
+        try:
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            for write, wait, _result in done:
+                self._observe(write, wait, failed=True)
+                write.future.set_exception(exc)
+            raise
+        for write, wait, result in done:
+            self._observe(write, wait)
+            write.future.set_result(result)
+        with self._lock:
+            self._totals['batches'] += 1
+            self._totals['batched_writes'] += len(batch)
+            self._totals['commit_seconds'] += time.perf_counter() - started
+            self._totals['max_batch'] = max(self._totals['max_batch'], len(batch))
+
+    def _fail_unresolved(self, batch, exc):
+        # BEGIN IMMEDIATE 等锁超时或批次中途出错时，未决的写入一律以失败告知调用方
+        failed = 0
+        for write in batch:
+            future = write.future
+            if future.done():
+                continue
+            if not future.running() and not future.set_running_or_notify_cancel():
+                continue
+            self._observe(write, time.perf_counter() - write.enqueued_at, failed=True)
+            future.set_exception(exc)
+            failed += 1
+        with self._lock:
+            self._totals['failed_batches'] += 1
+            self._totals['failed_writes'] += failed
+
+    def _observe(self, write, wait, failed=False):
+        latency = time.perf_counter() - write.enqueued_at
+        with self._lock:
+            stats = self._labels.setdefault(write.label, Counter())
+            stats['count'] += 1
+            stats['failed'] += int(failed)
+            stats['wait_seconds'] += wait
+            stats['latency_seconds'] += latency
+            stats['max_latency_seconds'] = max(stats['max_latency_seconds'], latency)
+
+    def stats(self):
+        with self._lock:
+            labels = {
+                label: {
+                    'count': stats['count'],
+                    'failed': stats['failed'],
+                    'avg_wait_ms': round(stats['wait_seconds'] / stats['count'] * 1000, 2) if stats['count'] else 0,
+                    'avg_latency_ms': round(stats['latency_seconds'] / stats['count'] * 1000, 2) if stats['count'] else 0,
+                    'max_latency_ms': round(stats['max_latency_seconds'] * 1000, 2),
+                }
+                for label, stats in sorted(self._labels.items())
+            }
+            batches = self._totals['batches']
+            return {
+                'pending': self._queue.qsize(),
+                'batches': batches,
+                'avg_batch': round(self._totals['batched_writes'] / batches, 2) if batches else 0,
+                'max_batch': self._totals['max_batch'],
+                'avg_commit_ms': round(self._totals['commit_seconds'] / batches * 1000, 2) if batches else 0,
+                'failed_batches': self._totals['failed_batches'],
+                'failed_writes': self._totals['failed_writes'],
+                'writes': labels,
+            }
+
+
+_write_queue = (
+    _SQLiteWriteQueue(
+        app.config['SQLITE_WRITE_QUEUE_BATCH'],
+        app.config['SQLITE_WRITE_QUEUE_LINGER_MS'] / 1000
+    )
+    if app.config['SQLITE_WRITE_QUEUE'] and app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+    else None
+)
+
+
+def run_write(label, func, *args):
+    """Run `func(*args)` against db.session and commit it; returns func's result.
+
+    With SQLITE_WRITE_QUEUE on, `func` runs on the writer thread in a different
+    session, so it must look rows up by id itself and return plain values
+    (ids, flags), never ORM objects.
+    """
+    if _write_queue is None:
+        result = func(*args)
+        db.session.commit()
+        return result
+    # 先结束请求会话的读事务，写入提交后再读才能看到最新数据
+    db.session.commit()
+    future = _write_queue.submit(label, func, *args, actor_id=_current_actor_id())
     try:
-        return db.session.get(Member, int(user_id))
-    except (TypeError, ValueError):
-        return None
+        return future.result(timeout=app.config['SQLITE_WRITE_QUEUE_TIMEOUT_SECONDS'])
+    except FutureTimeoutError:
+        abort(503, description='写入排队超时，请稍后刷新确认是否已保存')
+    except OperationalError:
+        # 写线程拿不到数据库写锁（被其他进程长时间占用），该批写入未保存
+        abort(503, description='数据库繁忙，写入未保存，请稍后重试')
+
 
 # 路由定义
 @app.route('/')
@@ -3757,31 +6964,427 @@ def temporary_page(page_id):
     return send_from_directory(TEMP_PAGE_DIR, filename)
 
 
-@app.route('/events')
-@login_required
-def events_overview():
-    events_query = Event.query.options(
+_EVENTS_PAST_PAGE_SIZE = 20
+_EVENT_RANGE_MAX_DAYS = 366
+_EVENT_RANGE_MAX_RESULTS = 1000
+# 范围查询只按 start_time 走索引；跨越窗口起点的活动最多向前回溯这么多天
+_EVENT_RANGE_LOOKBEHIND_DAYS = 31
+_EVENT_FEED_DEFAULT_PAST_DAYS = 30
+_EVENT_FEED_DEFAULT_FUTURE_DAYS = 180
+
+
+def _accessible_events_query(member_id):
+    return Event.query.options(
         selectinload(Event.owner),
         selectinload(Event.locations),
         selectinload(Event.attachments),
         selectinload(Event.participant_links).selectinload(EventParticipant.member)
+    ).filter(_event_visibility_clause(member_id))
+
+
+@app.route('/events')
+@login_required
+@cached_view
+def events_overview():
+    now = datetime.utcnow()
+    active_series = and_(
+        Event.recurrence_rule.isnot(None),
+        Event.start_time.isnot(None),
+        or_(Event.recurrence_until.is_(None), Event.recurrence_until >= now)
     )
-    accessible_events = events_query.filter(
-        or_(
-            Event.visibility == 'public',
-            Event.owner_id == current_user.id,
-            Event.participant_links.any(EventParticipant.member_id == current_user.id)
-        )
+    # 即将开始的事项数量有限，整体加载；历史事项按时间倒序分页，只取当前页
+    upcoming_events = _accessible_events_query(current_user.id).filter(
+        or_(Event.start_time.is_(None), Event.start_time >= now, active_series)
     ).order_by(Event.start_time.asc(), Event.created_at.desc()).all()
+    # 仍在进行的重复事项按下一场时间排序
+    next_occurrences = _next_occurrences_by_event(
+        [ev for ev in upcoming_events if ev.is_recurring], now
+    )
+    upcoming_events.sort(key=lambda ev: (
+        ev.start_time is None,
+        next_occurrences[ev.id].start_time if ev.id in next_occurrences else ev.start_time or now
+    ))
+    page = max(1, request.args.get('page', type=int) or 1)
+    past_rows = _accessible_events_query(current_user.id).filter(
+        Event.start_time < now, not_(active_series)
+    ).order_by(Event.start_time.desc(), Event.id.desc()) \
+        .offset((page - 1) * _EVENTS_PAST_PAGE_SIZE).limit(_EVENTS_PAST_PAGE_SIZE + 1).all()
+    past_events = past_rows[:_EVENTS_PAST_PAGE_SIZE]
+    return render_template(
+        'events.html',
+        now=now,
+        upcoming_events=upcoming_events,
+        next_occurrences=next_occurrences,
+        past_events=past_events,
+        past_page=page,
+        past_has_next=len(past_rows) > _EVENTS_PAST_PAGE_SIZE,
+        calendar_feed_url=build_calendar_feed_url(current_user)
+    )
+
+
+def _parse_event_range(default_past_days=None, default_future_days=None):
+    """Read `from`/`to` query parameters as naive UTC datetimes.
+
+    Returns (start, end, error_response). Missing bounds fall back to the given
+    defaults relative to now; without defaults they are required.
+    """
     now = datetime.utcnow()
-    upcoming_events = []
-    past_events = []
-    for event in accessible_events:
-        if event.start_time and event.start_time < now:
-            past_events.append(event)
+    bounds = []
+    for name, default_days in (('from', default_past_days), ('to', default_future_days)):
+        raw = (request.args.get(name) or '').strip()
+        if not raw:
+            if default_days is None:
+                return None, None, (jsonify({'error': 'missing_range', 'message': f'缺少 {name} 参数'}), 400)
+            offset = timedelta(days=default_days)
+            bounds.append(now - offset if name == 'from' else now + offset)
+            continue
+        value = _as_utc(raw)
+        if value is None:
+            return None, None, (jsonify({'error': 'invalid_range', 'message': f'{name} 需为 ISO 日期或时间'}), 400)
+        bounds.append(value.replace(tzinfo=None))
+    start, end = bounds
+    if end <= start:
+        return None, None, (jsonify({'error': 'invalid_range', 'message': 'to 必须晚于 from'}), 400)
+    if end - start > timedelta(days=_EVENT_RANGE_MAX_DAYS):
+        return None, None, (jsonify({'error': 'range_too_large', 'message': f'时间范围不能超过 {_EVENT_RANGE_MAX_DAYS} 天'}), 400)
+    return start, end, None
+
+
+def _next_occurrences_by_event(events, now, horizon_days=366):
+    """First upcoming (or ongoing) occurrence of each recurring event, keyed by event id."""
+    result = {}
+    for occurrence in expand_event_occurrences(events, now, now + timedelta(days=horizon_days)):
+        result.setdefault(occurrence.event.id, occurrence)
+    return result
+
+
+def _query_event_occurrences_in_range(member_id, start, end):
+    """Occurrences of visible events overlapping [start, end), ordered by start time.
+
+    One-off events are matched by start_time; recurring series are selected by
+    their recurrence_until bound and expanded only inside the window.
+    """
+    rows = (
+        Event.query
+        .options(selectinload(Event.owner), selectinload(Event.locations))
+        .filter(
+            or_(
+                and_(
+                    Event.recurrence_rule.is_(None),
+                    Event.start_time >= start - timedelta(days=_EVENT_RANGE_LOOKBEHIND_DAYS),
+                    Event.start_time < end
+                ),
+                _recurring_series_in_window(start, end)
+            ),
+            _event_visibility_clause(member_id)
+        )
+        .order_by(Event.start_time.asc(), Event.id.asc())
+        .limit(_EVENT_RANGE_MAX_RESULTS)
+        .all()
+    )
+    return expand_event_occurrences(rows, start, end)[:_EVENT_RANGE_MAX_RESULTS]
+
+
+def _isoformat_utc(value):
+    return value.replace(tzinfo=UTC).isoformat().replace('+00:00', 'Z') if value else None
+
+
+@app.route('/api/events')
+@login_required
+def events_in_range():
+    """Events visible to the current user overlapping `?from=&to=` (ISO dates or datetimes)."""
+    start, end, error = _parse_event_range()
+    if error:
+        return error
+    occurrences = _query_event_occurrences_in_range(current_user.id, start, end)
+    return jsonify({
+        'from': _isoformat_utc(start),
+        'to': _isoformat_utc(end),
+        'events': [
+            {
+                'id': occ.event.id,
+                'title': occ.title,
+                'start': _isoformat_utc(occ.start_time),
+                'end': _isoformat_utc(occ.end_time if occ.event.is_recurring else occ.event.end_time),
+                'occurrenceStart': _isoformat_utc(occ.original_start),
+                'recurring': occ.event.is_recurring,
+                'visibility': occ.event.visibility,
+                'ownerName': (occ.event.owner.name or occ.event.owner.username) if occ.event.owner else None,
+                'locations': [loc.name for loc in occ.event.locations],
+                'detailUrl': url_for('event_detail', event_id=occ.event.id),
+            }
+            for occ in occurrences
+        ],
+    })
+
+
+_OCCURRENCE_ACTIONS = ('cancel', 'reschedule', 'reset')
+
+
+def _parse_datetime_param(raw):
+    value = parse_datetime_local(raw) if isinstance(raw, str) else None
+    if value is None:
+        parsed = _as_utc(raw)
+        value = parsed.replace(tzinfo=None) if parsed else None
+    return value
+
+
+@app.route('/api/events/<int:event_id>/occurrences', methods=['POST'])
+@login_required
+def update_event_occurrence(event_id):
+    """Cancel, reschedule or reset one occurrence of a recurring event.
+
+    Body: `occurrence_start` (the occurrence's original start), `action`
+    (cancel/reschedule/reset) and for reschedule `start_time`, `end_time`,
+    `title`. Form posts redirect back to the event page.
+    """
+    event = Event.query.options(selectinload(Event.occurrence_overrides)).get_or_404(event_id)
+    if not event.can_edit(current_user):
+        abort(403)
+    payload = request.get_json(silent=True)
+    is_json = payload is not None
+    if not is_json:
+        payload = request.form.to_dict()
+
+    def fail(code, message):
+        if is_json:
+            return jsonify({'error': code, 'message': message}), 400
+        flash(message, 'danger')
+        return redirect(url_for('event_detail', event_id=event.id))
+
+    if not event.is_recurring:
+        return fail('not_recurring', '该事项不是重复事项')
+    action = (payload.get('action') or '').strip()
+    if action not in _OCCURRENCE_ACTIONS:
+        return fail('invalid_action', 'action 需为 cancel、reschedule 或 reset')
+    original_start = _parse_datetime_param(payload.get('occurrence_start'))
+    rule = parse_recurrence_rule(event.recurrence_rule)
+    if original_start is None or next(
+        iter_occurrence_starts(event.start_time, rule, original_start, original_start + timedelta(seconds=1)),
+        None
+    ) != original_start:
+        return fail('invalid_occurrence', '指定的场次不在重复规则内')
+
+    override = next((o for o in event.occurrence_overrides if o.original_start == original_start), None)
+    if action == 'reset':
+        if override is not None:
+            event.occurrence_overrides.remove(override)
+    else:
+        if override is None:
+            override = EventOccurrenceOverride(original_start=original_start)
+            event.occurrence_overrides.append(override)
+        if action == 'cancel':
+            override.cancelled = True
         else:
-            upcoming_events.append(event)
-    return render_template('events.html', events=accessible_events, now=now, upcoming_events=upcoming_events, past_events=past_events)
+            start_time = _parse_datetime_param(payload.get('start_time'))
+            end_time = _parse_datetime_param(payload.get('end_time'))
+            if payload.get('start_time') and start_time is None:
+                return fail('invalid_time', '调整后的开始时间格式无效')
+            if start_time and end_time and end_time < start_time:
+                return fail('invalid_time', '结束时间不能早于开始时间')
+            override.cancelled = False
+            override.start_time = start_time
+            override.end_time = end_time
+            override.title = (payload.get('title') or '').strip() or None
+    event.touch()
+    record_log(
+        user_id=current_user.id,
+        event_id=event.id,
+        action_type="调整重复事项",
+        details=f"{action} occurrence {original_start.isoformat()} of event {event.title}"
+    )
+    db.session.commit()
+    if not is_json:
+        flash({'cancel': '该场次已取消', 'reschedule': '该场次已调整', 'reset': '该场次已恢复'}[action], 'success')
+        return redirect(url_for('event_detail', event_id=event.id))
+    return jsonify({
+        'eventId': event.id,
+        'occurrenceStart': _isoformat_utc(original_start),
+        'action': action,
+        'cancelled': action == 'cancel',
+    })
+
+
+_AVAILABILITY_DEFAULT_DAYS = 7
+
+
+def _reservation_payload(reservation):
+    other = reservation.event
+    visible = bool(other and other.can_view(current_user))
+    return {
+        'resourceType': reservation.resource_type,
+        'resourceId': reservation.resource_id,
+        'start': _isoformat_utc(reservation.start_time),
+        'end': _isoformat_utc(reservation.end_time),
+        'eventId': reservation.event_id if visible else None,
+        'eventTitle': other.title if visible else None,
+    }
+
+
+def _parse_id_list_param(name):
+    ids = set()
+    for token in (request.args.get(name) or '').split(','):
+        token = token.strip()
+        if token.isdigit():
+            ids.add(int(token))
+    return ids
+
+
+@app.route('/api/reservations/conflicts')
+@login_required
+def reservation_conflicts():
+    """Reservations overlapping `?from=&to=` for `item_ids=1,2` / `location_ids=3` (optionally excluding one event)."""
+    start, end, error = _parse_event_range()
+    if error:
+        return error
+    resources = [('item', item_id) for item_id in _parse_id_list_param('item_ids')]
+    resources += [('location', loc_id) for loc_id in _parse_id_list_param('location_ids')]
+    conflicts = _find_reservation_conflicts(
+        resources, start, end, exclude_event_id=request.args.get('exclude_event_id', type=int)
+    )
+    return jsonify({'conflicts': [_reservation_payload(reservation) for reservation in conflicts]})
+
+
+@app.route('/api/reservations/availability')
+@login_required
+def resource_availability():
+    """Busy intervals and free slots of one item/location between `from` and `to` (default: next 7 days)."""
+    resource_type = request.args.get('type')
+    resource_id = request.args.get('id', type=int)
+    if resource_type not in _RESERVATION_RESOURCE_TYPES or not resource_id:
+        return jsonify({'error': 'invalid_resource', 'message': 'type 需为 item 或 location，并提供 id'}), 400
+    model = Item if resource_type == 'item' else Location
+    resource = db.session.get(model, resource_id)
+    if resource is None:
+        return jsonify({'error': 'not_found', 'message': '资源不存在'}), 404
+    start, end, error = _parse_event_range(0, _AVAILABILITY_DEFAULT_DAYS)
+    if error:
+        return error
+    min_slot = timedelta(minutes=max(0, request.args.get('minutes', type=int) or 0))
+    reservations = _find_reservation_conflicts([(resource_type, resource_id)], start, end)
+    busy = []
+    free = []
+    cursor = start
+    for reservation in reservations:
+        if reservation.start_time > cursor and reservation.start_time - cursor >= min_slot:
+            free.append({'start': _isoformat_utc(cursor), 'end': _isoformat_utc(reservation.start_time)})
+        cursor = max(cursor, reservation.end_time)
+        busy.append(_reservation_payload(reservation))
+    if end > cursor and end - cursor >= min_slot:
+        free.append({'start': _isoformat_utc(cursor), 'end': _isoformat_utc(end)})
+    return jsonify({
+        'resource': {'type': resource_type, 'id': resource.id, 'name': resource.name},
+        'from': _isoformat_utc(start),
+        'to': _isoformat_utc(end),
+        'busy': busy,
+        'free': free,
+    })
+
+
+def _calendar_feed_serializer():
+    return URLSafeTimedSerializer(secret_key=app.config['SECRET_KEY'], salt='benlab-calendar-feed')
+
+
+def _calendar_feed_fingerprint(member):
+    # 与密码哈希绑定：修改密码即可吊销已分发的订阅链接
+    return hashlib.sha1((member.password_hash or '').encode('utf-8')).hexdigest()[:12]
+
+
+def build_calendar_feed_url(member):
+    token = _calendar_feed_serializer().dumps({'member_id': member.id, 'fp': _calendar_feed_fingerprint(member)})
+    return url_for('events_calendar_feed', token=token, _external=True)
+
+
+def _ical_escape(value):
+    return (
+        _ensure_string(value)
+        .replace('\\', '\\\\')
+        .replace(';', '\\;')
+        .replace(',', '\\,')
+        .replace('\r\n', '\\n')
+        .replace('\n', '\\n')
+    )
+
+
+def _ical_fold(line):
+    """Fold a content line at 75 octets without splitting UTF-8 sequences (RFC 5545 §3.1)."""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    current = ''
+    current_size = 0
+    for char in line:
+        size = len(char.encode('utf-8'))
+        if current_size + size > 75:
+            parts.append(current)
+            # 续行以一个空格开头，空格计入该行的 75 字节
+            current = ' '
+            current_size = 1
+        current += char
+        current_size += size
+    parts.append(current)
+    return '\r\n'.join(parts)
+
+
+def _ical_datetime(value):
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+@app.route('/events/feed.ics')
+def events_calendar_feed():
+    """iCalendar feed of visible events, authenticated by session or a per-member `?token=`."""
+    member = current_user if current_user.is_authenticated else None
+    token = request.args.get('token')
+    if token:
+        try:
+            payload = _calendar_feed_serializer().loads(token)
+        except BadSignature:
+            abort(403)
+        member = db.session.get(Member, payload.get('member_id'))
+        if member is None or payload.get('fp') != _calendar_feed_fingerprint(member):
+            abort(403)
+    if member is None:
+        abort(401)
+    start, end, error = _parse_event_range(_EVENT_FEED_DEFAULT_PAST_DAYS, _EVENT_FEED_DEFAULT_FUTURE_DAYS)
+    if error:
+        return error
+    stamp = _ical_datetime(datetime.utcnow())
+    host = urlsplit(request.host_url).hostname or 'benlab'
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Benlab//Events//ZH',
+        'CALSCALE:GREGORIAN',
+        'X-WR-CALNAME:Benlab 事项',
+    ]
+    for occ in _query_event_occurrences_in_range(member.id, start, end):
+        ev = occ.event
+        # 重复事项的每一场单独输出，UID 带上原开始时间以保持稳定
+        uid = f'event-{ev.id}-{_ical_datetime(occ.original_start)}' if ev.is_recurring else f'event-{ev.id}'
+        lines.extend([
+            'BEGIN:VEVENT',
+            f'UID:{uid}@{host}',
+            f'DTSTAMP:{stamp}',
+            f'DTSTART:{_ical_datetime(occ.start_time)}',
+            f'DTEND:{_ical_datetime(occ.end_time)}',
+            f'SUMMARY:{_ical_escape(occ.title)}',
+            f'URL:{url_for("event_detail", event_id=ev.id, _external=True)}',
+        ])
+        if ev.locations:
+            lines.append(f"LOCATION:{_ical_escape('、'.join(loc.name for loc in ev.locations))}")
+        if ev.description:
+            lines.append(f'DESCRIPTION:{_ical_escape(ev.description)}')
+        if ev.updated_at:
+            lines.append(f'LAST-MODIFIED:{_ical_datetime(ev.updated_at)}')
+        lines.append('END:VEVENT')
+    lines.append('END:VCALENDAR')
+    body = '\r\n'.join(_ical_fold(line) for line in lines) + '\r\n'
+    response = make_response(body)
+    response.headers['Content-Type'] = 'text/calendar; charset=utf-8'
+    response.headers['Content-Disposition'] = 'inline; filename="benlab-events.ics"'
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response
 
 
 def _event_form_choices():
@@ -3824,6 +7427,56 @@ def _merge_selection_ids(new_ids, existing_ids, touched_flag):
     return existing_ids, False
 
 
+def _recurrence_form_state(raw_rule):
+    """Form fields of the recurrence editor for a stored rule."""
+    try:
+        rule = parse_recurrence_rule(raw_rule)
+    except ValueError:
+        rule = None
+    if rule is None:
+        return {
+            'recurrence_freq': '',
+            'recurrence_interval': '1',
+            'recurrence_weekdays': [],
+            'recurrence_until': '',
+            'recurrence_count': '',
+        }
+    return {
+        'recurrence_freq': rule.freq,
+        'recurrence_interval': str(rule.interval),
+        'recurrence_weekdays': [_RECURRENCE_WEEKDAYS[day] for day in rule.weekdays],
+        'recurrence_until': rule.until.strftime('%Y-%m-%d') if rule.until else '',
+        'recurrence_count': str(rule.count) if rule.count else '',
+    }
+
+
+def _recurrence_from_form(form):
+    """Read the recurrence editor. Returns (rule or None, form_state, error message or None)."""
+    state = {
+        'recurrence_freq': (form.get('recurrence_freq') or '').strip().upper(),
+        'recurrence_interval': (form.get('recurrence_interval') or '1').strip(),
+        'recurrence_weekdays': [day for day in form.getlist('recurrence_weekdays') if day in _RECURRENCE_WEEKDAYS],
+        'recurrence_until': (form.get('recurrence_until') or '').strip(),
+        'recurrence_count': (form.get('recurrence_count') or '').strip(),
+    }
+    if not state['recurrence_freq']:
+        return None, state, None
+    parts = [f"FREQ={state['recurrence_freq']}", f"INTERVAL={state['recurrence_interval'] or 1}"]
+    if state['recurrence_weekdays'] and state['recurrence_freq'] == 'WEEKLY':
+        parts.append('BYDAY=' + ','.join(state['recurrence_weekdays']))
+    if state['recurrence_count']:
+        parts.append(f"COUNT={state['recurrence_count']}")
+    if state['recurrence_until']:
+        parts.append('UNTIL=' + state['recurrence_until'].replace('-', ''))
+    try:
+        rule = parse_recurrence_rule(';'.join(parts))
+    except ValueError as exc:
+        return None, state, str(exc)
+    if rule.count and rule.until:
+        return None, state, '重复截止日期与重复次数只能填写一项'
+    return rule, state, None
+
+
 def build_lab_universe_graph(center_member):
     """Build a universe graph centered on the given member."""
     nodes = {}
@@ -4041,7 +7694,8 @@ def add_event():
         'location_selection_touched': '0',
         'item_selection_touched': '0',
         'start_time_touched': '0',
-        'end_time_touched': '0'
+        'end_time_touched': '0',
+        **_recurrence_form_state(None)
     }
     if request.method == 'POST':
         title = (request.form.get('title') or '').strip()
@@ -4063,6 +7717,7 @@ def add_event():
 
         available_member_ids = {member.id for member in members}
         participant_ids = {pid for pid in participant_ids if pid in available_member_ids and pid != current_user.id}
+        recurrence, recurrence_state, recurrence_error = _recurrence_from_form(request.form)
 
         errors = []
         if not title:
@@ -4071,6 +7726,10 @@ def add_event():
             errors.append('结束时间不能早于开始时间')
         if visibility == 'internal' and not participant_ids:
             errors.append('内部事项需要至少选择一名参与人员')
+        if recurrence_error:
+            errors.append(recurrence_error)
+        elif recurrence and not start_time:
+            errors.append('重复事项需要设置开始时间')
 
         form_state = {
             'title': title,
@@ -4088,7 +7747,8 @@ def add_event():
             'location_selection_touched': request.form.get('location_selection_touched', '0'),
             'item_selection_touched': request.form.get('item_selection_touched', '0'),
             'start_time_touched': request.form.get('start_time_touched', '0'),
-            'end_time_touched': request.form.get('end_time_touched', '0')
+            'end_time_touched': request.form.get('end_time_touched', '0'),
+            **recurrence_state
         }
 
         if errors:
@@ -4106,6 +7766,7 @@ def add_event():
             detail_link=detail_link or None,
             allow_participant_edit=allow_participant_edit
         )
+        apply_event_recurrence(event, recurrence)
         db.session.add(event)
 
         ensure_owner_participation(event)
@@ -4118,6 +7779,7 @@ def add_event():
         selected_locations = Location.query.filter(Location.id.in_(location_ids)).all() if location_ids else []
         event.items = selected_items
         event.locations = selected_locations
+        _sync_event_reservations(event)
 
         uploaded_event_files = request.files.getlist('event_attachments')
         cleaned_files = [f for f in uploaded_event_files if f and getattr(f, 'filename', '')]
@@ -4134,6 +7796,13 @@ def add_event():
                     event.attachments.append(Attachment(filename=url))
                     existing_refs.add(url)
         event.touch()
+        db.session.flush()
+        record_log(
+            user_id=current_user.id,
+            event_id=event.id,
+            action_type="新增事项",
+            details=f"Created event {event.title} (visibility={event.visibility})"
+        )
         db.session.commit()
 
         missing_items, missing_locations = compute_missing_resources(event)
@@ -4141,15 +7810,7 @@ def add_event():
             flash('事项内容提到了以下物品但未在“所需物品”中选择：' + '、'.join(item.name for item in missing_items), 'warning')
         if missing_locations:
             flash('事项内容提到了以下位置但未在“活动地点”中选择：' + '、'.join(loc.name for loc in missing_locations), 'warning')
-
-        log = Log(
-            user_id=current_user.id,
-            event_id=event.id,
-            action_type="新增事项",
-            details=f"Created event {event.title} (visibility={event.visibility})"
-        )
-        db.session.add(log)
-        db.session.commit()
+        _flash_reservation_conflicts(event)
 
         flash('事项已创建', 'success')
         return redirect(url_for('event_detail', event_id=event.id))
@@ -4187,7 +7848,8 @@ def event_detail(event_id):
         allow_join=allow_join,
         feedback_entries=feedback_entries,
         feedback_post_url=url_for('post_event_feedback', event_id=event.id),
-        share_meta=share_meta
+        share_meta=share_meta,
+        occurrence_schedule=event_occurrence_schedule(event)
     )
 
 @app.route('/events/<int:event_id>/poster.png')
@@ -4252,6 +7914,13 @@ def event_share_entry(event_id, token):
     return redirect(url_for('event_detail', event_id=event.id))
 
 
+def _append_event_feedback(event_id, sender_id, content):
+    # 在写事务内重新读取 feedback_log，并发留言不会互相覆盖
+    event = db.session.get(Event, event_id)
+    append_feedback_entry(event, db.session.get(Member, sender_id), content)
+    event.touch()
+
+
 @app.route('/events/<int:event_id>/feedback', methods=['POST'])
 @login_required
 def post_event_feedback(event_id):
@@ -4260,9 +7929,7 @@ def post_event_feedback(event_id):
         abort(403)
     content = request.form.get('content', '')
     if content and content.strip():
-        append_feedback_entry(event, current_user, content.strip())
-        event.touch()
-        db.session.commit()
+        run_write('post_event_feedback', _append_event_feedback, event.id, current_user.id, content.strip())
         flash('留言已发布', 'success')
     else:
         flash('留言内容不能为空', 'warning')
@@ -4333,6 +8000,7 @@ def edit_event(event_id):
 
         available_member_ids = {member.id for member in members}
         participant_ids = {pid for pid in participant_ids if pid in available_member_ids and pid != event.owner_id}
+        recurrence, recurrence_state, recurrence_error = _recurrence_from_form(request.form)
 
         errors = []
         if not title:
@@ -4341,6 +8009,10 @@ def edit_event(event_id):
             errors.append('结束时间不能早于开始时间')
         if visibility == 'internal' and not participant_ids:
             errors.append('内部事项需要至少选择一名参与人员')
+        if recurrence_error:
+            errors.append(recurrence_error)
+        elif recurrence and not start_time:
+            errors.append('重复事项需要设置开始时间')
 
         form_state = {
             'title': title,
@@ -4358,7 +8030,8 @@ def edit_event(event_id):
             'location_selection_touched': '1' if location_selection_touched else '0',
             'item_selection_touched': '1' if item_selection_touched else '0',
             'start_time_touched': '1' if start_time_touched else '0',
-            'end_time_touched': '1' if end_time_touched else '0'
+            'end_time_touched': '1' if end_time_touched else '0',
+            **recurrence_state
         }
 
         if errors:
@@ -4369,8 +8042,13 @@ def edit_event(event_id):
         event.title = title
         event.description = description
         event.visibility = visibility
+        previous_series = (event.start_time, event.recurrence_rule)
         event.start_time = start_time
         event.end_time = end_time
+        apply_event_recurrence(event, recurrence)
+        if (event.start_time, event.recurrence_rule) != previous_series:
+            # 单场例外以原开始时间为键，系列时间或规则变化后不再对得上
+            event.occurrence_overrides.clear()
         event.detail_link = detail_link or None
         if current_user.id == event.owner_id:
             event.allow_participant_edit = allow_participant_edit and visibility == 'internal'
@@ -4398,6 +8076,7 @@ def edit_event(event_id):
         selected_locations = Location.query.filter(Location.id.in_(location_ids)).all() if location_ids else []
         event.items = selected_items
         event.locations = selected_locations
+        _sync_event_reservations(event)
 
         pending_delete_refs = []
         remove_attachment_ids_raw = request.form.getlist('remove_event_attachment_ids')
@@ -4425,24 +8104,21 @@ def edit_event(event_id):
                     existing_refs.add(url)
 
         event.touch()
+        record_log(
+            user_id=current_user.id,
+            event_id=event.id,
+            action_type="修改事项",
+            details=f"Updated event {event.title}"
+        )
+        enqueue_attachment_deletions(pending_delete_refs)
         db.session.commit()
-        for ref in pending_delete_refs:
-            remove_uploaded_file(ref)
 
         missing_items, missing_locations = compute_missing_resources(event)
         if missing_items:
             flash('事项内容提到了以下物品但未在“所需物品”中选择：' + '、'.join(item.name for item in missing_items), 'warning')
         if missing_locations:
             flash('事项内容提到了以下位置但未在“活动地点”中选择：' + '、'.join(loc.name for loc in missing_locations), 'warning')
-
-        log = Log(
-            user_id=current_user.id,
-            event_id=event.id,
-            action_type="修改事项",
-            details=f"Updated event {event.title}"
-        )
-        db.session.add(log)
-        db.session.commit()
+        _flash_reservation_conflicts(event)
 
         flash('事项已更新', 'success')
         return redirect(url_for('event_detail', event_id=event.id))
@@ -4463,7 +8139,8 @@ def edit_event(event_id):
         'location_selection_touched': '0',
         'item_selection_touched': '0',
         'start_time_touched': '0',
-        'end_time_touched': '0'
+        'end_time_touched': '0',
+        **_recurrence_form_state(event.recurrence_rule)
     }
     return render_template('event_form.html', event=event, members=members, items=items, locations=locations, form_state=form_state)
 
@@ -4478,16 +8155,13 @@ def delete_event(event_id):
     event_identifier = event.id
     refs_to_delete = [att.filename for att in list(event.attachments)]
     db.session.delete(event)
-    db.session.commit()
-    for ref in refs_to_delete:
-        remove_uploaded_file(ref)
-    log = Log(
+    record_log(
         user_id=current_user.id,
         event_id=event_identifier,
         action_type="删除事项",
         details=f"Deleted event {event_title}"
     )
-    db.session.add(log)
+    enqueue_attachment_deletions(refs_to_delete)
     db.session.commit()
     flash('事项已删除', 'info')
     return redirect(url_for('events_overview'))
@@ -4502,14 +8176,12 @@ def signup_event(event_id):
         return redirect(url_for('event_detail', event_id=event.id))
     event.participant_links.append(EventParticipant(member_id=current_user.id, role='participant', status='confirmed'))
     event.touch()
-    db.session.commit()
-    log = Log(
+    record_log(
         user_id=current_user.id,
         event_id=event.id,
         action_type="参加事项",
         details=f"Joined event {event.title}"
     )
-    db.session.add(log)
     db.session.commit()
     flash('报名成功，已加入事项', 'success')
     return redirect(url_for('event_detail', event_id=event.id))
@@ -4532,14 +8204,12 @@ def withdraw_event(event_id):
             removed = True
     if removed:
         event.touch()
-        db.session.commit()
-        log = Log(
+        record_log(
             user_id=current_user.id,
             event_id=event.id,
             action_type="退出事项",
             details=f"Withdrew from event {event.title}"
         )
-        db.session.add(log)
         db.session.commit()
         flash('已退出该事项', 'info')
     return redirect(url_for('event_detail', event_id=event.id))
@@ -4571,6 +8241,7 @@ def _build_item_category_payload(items):
 
 @app.route('/items')
 @login_required
+@cached_view
 def items():
     items_list = (
         Item.query.options(
@@ -4598,6 +8269,7 @@ def items():
 
 @app.route('/items/<int:item_id>')
 @login_required
+@cached_view
 def item_detail(item_id):
     # 查看物品详情
     item = (
@@ -4645,9 +8317,24 @@ def item_detail(item_id):
         .all()
     )
     categories, category_payload, uncategorized_payload = _build_item_category_payload(category_seed)
+    depletion_forecast = db.session.get(ItemDepletionForecast, item.id)
+    current_loan = _open_loan_for_item(item.id)
+    loan_history = (
+        item.loans.options(selectinload(ItemLoan.borrower))
+        .order_by(ItemLoan.checked_out_at.desc())
+        .limit(_LOAN_HISTORY_LIMIT)
+        .all()
+    )
     return render_template(
         'item_detail.html',
         item=item,
+        depletion_forecast=depletion_forecast,
+        current_loan=current_loan,
+        loan_history=loan_history,
+        loan_members=sorted(members, key=lambda mem: (mem.name or mem.username or '').lower()),
+        can_handle_loan=_can_handle_loan(item, current_user),
+        loan_default_days=_LOAN_DEFAULT_DAYS,
+        now=datetime.utcnow(),
         detail_refs=item.detail_refs,
         event_summary=event_bundle['summary'],
         ongoing_events=event_bundle['ongoing'],
@@ -4663,6 +8350,36 @@ def item_detail(item_id):
         uncategorized_items=uncategorized_payload
     )
 
+def _create_item(fields, responsible_ids, location_ids, attachment_refs, detail_refs, actor_id):
+    """Insert an item with its links, attachments and log row; returns (item_id, refs_trimmed)."""
+    new_item = Item(**fields)
+    responsible_members = []
+    if responsible_ids:
+        responsible_members = Member.query.filter(Member.id.in_(responsible_ids)).all()
+    assigned_members = new_item.assign_responsible_members(responsible_members)
+    if fields['features'] == '私人' and not assigned_members:
+        new_item.assign_responsible_members([db.session.get(Member, actor_id)])
+    trimmed_refs = new_item.set_detail_refs(detail_refs)
+    if location_ids:
+        new_item.locations = Location.query.filter(Location.id.in_(location_ids)).all()
+    db.session.add(new_item)
+    existing_refs = set()
+    for ref in attachment_refs:
+        if ref not in existing_refs:
+            new_item.attachments.append(Attachment(filename=ref))
+            existing_refs.add(ref)
+    db.session.flush()
+
+    # ✅ 写入日志
+    record_log(
+        user_id=actor_id,
+        item_id=new_item.id,
+        action_type="新增物品",
+        details=f"Added item {new_item.name}"
+    )
+    return new_item.id, trimmed_refs
+
+
 @app.route('/items/add', methods=['GET', 'POST'])
 @login_required
 def add_item():
@@ -4693,11 +8410,6 @@ def add_item():
 
         responsible_ids_raw = request.form.getlist('responsible_ids')
         responsible_ids = {int(x) for x in responsible_ids_raw if x.isdigit()}
-        responsible_members = []
-        if responsible_ids:
-            responsible_members = Member.query.filter(Member.id.in_(responsible_ids)).all()
-        if features_str == '私人' and not responsible_members:
-            responsible_members = [current_user]
         location_ids = request.form.getlist('location_ids')  # ✅ 支持多个位置
         notes = request.form.get('notes')
         purchase_link = (request.form.get('purchase_link') or '').strip()
@@ -4708,9 +8420,10 @@ def add_item():
 
         saved_refs = []
         saved_ref_seen = set()
-        for attachment_file in uploaded_files:
-            stored_name = save_uploaded_media(attachment_file)
-            if stored_name and stored_name not in saved_ref_seen:
+        stored_names, upload_failures = save_uploaded_media_batch(uploaded_files)
+        _flash_upload_failures(upload_failures)
+        for stored_name in stored_names:
+            if stored_name not in saved_ref_seen:
                 saved_refs.append(stored_name)
                 saved_ref_seen.add(stored_name)
         remote_refs = _collect_remote_object_keys('attachments')
@@ -4720,54 +8433,30 @@ def add_item():
                 saved_ref_seen.add(remote_ref)
 
         external_urls = _extract_external_urls(request.form.get('external_attachment_urls'))
-
-        # ✅ 创建新的 Item 实例（已更新字段）
-        new_item = Item(
-            name=name,
-            category=category,
-            stock_status=stock_status,
-            features=features_str,
-            value=value,
-            quantity=quantity,
-            unit=unit,
-            purchase_date=purchase_date,
-            notes=notes,
-            purchase_link=purchase_link
-        )
-        assigned_members = new_item.assign_responsible_members(responsible_members)
-        if features_str == '私人' and not assigned_members:
-            new_item.assign_responsible_members([current_user])
-        trimmed_refs = new_item.set_detail_refs(detail_refs)
-        if trimmed_refs:
-            flash('部分参考信息过长，已保留前几条，请确认长度。', 'warning')
         # 绑定多个位置（若前端未选择则为空列表）
         loc_ids = [int(x) for x in location_ids] if location_ids else []
         if not loc_ids and default_loc_id:
             loc_ids = [default_loc_id]
-        if loc_ids:
-            new_item.locations = Location.query.filter(Location.id.in_(loc_ids)).all()
-        db.session.add(new_item)
-        existing_refs = set()
-        for fname in saved_refs:
-            if fname not in existing_refs:
-                new_item.attachments.append(Attachment(filename=fname))
-                existing_refs.add(fname)
-        for url in external_urls:
-            if url not in existing_refs:
-                new_item.attachments.append(Attachment(filename=url))
-                existing_refs.add(url)
-        db.session.commit()
 
-        # ✅ 写入日志
-        log = Log(
-            user_id=current_user.id,
-            item_id=new_item.id,
-            action_type="新增物品",
-            details=f"Added item {new_item.name}"
+        # 文件已在事务外保存好，这里只把行写入交给 run_write
+        fields = {
+            'name': name,
+            'category': category,
+            'stock_status': stock_status,
+            'features': features_str,
+            'value': value,
+            'quantity': quantity,
+            'unit': unit,
+            'purchase_date': purchase_date,
+            'notes': notes,
+            'purchase_link': purchase_link
+        }
+        _item_id, trimmed_refs = run_write(
+            'add_item', _create_item, fields, responsible_ids, loc_ids,
+            saved_refs + external_urls, detail_refs, current_user.id
         )
-        db.session.add(log)
-        db.session.commit()
-
+        if trimmed_refs:
+            flash('部分参考信息过长，已保留前几条，请确认长度。', 'warning')
         flash('物品已添加', 'success')
         return redirect(url_for('items'))
 
@@ -4852,10 +8541,10 @@ def edit_item(item_id):
 
         # 处理新增上传（支持多选）
         uploaded_files = request.files.getlist('attachments')
-        for attachment_file in uploaded_files:
-            stored_name = save_uploaded_media(attachment_file)
-            if stored_name:
-                item.attachments.append(Attachment(filename=stored_name))
+        stored_names, upload_failures = save_uploaded_media_batch(uploaded_files)
+        _flash_upload_failures(upload_failures)
+        for stored_name in stored_names:
+            item.attachments.append(Attachment(filename=stored_name))
         remote_refs = _collect_remote_object_keys('attachments')
         if remote_refs:
             _append_media_records(item.attachments, Attachment, remote_refs)
@@ -4869,13 +8558,9 @@ def edit_item(item_id):
                     existing_refs.add(url)
 
         item.last_modified = datetime.utcnow()
-        db.session.commit()
-        for ref in pending_delete_refs:
-            remove_uploaded_file(ref)
-
         # 记录日志
-        log = Log(user_id=current_user.id, item_id=item.id, action_type="修改物品", details=f"Edited item {item.name}")
-        db.session.add(log)
+        record_log(user_id=current_user.id, item_id=item.id, action_type="修改物品", details=f"Edited item {item.name}")
+        enqueue_attachment_deletions(pending_delete_refs)
         db.session.commit()
 
         flash('物品信息已更新', 'success')
@@ -4906,16 +8591,801 @@ def delete_item(item_id):
         abort(403)
     refs_to_delete = sorted(set(item.attachment_filenames))
     db.session.delete(item)
-    db.session.commit()
-    for fname in refs_to_delete:
-        remove_uploaded_file(fname)
     # 记录日志
-    log = Log(user_id=current_user.id, item_id=item_id, action_type="删除物品", details=f"Deleted item {item.name}")
-    db.session.add(log)
+    record_log(user_id=current_user.id, item_id=item_id, action_type="删除物品", details=f"Deleted item {item.name}")
+    # 文件由后台删除队列批量清理，请求不再等待存储往返
+    enqueue_attachment_deletions(refs_to_delete)
     db.session.commit()
     flash('物品已删除', 'info')
     return redirect(url_for('items'))
 
+def _loan_payload(loan, now=None):
+    borrower = loan.borrower
+    return {
+        'id': loan.id,
+        'itemId': loan.item_id,
+        'itemName': loan.item.name if loan.item else None,
+        'borrowerId': loan.borrower_id,
+        'borrowerName': (borrower.name or borrower.username) if borrower else None,
+        'checkedOutAt': _isoformat_utc(loan.checked_out_at),
+        'dueAt': _isoformat_utc(loan.due_at),
+        'returnedAt': _isoformat_utc(loan.returned_at),
+        'overdue': loan.is_overdue(now),
+        'note': loan.note,
+    }
+
+
+def _loan_form_response(is_json, item, message, category='success', status=200, payload=None):
+    if is_json:
+        if status >= 400:
+            return jsonify(payload), status
+        return jsonify(payload)
+    flash(message, category)
+    next_url = request.form.get('next') or ''
+    if next_url.startswith('/'):
+        return redirect(next_url)
+    return redirect(url_for('item_detail', item_id=item.id))
+
+
+@app.route('/api/items/<int:item_id>/checkout', methods=['POST'])
+@login_required
+def checkout_item_view(item_id):
+    """Lend an item: `borrower_id` (default: yourself), `due_at` or `due_days`, `note`."""
+    item = Item.query.options(selectinload(Item.responsible_members)).get_or_404(item_id)
+    if not _can_handle_loan(item, current_user):
+        abort(403)
+    payload = request.get_json(silent=True)
+    is_json = payload is not None
+    if not is_json:
+        payload = request.form.to_dict()
+
+    def fail(code, message):
+        return _loan_form_response(is_json, item, message, 'danger', 400, {'error': code, 'message': message})
+
+    borrower = current_user
+    raw_borrower = payload.get('borrower_id')
+    if raw_borrower not in (None, ''):
+        try:
+            borrower = db.session.get(Member, int(raw_borrower))
+        except (TypeError, ValueError):
+            borrower = None
+        if borrower is None:
+            return fail('invalid_borrower', '借用人不存在')
+    due_at = None
+    if payload.get('due_at'):
+        due_at = _parse_datetime_param(payload.get('due_at'))
+        if due_at is None:
+            return fail('invalid_due_at', '归还期限格式无效')
+    elif payload.get('due_days') not in (None, ''):
+        try:
+            due_days = int(payload.get('due_days'))
+        except (TypeError, ValueError):
+            return fail('invalid_due_at', '借用天数必须是整数')
+        if due_days > 0:
+            due_at = datetime.utcnow() + timedelta(days=due_days)
+    try:
+        loan = checkout_item(item, borrower, current_user, due_at=due_at, note=payload.get('note'))
+        db.session.commit()
+    except ValueError as exc:
+        db.session.rollback()
+        return fail('already_checked_out', str(exc))
+    except IntegrityError:
+        # 并发借出时由部分唯一索引兜底
+        db.session.rollback()
+        return fail('already_checked_out', f'{item.name} 已被借出，需先归还')
+    return _loan_form_response(is_json, item, f'已登记借出给 {borrower.name or borrower.username}', payload=_loan_payload(loan))
+
+
+@app.route('/api/items/<int:item_id>/checkin', methods=['POST'])
+@login_required
+def checkin_item_view(item_id):
+    """Return an item: closes its open loan and restores the previous stock status."""
+    item = Item.query.options(selectinload(Item.responsible_members)).get_or_404(item_id)
+    is_json = request.get_json(silent=True) is not None
+    loan = _open_loan_for_item(item.id)
+    if loan is None:
+        return _loan_form_response(
+            is_json, item, '该物品当前没有借出记录', 'warning', 400,
+            {'error': 'not_checked_out', 'message': '该物品当前没有借出记录'}
+        )
+    if loan.borrower_id != current_user.id and not _can_handle_loan(item, current_user):
+        abort(403)
+    checkin_item(loan, current_user)
+    db.session.commit()
+    return _loan_form_response(is_json, item, f'{item.name} 已归还', payload=_loan_payload(loan))
+
+
+@app.route('/api/loans')
+@login_required
+def loans_index():
+    """Loan ledger: `status=open|overdue|all` (default open), optional `item_id` / `member_id`."""
+    status = request.args.get('status', 'open')
+    if status not in ('open', 'overdue', 'all'):
+        return jsonify({'error': 'invalid_status', 'message': 'status 需为 open、overdue 或 all'}), 400
+    now = datetime.utcnow()
+    if status == 'overdue':
+        query = _overdue_loans_query(now).order_by(ItemLoan.due_at.asc())
+    elif status == 'open':
+        query = _open_loans_query().order_by(ItemLoan.checked_out_at.desc())
+    else:
+        query = ItemLoan.query.options(
+            selectinload(ItemLoan.item), selectinload(ItemLoan.borrower)
+        ).order_by(ItemLoan.checked_out_at.desc())
+    item_id = request.args.get('item_id', type=int)
+    if item_id:
+        query = query.filter(ItemLoan.item_id == item_id)
+    member_id = request.args.get('member_id', type=int)
+    if member_id:
+        query = query.filter(ItemLoan.borrower_id == member_id)
+    loans = query.limit(_LOAN_API_MAX_RESULTS).all()
+    return jsonify({'loans': [_loan_payload(loan, now) for loan in loans]})
+
+
+_ITEM_BATCH_MAX_ITEMS = 1000
+_ITEM_BATCH_CHANGE_KEYS = ('stock_status', 'category', 'location_ids', 'responsible_ids')
+
+
+def _coerce_id_set(value):
+    """Normalize a JSON id list (ints or digit strings) into a set; None when malformed."""
+    if value is None:
+        return set()
+    if not isinstance(value, (list, tuple)):
+        return None
+    ids = set()
+    for raw in value:
+        if isinstance(raw, bool):
+            return None
+        if isinstance(raw, int):
+            ids.add(raw)
+        elif isinstance(raw, str) and raw.strip().isdigit():
+            ids.add(int(raw.strip()))
+        else:
+            return None
+    return ids
+
+
+def _parse_batch_link_change(value):
+    """Parse `{'add': [...], 'remove': [...]}` or `{'set': [...]}`; a bare list means set."""
+    if isinstance(value, (list, tuple)):
+        value = {'set': value}
+    if not isinstance(value, dict) or not value:
+        return None
+    if set(value) - {'add', 'remove', 'set'}:
+        return None
+    if 'set' in value and ('add' in value or 'remove' in value):
+        return None
+    parsed = {}
+    for key in ('add', 'remove', 'set'):
+        if key in value:
+            ids = _coerce_id_set(value[key])
+            if ids is None:
+                return None
+            parsed[key] = ids
+    return parsed
+
+
+def _apply_link_change(current, change):
+    """Return the target id set after applying a parsed add/remove/set change."""
+    if 'set' in change:
+        return set(change['set'])
+    return (set(current) | change.get('add', set())) - change.get('remove', set())
+
+
+def _editable_item_rows(item_ids, member_id):
+    """Load the items a member may edit, keyed by id, in a single query.
+
+    Private items are editable only by their responsible members; the check is an
+    EXISTS on item_members rather than a lazy `responsible_members` load per item.
+    """
+    if not item_ids:
+        return {}
+    is_responsible = (
+        db.select(item_members.c.item_id)
+        .where(item_members.c.item_id == Item.id, item_members.c.member_id == member_id)
+        .exists()
+    )
+    rows = db.session.execute(
+        db.select(Item.id, Item.name, Item.category, Item.stock_status, Item.features)
+        .where(Item.id.in_(item_ids))
+        .where(or_(Item.features.is_(None), Item.features != '私人', is_responsible))
+    ).all()
+    return {row.id: row for row in rows}
+
+
+def _load_link_map(owner_column, target_column, owner_ids):
+    """Read an association table once and group target ids by owner id."""
+    mapping = {owner_id: set() for owner_id in owner_ids}
+    if owner_ids:
+        rows = db.session.execute(
+            db.select(owner_column, target_column).where(owner_column.in_(owner_ids))
+        ).all()
+        for owner_id, target_id in rows:
+            mapping.setdefault(owner_id, set()).add(target_id)
+    return mapping
+
+
+def _restricted_location_ids(location_ids, member_id):
+    """Locations that have responsible members, none of which is `member_id`."""
+    owners = _load_link_map(location_members.c.location_id, location_members.c.member_id, location_ids)
+    return {loc_id for loc_id, member_ids in owners.items() if member_ids and member_id not in member_ids}
+
+
+def _bulk_link_rows(table, owner_key, target_key, inserts=(), deletes=()):
+    """Insert/delete association rows with one executemany each (caller commits)."""
+    if deletes:
+        db.session.execute(
+            table.delete().where(
+                table.c[owner_key] == db.bindparam('b_owner'),
+                table.c[target_key] == db.bindparam('b_target')
+            ),
+            [{'b_owner': owner_id, 'b_target': target_id} for owner_id, target_id in deletes]
+        )
+    if inserts:
+        db.session.execute(
+            table.insert(),
+            [{owner_key: owner_id, target_key: target_id} for owner_id, target_id in inserts]
+        )
+
+
+def _bulk_touch(model, ids, now):
+    """Bump `last_modified` for many rows in one UPDATE and journal them for sync clients."""
+    if ids:
+        db.session.execute(
+            model.__table__.update()
+            .where(model.__table__.c.id.in_(ids))
+            .values(last_modified=now)
+        )
+        _journal_changes(db.session.connection(), _SYNC_ENTITY_TYPES[model], ids,
+                         member_id=_current_actor_id(), now=now)
+
+
+def _bulk_insert_logs(entries):
+    """Insert many Log rows with a single executemany instead of one ORM flush each.
+
+    Each entry is a dict of Log columns; missing columns default to NULL and the
+    timestamp to now. Notifications are fanned out in the same statement batch.
+    The caller owns the transaction.
+    """
+    if not entries:
+        return 0
+    now = datetime.utcnow()
+    rows = []
+    for entry in entries:
+        row = {
+            'timestamp': now,
+            'user_id': None,
+            'item_id': None,
+            'location_id': None,
+            'event_id': None,
+            'action_type': None,
+            'details': None,
+        }
+        row.update(entry)
+        rows.append(row)
+    log_table = Log.__table__
+    log_ids = db.session.execute(
+        log_table.insert().returning(log_table.c.id, sort_by_parameter_order=True),
+        rows
+    ).scalars().all()
+    for row, log_id in zip(rows, log_ids):
+        row['id'] = log_id
+    # 绕过 ORM 的批量写入不会触发 after_flush，这里显式扇出通知
+    _insert_notifications_for_logs(db.session.connection(), rows)
+    return len(rows)
+
+
+@app.route('/api/items/batch', methods=['POST'])
+@login_required
+def batch_update_items():
+    """Apply one set of changes to many items in a single transaction.
+
+    Body: `{"item_ids": [...], "changes": {"stock_status": "...", "category": "...",
+    "location_ids": {"add": [...], "remove": [...]} | {"set": [...]},
+    "responsible_ids": {...}}}`. Items the user may not edit are reported in
+    `skipped` rather than failing the whole batch.
+    """
+    payload = request.get_json(silent=True) or {}
+    item_ids = _coerce_id_set(payload.get('item_ids'))
+    if not item_ids:
+        return jsonify({'error': 'missing_items', 'message': '请提供需要批量修改的物品 ID 列表'}), 400
+    if len(item_ids) > _ITEM_BATCH_MAX_ITEMS:
+        return jsonify({
+            'error': 'too_many_items',
+            'message': f'单次最多修改 {_ITEM_BATCH_MAX_ITEMS} 个物品',
+            'max_items': _ITEM_BATCH_MAX_ITEMS
+        }), 400
+    changes = payload.get('changes')
+    if not isinstance(changes, dict) or not changes:
+        return jsonify({'error': 'missing_changes', 'message': '请提供需要应用的修改内容'}), 400
+    unsupported = sorted(set(changes) - set(_ITEM_BATCH_CHANGE_KEYS))
+    if unsupported:
+        return jsonify({'error': 'unsupported_change', 'message': '包含不支持的修改字段', 'fields': unsupported}), 400
+
+    new_status = None
+    if 'stock_status' in changes:
+        new_status = _normalize_item_stock_status(changes.get('stock_status'))
+        if not new_status:
+            return jsonify({'error': 'invalid_stock_status', 'message': '请选择有效的物品状态'}), 400
+    new_category = None
+    if 'category' in changes:
+        new_category = _ensure_string(changes.get('category')).strip()[:50] or None
+    location_change = None
+    if 'location_ids' in changes:
+        location_change = _parse_batch_link_change(changes.get('location_ids'))
+        if location_change is None:
+            return jsonify({'error': 'invalid_location_ids', 'message': 'location_ids 格式无效'}), 400
+    member_change = None
+    if 'responsible_ids' in changes:
+        member_change = _parse_batch_link_change(changes.get('responsible_ids'))
+        if member_change is None:
+            return jsonify({'error': 'invalid_responsible_ids', 'message': 'responsible_ids 格式无效'}), 400
+
+    location_names = {}
+    if location_change:
+        requested = set().union(*location_change.values())
+        if requested:
+            location_names = dict(
+                db.session.query(Location.id, Location.name).filter(Location.id.in_(requested)).all()
+            )
+            missing = sorted(requested - set(location_names))
+            if missing:
+                return jsonify({'error': 'unknown_locations', 'message': '部分位置不存在', 'ids': missing}), 400
+    member_names = {}
+    if member_change:
+        requested = set().union(*member_change.values())
+        if requested:
+            member_names = {
+                mem_id: (name or username)
+                for mem_id, name, username in db.session.query(
+                    Member.id, Member.name, Member.username
+                ).filter(Member.id.in_(requested)).all()
+            }
+            missing = sorted(requested - set(member_names))
+            if missing:
+                return jsonify({'error': 'unknown_members', 'message': '部分成员不存在', 'ids': missing}), 400
+
+    rows = _editable_item_rows(item_ids, current_user.id)
+    denied_ids = item_ids - set(rows)
+    forbidden_ids = set()
+    if denied_ids:
+        forbidden_ids = {
+            item_id for (item_id,) in db.session.query(Item.id).filter(Item.id.in_(denied_ids)).all()
+        }
+    skipped = [
+        {'id': item_id, 'reason': 'forbidden' if item_id in forbidden_ids else 'not_found'}
+        for item_id in sorted(denied_ids)
+    ]
+    editable_ids = sorted(rows)
+
+    current_locations = (
+        _load_link_map(item_locations.c.item_id, item_locations.c.location_id, editable_ids)
+        if location_change else {}
+    )
+    current_members = (
+        _load_link_map(item_members.c.item_id, item_members.c.member_id, editable_ids)
+        if member_change else {}
+    )
+    if location_change and 'set' in location_change:
+        # 整体替换会移除旧关联，补充旧位置名称用于日志
+        stale = set().union(*current_locations.values()) - set(location_names) if current_locations else set()
+        if stale:
+            location_names.update(dict(
+                db.session.query(Location.id, Location.name).filter(Location.id.in_(stale)).all()
+            ))
+    if member_change and 'set' in member_change:
+        stale = set().union(*current_members.values()) - set(member_names) if current_members else set()
+        if stale:
+            member_names.update({
+                mem_id: (name or username)
+                for mem_id, name, username in db.session.query(
+                    Member.id, Member.name, Member.username
+                ).filter(Member.id.in_(stale)).all()
+            })
+
+    status_ids = []
+    category_ids = []
+    location_inserts, location_deletes = [], []
+    member_inserts, member_deletes = [], []
+    touched_location_ids = set()
+    log_entries = []
+    for item_id in editable_ids:
+        row = rows[item_id]
+        notes = []
+        if new_status and row.stock_status != new_status:
+            status_ids.append(item_id)
+            notes.append(f"状态 {row.stock_status or '未设置'} → {new_status}")
+        if 'category' in changes and (row.category or None) != new_category:
+            category_ids.append(item_id)
+            notes.append(f"类别 {row.category or '未分类'} → {new_category or '未分类'}")
+        if location_change:
+            before = current_locations.get(item_id, set())
+            after = _apply_link_change(before, location_change)
+            added, removed = after - before, before - after
+            location_inserts.extend((item_id, loc_id) for loc_id in sorted(added))
+            location_deletes.extend((item_id, loc_id) for loc_id in sorted(removed))
+            touched_location_ids.update(added | removed)
+            if added:
+                notes.append('新增位置 ' + '、'.join(location_names.get(i, str(i)) for i in sorted(added)))
+            if removed:
+                notes.append('移除位置 ' + '、'.join(location_names.get(i, str(i)) for i in sorted(removed)))
+        if member_change:
+            before = current_members.get(item_id, set())
+            after = _apply_link_change(before, member_change)
+            if row.features == '私人' and not after:
+                # 私人物品至少保留一位负责人，与编辑表单的兜底逻辑一致
+                after = {current_user.id}
+                member_names.setdefault(current_user.id, current_user.name or current_user.username)
+            added, removed = after - before, before - after
+            member_inserts.extend((item_id, mem_id) for mem_id in sorted(added))
+            member_deletes.extend((item_id, mem_id) for mem_id in sorted(removed))
+            if added:
+                notes.append('新增负责人 ' + '、'.join(member_names.get(i, str(i)) for i in sorted(added)))
+            if removed:
+                notes.append('移除负责人 ' + '、'.join(member_names.get(i, str(i)) for i in sorted(removed)))
+        if notes:
+            log_entries.append({
+                'user_id': current_user.id,
+                'item_id': item_id,
+                'action_type': "批量修改物品",
+                'details': f"{row.name}：" + '；'.join(notes)
+            })
+
+    restricted = _restricted_location_ids(touched_location_ids, current_user.id)
+    if restricted:
+        return jsonify({
+            'error': 'forbidden_locations',
+            'message': '无权调整部分位置的物品',
+            'ids': sorted(restricted)
+        }), 403
+
+    changed_ids = [entry['item_id'] for entry in log_entries]
+    if changed_ids:
+        now = datetime.utcnow()
+        items_table = Item.__table__
+        if status_ids:
+            db.session.execute(
+                items_table.update().where(items_table.c.id.in_(status_ids)).values(stock_status=new_status)
+            )
+        if category_ids:
+            db.session.execute(
+                items_table.update().where(items_table.c.id.in_(category_ids)).values(category=new_category)
+            )
+        _bulk_link_rows(item_locations, 'item_id', 'location_id', location_inserts, location_deletes)
+        _bulk_link_rows(item_members, 'item_id', 'member_id', member_inserts, member_deletes)
+        if status_ids or member_inserts or member_deletes:
+            # Core 批量更新不经过 flush 监听，告警表在同一事务内补算
+            _refresh_status_alerts(
+                db.session.connection(),
+                set(status_ids) | {item_id for item_id, _ in member_inserts + member_deletes},
+                ()
+            )
+        _bulk_touch(Item, changed_ids, now)
+        _bulk_touch(Location, touched_location_ids, now)
+        _bulk_insert_logs(log_entries)
+        db.session.commit()
+
+    return jsonify({
+        'updated': len(changed_ids),
+        'updated_ids': changed_ids,
+        'unchanged_ids': sorted(set(editable_ids) - set(changed_ids)),
+        'skipped': skipped
+    })
+
+
+_SYNC_DEFAULT_LIMIT = 500
+_SYNC_MAX_LIMIT = 2000
+_SYNC_PUSH_MAX_CHANGES = 500
+
+
+def _sync_float(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise ValueError('数量需为数字')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError('数量需为数字')
+
+
+def _sync_choice(normalize, label):
+    def convert(value):
+        normalized = normalize(value)
+        if not normalized:
+            raise ValueError(f'{label}无效：{value}')
+        return normalized
+    return convert
+
+
+def _sync_text(value):
+    if value is not None and not isinstance(value, str):
+        raise ValueError('备注需为字符串')
+    return value or None
+
+
+# 离线盘点可回写的字段：客户端键 -> (模型属性, 转换函数, 日志中的中文名)
+_SYNC_PUSH_FIELDS = {
+    'item': {
+        'quantity': ('quantity', _sync_float, '数量'),
+        'stockStatus': ('stock_status', _sync_choice(_normalize_item_stock_status, '库存状态'), '状态'),
+        'notes': ('notes', _sync_text, '备注'),
+    },
+    'location': {
+        'status': ('status', _sync_choice(_normalize_location_status, '位置状态'), '状态'),
+        'notes': ('notes', _sync_text, '备注'),
+    },
+}
+
+
+def _sync_payloads(entity_type, ids):
+    """Serialize current rows of one entity type; ids missing from the result no longer exist."""
+    if not ids:
+        return {}
+    ids = list(ids)
+    if entity_type == 'item':
+        locations = _load_link_map(item_locations.c.item_id, item_locations.c.location_id, ids)
+        members = _load_link_map(item_members.c.item_id, item_members.c.member_id, ids)
+        return {
+            item.id: {
+                'name': item.name,
+                'category': item.category,
+                'stockStatus': item.stock_status,
+                'features': item.features,
+                'quantity': item.quantity,
+                'unit': item.unit,
+                'notes': item.notes,
+                'locationIds': sorted(locations.get(item.id, ())),
+                'responsibleIds': sorted(members.get(item.id, ())),
+                'lastModified': _isoformat_utc(item.last_modified),
+            }
+            for item in db.session.execute(db.select(Item.__table__).where(Item.id.in_(ids)))
+        }
+    if entity_type == 'location':
+        members = _load_link_map(location_members.c.location_id, location_members.c.member_id, ids)
+        return {
+            loc.id: {
+                'name': loc.name,
+                'parentId': loc.parent_id,
+                'status': loc.status,
+                'isPublic': bool(loc.is_public),
+                'latitude': loc.latitude,
+                'longitude': loc.longitude,
+                'notes': loc.notes,
+                'responsibleIds': sorted(members.get(loc.id, ())),
+                'lastModified': _isoformat_utc(loc.last_modified),
+            }
+            for loc in db.session.execute(db.select(Location.__table__).where(Location.id.in_(ids)))
+        }
+    if entity_type == 'event':
+        visible = db.select(Event.__table__).where(Event.id.in_(ids), _event_visibility_clause(current_user.id))
+        rows = db.session.execute(visible).all()
+        event_ids = [row.id for row in rows]
+        items = _load_link_map(event_items.c.event_id, event_items.c.item_id, event_ids)
+        locations = _load_link_map(event_locations.c.event_id, event_locations.c.location_id, event_ids)
+        return {
+            ev.id: {
+                'title': ev.title,
+                'visibility': ev.visibility,
+                'ownerId': ev.owner_id,
+                'startTime': _isoformat_utc(ev.start_time),
+                'endTime': _isoformat_utc(ev.end_time),
+                'recurrenceRule': ev.recurrence_rule,
+                'itemIds': sorted(items.get(ev.id, ())),
+                'locationIds': sorted(locations.get(ev.id, ())),
+                'updatedAt': _isoformat_utc(ev.updated_at),
+            }
+            for ev in rows
+        }
+    table = Attachment.__table__
+    hidden_events = db.select(Event.id).where(~_event_visibility_clause(current_user.id))
+    rows = db.session.execute(
+        db.select(table).where(
+            table.c.id.in_(ids),
+            or_(table.c.event_id.is_(None), table.c.event_id.not_in(hidden_events))
+        )
+    ).all()
+    return {
+        att.id: {
+            'itemId': att.item_id,
+            'locationId': att.location_id,
+            'eventId': att.event_id,
+            'filename': _media_display_name(att.filename),
+            'url': _resolve_media_url(att.filename),
+            'createdAt': _isoformat_utc(att.created_at),
+        }
+        for att in rows
+    }
+
+
+@app.route('/api/sync/changes')
+@login_required
+def sync_changes():
+    """Entity changes after `?since=<cursor>` (0 = full snapshot), oldest first.
+
+    Each entity appears once with its current state (`op: upsert`) or as a
+    tombstone (`op: delete`; also used for events the user can no longer see).
+    Pass the returned `cursor` as the next `since` until `hasMore` is false.
+    """
+    since = request.args.get('since', default=0, type=int)
+    if since is None or since < 0:
+        return jsonify({'error': 'invalid_cursor', 'message': 'since 需为非负整数'}), 400
+    limit = request.args.get('limit', type=int) or _SYNC_DEFAULT_LIMIT
+    limit = max(1, min(limit, _SYNC_MAX_LIMIT))
+    journal = ChangeJournal.__table__
+    rows = db.session.execute(
+        db.select(journal.c.id, journal.c.entity_type, journal.c.entity_id, journal.c.op)
+        .where(journal.c.id > since)
+        .order_by(journal.c.id)
+        .limit(limit + 1)
+    ).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    latest = {}
+    for row in rows:
+        key = (row.entity_type, row.entity_id)
+        latest.pop(key, None)
+        latest[key] = row.op
+    wanted = {}
+    for (entity_type, entity_id), op in latest.items():
+        if op == 'upsert':
+            wanted.setdefault(entity_type, set()).add(entity_id)
+    payloads = {entity_type: _sync_payloads(entity_type, ids) for entity_type, ids in wanted.items()}
+    changes = []
+    for (entity_type, entity_id), op in latest.items():
+        data = payloads.get(entity_type, {}).get(entity_id) if op == 'upsert' else None
+        if data is None:
+            changes.append({'type': entity_type, 'id': entity_id, 'op': 'delete'})
+        else:
+            changes.append({'type': entity_type, 'id': entity_id, 'op': 'upsert', 'data': data})
+    return jsonify({
+        'changes': changes,
+        'cursor': rows[-1].id if rows else since,
+        'hasMore': has_more,
+    })
+
+
+def _apply_sync_changes(parsed, actor_id):
+    """Check permissions and journal conflicts, then apply parsed sync edits.
+
+    Runs as one write so the conflict check and the updates see the same data.
+    Returns (applied, conflicts, rejected) lists of plain dicts.
+    """
+    ids_by_type = {}
+    for entity_type, entity_id, _values, _cursor in parsed:
+        ids_by_type.setdefault(entity_type, set()).add(entity_id)
+    editable = {
+        'item': set(_editable_item_rows(ids_by_type.get('item', set()), actor_id)),
+        'location': ids_by_type.get('location', set()) - _restricted_location_ids(
+            ids_by_type.get('location', set()), actor_id
+        ),
+    }
+    objects = {
+        entity_type: {
+            obj.id: obj for obj in _SYNC_ENTITY_MODELS[entity_type].query.filter(
+                _SYNC_ENTITY_MODELS[entity_type].id.in_(ids)
+            )
+        }
+        for entity_type, ids in ids_by_type.items()
+    }
+    # 每个实体在 journal 中的最新游标，一次查询覆盖整批
+    journal = ChangeJournal.__table__
+    last_written = {}
+    for entity_type, ids in ids_by_type.items():
+        last_written.update({
+            (entity_type, entity_id): cursor
+            for entity_id, cursor in db.session.execute(
+                db.select(journal.c.entity_id, func.max(journal.c.id))
+                .where(journal.c.entity_type == entity_type, journal.c.entity_id.in_(ids))
+                .group_by(journal.c.entity_id)
+            )
+        })
+
+    conflicts = []
+    applied = []
+    rejected = []
+    now = datetime.utcnow()
+    for entity_type, entity_id, values, change_cursor in parsed:
+        obj = objects.get(entity_type, {}).get(entity_id)
+        if obj is None:
+            rejected.append({'type': entity_type, 'id': entity_id, 'reason': 'not_found', 'message': '记录不存在或已删除'})
+            continue
+        if entity_id not in editable[entity_type]:
+            rejected.append({'type': entity_type, 'id': entity_id, 'reason': 'forbidden', 'message': '无权修改该记录'})
+            continue
+        if last_written.get((entity_type, entity_id), 0) > change_cursor:
+            conflicts.append({'type': entity_type, 'id': entity_id})
+            continue
+        notes = []
+        labels = {attr: label for attr, _convert, label in _SYNC_PUSH_FIELDS[entity_type].values()}
+        for attr, value in values.items():
+            before = getattr(obj, attr)
+            if before == value:
+                continue
+            setattr(obj, attr, value)
+            if attr != 'notes':
+                notes.append(f"{labels[attr]} {before if before is not None else '未设置'} → {value}")
+            else:
+                notes.append('更新备注')
+        if not notes:
+            applied.append({'type': entity_type, 'id': entity_id})
+            continue
+        obj.last_modified = now
+        if entity_type == 'item':
+            record_log(user_id=actor_id, item_id=obj.id, action_type="修改物品",
+                       details=f"离线同步 {obj.name}：" + '；'.join(notes))
+        else:
+            record_log(user_id=actor_id, location_id=obj.id, action_type="修改位置",
+                       details=f"离线同步 {obj.name}：" + '；'.join(notes))
+        applied.append({'type': entity_type, 'id': entity_id})
+    return applied, conflicts, rejected
+
+
+@app.route('/api/sync/push', methods=['POST'])
+@login_required
+def sync_push():
+    """Apply a batch of offline edits in one transaction.
+
+    Body: `{"cursor": <last synced cursor>, "changes": [{"type": "item"|"location",
+    "id": 1, "fields": {...}, "cursor": <optional per-change base>}]}`. A change
+    conflicts when the journal recorded a newer write to the same entity after
+    its base cursor; conflicts and rejected changes come back with the server's
+    current state and are not applied, the rest are committed together. The
+    applied edits show up in the next `/api/sync/changes` pull.
+    """
+    payload = request.get_json(silent=True) or {}
+    changes = payload.get('changes')
+    if not isinstance(changes, list) or not changes:
+        return jsonify({'error': 'missing_changes', 'message': '请提供需要同步的修改'}), 400
+    if len(changes) > _SYNC_PUSH_MAX_CHANGES:
+        return jsonify({
+            'error': 'too_many_changes',
+            'message': f'单次最多同步 {_SYNC_PUSH_MAX_CHANGES} 条修改'
+        }), 400
+    base_cursor = payload.get('cursor')
+    if isinstance(base_cursor, bool) or not isinstance(base_cursor, int) or base_cursor < 0:
+        return jsonify({'error': 'invalid_cursor', 'message': 'cursor 需为非负整数'}), 400
+
+    rejected = []
+    parsed = []
+    for change in changes:
+        if not isinstance(change, dict):
+            return jsonify({'error': 'invalid_change', 'message': '修改项格式无效'}), 400
+        entity_type, entity_id = change.get('type'), change.get('id')
+        fields = change.get('fields')
+        allowed = _SYNC_PUSH_FIELDS.get(entity_type)
+        if allowed is None or isinstance(entity_id, bool) or not isinstance(entity_id, int) or not isinstance(fields, dict):
+            rejected.append({'type': entity_type, 'id': entity_id, 'reason': 'invalid', 'message': '修改项格式无效'})
+            continue
+        try:
+            values = {}
+            for key, raw in fields.items():
+                if key not in allowed:
+                    raise ValueError(f'不支持同步字段 {key}')
+                attr, convert, _label = allowed[key]
+                values[attr] = convert(raw)
+        except ValueError as exc:
+            rejected.append({'type': entity_type, 'id': entity_id, 'reason': 'invalid', 'message': str(exc)})
+            continue
+        change_cursor = change.get('cursor', base_cursor)
+        if isinstance(change_cursor, bool) or not isinstance(change_cursor, int):
+            change_cursor = base_cursor
+        parsed.append((entity_type, entity_id, values, change_cursor))
+
+    applied, conflicts, write_rejected = run_write('sync_push', _apply_sync_changes, parsed, current_user.id)
+    rejected.extend(write_rejected)
+
+    # 冲突与拒绝项附带服务端当前状态，客户端据此合并后重试
+    for entries in (conflicts, rejected):
+        for entry in entries:
+            if entry['type'] in _SYNC_PUSH_FIELDS and isinstance(entry['id'], int):
+                entry['server'] = _sync_payloads(entry['type'], [entry['id']]).get(entry['id'])
+    return jsonify({
+        'applied': applied,
+        'conflicts': conflicts,
+        'rejected': rejected,
+    })
+
+
 @app.route('/items/manage-category', methods=['POST'])
 @login_required
 def manage_item_category():
@@ -4942,50 +9412,49 @@ def manage_item_category():
         flash('未选择任何需要调整的物品', 'info')
         return redirect_target()
 
-    added_items = []
-    removed_items = []
-    now = datetime.utcnow()
-
-    if add_ids:
-        candidates = Item.query.filter(Item.id.in_(add_ids)).all()
-        for item in candidates:
-            if item.features == '私人' and current_user not in item.responsible_members:
-                continue
-            if (item.category or '').strip():
-                continue
-            item.category = category_name
-            item.last_modified = now
-            added_items.append(item)
-            log = Log(
-                user_id=current_user.id,
-                item_id=item.id,
-                action_type="物品类别调整",
-                details=f"将物品 {item.name} 归类为 {category_name}"
-            )
-            db.session.add(log)
-
-    if remove_ids:
-        candidates = Item.query.filter(Item.id.in_(remove_ids)).all()
-        for item in candidates:
-            if item.features == '私人' and current_user not in item.responsible_members:
-                continue
-            if (item.category or '').strip() != category_name:
-                continue
-            item.category = None
-            item.last_modified = now
-            removed_items.append(item)
-            log = Log(
-                user_id=current_user.id,
-                item_id=item.id,
-                action_type="物品类别调整",
-                details=f"取消物品 {item.name} 的类别 {category_name}"
-            )
-            db.session.add(log)
+    rows = _editable_item_rows(add_ids | remove_ids, current_user.id)
+    added_items = [
+        rows[item_id] for item_id in sorted(add_ids)
+        if item_id in rows and not (rows[item_id].category or '').strip()
+    ]
+    removed_items = [
+        rows[item_id] for item_id in sorted(remove_ids)
+        if item_id in rows and (rows[item_id].category or '').strip() == category_name
+    ]
 
     if not added_items and not removed_items:
         flash('没有物品符合调整条件', 'info')
         return redirect_target()
 
+    now = datetime.utcnow()
+    items_table = Item.__table__
+    if added_items:
+        db.session.execute(
+            items_table.update()
+            .where(items_table.c.id.in_([row.id for row in added_items]))
+            .values(category=category_name)
+        )
+    if removed_items:
+        db.session.execute(
+            items_table.update()
+            .where(items_table.c.id.in_([row.id for row in removed_items]))
+            .values(category=None)
+        )
+    _bulk_touch(Item, [row.id for row in added_items + removed_items], now)
+    _bulk_insert_logs(
+        [{
+            'user_id': current_user.id,
+            'item_id': row.id,
+            'action_type': "物品类别调整",
+            'details': f"将物品 {row.name} 归类为 {category_name}"
+        } for row in added_items]
+        + [{
+            'user_id': current_user.id,
+            'item_id': row.id,
+            'action_type': "物品类别调整",
+            'details': f"取消物品 {row.name} 的类别 {category_name}"
+        } for row in removed_items]
+    )
     db.session.commit()
     summary = []
     if added_items:
@@ -4997,10 +9466,12 @@ def manage_item_category():
 
 @app.route('/locations')
 @login_required
+@cached_view
 def locations_list():
     locations = Location.query.options(
-        # selectinload 用于加载多级 children 避免 N+1 查询问题
-        db.selectinload(Location.children).selectinload(Location.children)
+        # 结果已包含全部位置，一层 selectinload 即可填充任意深度的 children，避免 N+1 查询
+        db.selectinload(Location.children),
+        db.selectinload(Location.responsible_members)
     ).order_by(Location.name).all()
     event_counts = dict(
         db.session.query(
@@ -5040,6 +9511,112 @@ def search_locations():
         })
     return jsonify(payload)
 
+
+_NEARBY_DEFAULT_RADIUS_METERS = 1000
+_NEARBY_MAX_RADIUS_METERS = 50000
+_NEARBY_MAX_RESULTS = 200
+
+
+def _parse_bbox_param(raw):
+    """Parse `minLng,minLat,maxLng,maxLat` (OSM/Leaflet order) into floats."""
+    parts = [part.strip() for part in _ensure_string(raw).split(',')]
+    if len(parts) != 4:
+        return None
+    values = [_parse_coordinate(part) for part in parts]
+    if any(value is None for value in values):
+        return None
+    min_lng, min_lat, max_lng, max_lat = values
+    if min_lat > max_lat or min_lng > max_lng:
+        return None
+    return min_lat, min_lng, max_lat, max_lng
+
+
+def _query_locations_in_bbox(min_lat, min_lng, max_lat, max_lng):
+    """Fetch locations inside a bounding box via geohash prefix ranges."""
+    prefixes = _geohash_cover_prefixes(min_lat, min_lng, max_lat, max_lng)
+    if not prefixes:
+        return []
+    # 前缀区间（>= prefix 且 < prefix + '~'）可直接走 ix_locations_geohash 索引
+    cell_filters = [
+        and_(Location.geohash >= prefix, Location.geohash < prefix + '~')
+        for prefix in prefixes
+    ]
+    return (
+        Location.query
+        .options(load_only(
+            Location.id, Location.name, Location.status, Location.latitude,
+            Location.longitude, Location.is_public, Location.parent_id
+        ))
+        .filter(or_(*cell_filters))
+        .filter(
+            Location.latitude.between(min_lat, max_lat),
+            Location.longitude.between(min_lng, max_lng)
+        )
+        .all()
+    )
+
+
+@app.route('/api/locations/nearby')
+@login_required
+def nearby_locations():
+    """Distance-sorted locations around a point, or all locations in a map viewport."""
+    bbox_raw = request.args.get('bbox')
+    lat = _parse_coordinate(request.args.get('lat'))
+    lng = _parse_coordinate(request.args.get('lng'))
+    limit = request.args.get('limit', type=int) or 50
+    limit = max(1, min(limit, _NEARBY_MAX_RESULTS))
+    radius = None
+    if bbox_raw:
+        bbox = _parse_bbox_param(bbox_raw)
+        if not bbox:
+            return jsonify({'error': 'invalid_bbox', 'message': 'bbox 格式应为 minLng,minLat,maxLng,maxLat'}), 400
+    else:
+        if lat is None or lng is None or not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
+            return jsonify({'error': 'invalid_coordinates', 'message': '请提供有效的 lat 与 lng 参数'}), 400
+        radius = request.args.get('radius', type=float) or _NEARBY_DEFAULT_RADIUS_METERS
+        radius = max(1.0, min(radius, float(_NEARBY_MAX_RADIUS_METERS)))
+        bbox = _bounding_box_for_radius(lat, lng, radius)
+
+    has_origin = lat is not None and lng is not None
+    results = []
+    for loc in _query_locations_in_bbox(*bbox):
+        distance = None
+        if has_origin:
+            distance = _haversine_meters(lat, lng, loc.latitude, loc.longitude)
+            if radius is not None and distance > radius:
+                continue
+        results.append((distance, loc))
+    if has_origin:
+        results.sort(key=lambda pair: (pair[0], pair[1].id))
+    else:
+        results.sort(key=lambda pair: ((pair[1].name or '').lower(), pair[1].id))
+    truncated = len(results) > limit
+    payload = []
+    for distance, loc in results[:limit]:
+        payload.append({
+            'id': loc.id,
+            'name': loc.name,
+            'status': loc.status,
+            'isPublic': bool(loc.is_public),
+            'parentId': loc.parent_id,
+            'latitude': loc.latitude,
+            'longitude': loc.longitude,
+            'distanceMeters': round(distance, 1) if distance is not None else None,
+            'detailUrl': url_for('view_location', loc_id=loc.id)
+        })
+    return jsonify({
+        'results': payload,
+        'count': len(payload),
+        'truncated': truncated,
+        'radiusMeters': radius,
+        'bbox': {
+            'minLat': bbox[0],
+            'minLng': bbox[1],
+            'maxLat': bbox[2],
+            'maxLng': bbox[3]
+        }
+    })
+
 @app.route('/api/items/search')
 @login_required
 def search_items():
@@ -5146,11 +9723,8 @@ def add_location():
 
         uploaded_files = request.files.getlist('attachments')
 
-        saved_refs = []
-        for attachment_file in uploaded_files:
-            stored_name = save_uploaded_media(attachment_file)
-            if stored_name:
-                saved_refs.append(stored_name)
+        saved_refs, upload_failures = save_uploaded_media_batch(uploaded_files)
+        _flash_upload_failures(upload_failures)
         saved_refs.extend(_collect_remote_object_keys('attachments'))
         external_urls = _extract_external_urls(request.form.get('external_attachment_urls'))
         # 先创建 Location
@@ -5165,6 +9739,7 @@ def add_location():
             longitude=longitude,
             coordinate_source=coordinate_source
         )
+        new_loc.refresh_geohash()
         trimmed_refs = new_loc.set_detail_refs(detail_refs)
         db.session.add(new_loc)
         existing_refs = set()
@@ -5183,10 +9758,9 @@ def add_location():
         if not member_objs and not is_public:
             member_objs = [current_user]
         new_loc.responsible_members = member_objs
-        db.session.commit()
+        db.session.flush()
         # 记录日志
-        log = Log(user_id=current_user.id, location_id=new_loc.id, action_type="新增位置", details=f"Added location {new_loc.name}")
-        db.session.add(log)
+        record_log(user_id=current_user.id, location_id=new_loc.id, action_type="新增位置", details=f"Added location {new_loc.name}")
         db.session.commit()
 
         if trimmed_refs:
@@ -5251,10 +9825,10 @@ def edit_location(loc_id):
                     db.session.delete(att)
 
         uploaded_files = request.files.getlist('attachments')
-        for attachment_file in uploaded_files:
-            stored_name = save_uploaded_media(attachment_file)
-            if stored_name:
-                location.attachments.append(Attachment(filename=stored_name))
+        stored_names, upload_failures = save_uploaded_media_batch(uploaded_files)
+        _flash_upload_failures(upload_failures)
+        for stored_name in stored_names:
+            location.attachments.append(Attachment(filename=stored_name))
         remote_refs = _collect_remote_object_keys('attachments')
         if remote_refs:
             _append_media_records(location.attachments, Attachment, remote_refs)
@@ -5278,13 +9852,11 @@ def edit_location(loc_id):
         location.latitude = latitude
         location.longitude = longitude
         location.coordinate_source = coordinate_source
+        location.refresh_geohash()
         location.last_modified = datetime.utcnow()
-        db.session.commit()
-        for ref in pending_delete_refs:
-            remove_uploaded_file(ref)
         # 记录日志
-        log = Log(user_id=current_user.id, location_id=location.id, action_type="修改位置", details=f"Edited location {location.name}")
-        db.session.add(log)
+        record_log(user_id=current_user.id, location_id=location.id, action_type="修改位置", details=f"Edited location {location.name}")
+        enqueue_attachment_deletions(pending_delete_refs)
         db.session.commit()
         if trimmed_refs:
             flash('部分参考信息过长，已保留前几条，请确认长度。', 'warning')
@@ -5309,20 +9881,20 @@ def delete_location(loc_id):
         abort(403)
     refs_to_delete = sorted(set(location.attachment_filenames))
     db.session.delete(location)
-    db.session.commit()
-    for fname in refs_to_delete:
-        remove_uploaded_file(fname)
     # 记录日志
-    log = Log(user_id=current_user.id, location_id=loc_id, action_type="删除位置", details=f"Deleted location {location.name}")
-    db.session.add(log)
+    record_log(user_id=current_user.id, location_id=loc_id, action_type="删除位置", details=f"Deleted location {location.name}")
+    enqueue_attachment_deletions(refs_to_delete)
     db.session.commit()
     flash('社区空间已删除', 'info')
     return redirect(url_for('locations_list'))
 
 @app.route('/locations/<int:loc_id>')
 @login_required
+@cached_view
 def view_location(loc_id):
-    location = Location.query.get_or_404(loc_id)
+    location = Location.query.options(
+        db.selectinload(Location.items).selectinload(Item.responsible_members)
+    ).filter_by(id=loc_id).first_or_404()
     # 获取该位置包含的所有物品（多对多）
     items_at_location = sorted(location.items, key=lambda item: item.name.lower())
     # 分类统计状态标签（如：用完、少量、借出）
@@ -5359,6 +9931,7 @@ def view_location(loc_id):
         responsible_stats.append({'member': member, 'count': count})
 
     available_items = Item.query.filter(~Item.locations.any(Location.id == location.id)) \
+                                .options(db.selectinload(Item.responsible_members)) \
                                 .order_by(Item.name.asc()).all()
 
     events = (
@@ -5447,27 +10020,38 @@ def manage_location_items(loc_id):
         if not selected_ids:
             flash('请选择要加入的位置物品', 'warning')
             return redirect(url_for('view_location', loc_id=loc_id))
-        items_to_add = Item.query.filter(Item.id.in_(selected_ids)).all()
+        linked_ids = {
+            item_id for (item_id,) in db.session.query(item_locations.c.item_id).filter(
+                item_locations.c.location_id == location.id,
+                item_locations.c.item_id.in_(selected_ids)
+            ).all()
+        }
+        candidate_ids = selected_ids - linked_ids
         added_items = []
-        for item in items_to_add:
-            if location not in item.locations:
-                item.locations.append(location)
-                added_items.append(item)
+        if candidate_ids:
+            added_items = (
+                db.session.query(Item.id, Item.name)
+                .filter(Item.id.in_(candidate_ids))
+                .order_by(Item.id)
+                .all()
+            )
         if not added_items:
             flash('所选物品已在该位置中', 'info')
             return redirect(url_for('view_location', loc_id=loc_id))
         now = datetime.utcnow()
         location.last_modified = now
-        for item in added_items:
-            item.last_modified = now
-            log = Log(
-                user_id=current_user.id,
-                item_id=item.id,
-                location_id=location.id,
-                action_type="物品关联位置",
-                details=f"关联物品 {item.name} 至位置 {location.name}"
-            )
-            db.session.add(log)
+        _bulk_link_rows(
+            item_locations, 'item_id', 'location_id',
+            inserts=[(row.id, location.id) for row in added_items]
+        )
+        _bulk_touch(Item, [row.id for row in added_items], now)
+        _bulk_insert_logs([{
+            'user_id': current_user.id,
+            'item_id': row.id,
+            'location_id': location.id,
+            'action_type': "物品关联位置",
+            'details': f"关联物品 {row.name} 至位置 {location.name}"
+        } for row in added_items])
         db.session.commit()
         flash(f"{len(added_items)} 个物品已加入此位置", 'success')
         return redirect(url_for('view_location', loc_id=loc_id))
@@ -5478,27 +10062,30 @@ def manage_location_items(loc_id):
     if not selected_ids:
         flash('请选择要移除的物品', 'warning')
         return redirect(url_for('view_location', loc_id=loc_id))
-    items_to_remove = Item.query.filter(Item.id.in_(selected_ids)).all()
-    removed_items = []
-    for item in items_to_remove:
-        if location in item.locations:
-            item.locations.remove(location)
-            removed_items.append(item)
+    removed_items = (
+        db.session.query(Item.id, Item.name)
+        .join(item_locations, item_locations.c.item_id == Item.id)
+        .filter(item_locations.c.location_id == location.id, Item.id.in_(selected_ids))
+        .order_by(Item.id)
+        .all()
+    )
     if not removed_items:
         flash('未移除任何物品', 'info')
         return redirect(url_for('view_location', loc_id=loc_id))
     now = datetime.utcnow()
     location.last_modified = now
-    for item in removed_items:
-        item.last_modified = now
-        log = Log(
-            user_id=current_user.id,
-            item_id=item.id,
-            location_id=location.id,
-            action_type="物品移出位置",
-            details=f"将物品 {item.name} 从位置 {location.name} 移除"
-        )
-        db.session.add(log)
+    _bulk_link_rows(
+        item_locations, 'item_id', 'location_id',
+        deletes=[(row.id, location.id) for row in removed_items]
+    )
+    _bulk_touch(Item, [row.id for row in removed_items], now)
+    _bulk_insert_logs([{
+        'user_id': current_user.id,
+        'item_id': row.id,
+        'location_id': location.id,
+        'action_type': "物品移出位置",
+        'details': f"将物品 {row.name} 从位置 {location.name} 移除"
+    } for row in removed_items])
     db.session.commit()
     flash(f"{len(removed_items)} 个物品已从该位置移除", 'success')
     return redirect(url_for('view_location', loc_id=loc_id))
@@ -5506,9 +10093,22 @@ def manage_location_items(loc_id):
 
 @app.route('/members')
 @login_required
+@cached_view
 def members_list():
     members = Member.query.order_by(Member.name).all()
     followed_ids = {mem.id for mem in current_user.following}
+    # 计数一次性分组统计，避免逐个成员加载负责物品/位置集合
+    item_counts = dict(
+        db.session.query(item_members.c.member_id, func.count(item_members.c.item_id))
+        .group_by(item_members.c.member_id).all()
+    )
+    location_counts = dict(
+        db.session.query(location_members.c.member_id, func.count(location_members.c.location_id))
+        .group_by(location_members.c.member_id).all()
+    )
+    event_counts = dict(
+        db.session.query(Event.owner_id, func.count(Event.id)).group_by(Event.owner_id).all()
+    )
     def sort_key(member):
         display_name = (member.name or member.username).lower()
         if member.id == current_user.id:
@@ -5519,7 +10119,22 @@ def members_list():
             group = 2
         return (group, display_name)
     members.sort(key=sort_key)
-    return render_template('members.html', members=members, followed_ids=followed_ids)
+    return render_template('members.html',
+                           members=members,
+                           followed_ids=followed_ids,
+                           item_counts=item_counts,
+                           location_counts=location_counts,
+                           event_counts=event_counts)
+
+
+def _toggle_follow(follower_id, member_id):
+    follower = db.session.get(Member, follower_id)
+    member = db.session.get(Member, member_id)
+    if member in follower.following:
+        follower.following.remove(member)
+        return False
+    follower.following.append(member)
+    return True
 
 
 @app.route('/members/<int:member_id>/toggle_follow', methods=['POST'])
@@ -5527,14 +10142,8 @@ def members_list():
 def toggle_follow(member_id):
     if member_id == current_user.id:
         return jsonify({'error': '不能关注自己'}), 400
-    member = Member.query.get_or_404(member_id)
-    if member in current_user.following:
-        current_user.following.remove(member)
-        followed = False
-    else:
-        current_user.following.append(member)
-        followed = True
-    db.session.commit()
+    Member.query.get_or_404(member_id)
+    followed = run_write('toggle_follow', _toggle_follow, current_user.id, member_id)
     return jsonify({'followed': followed})
 
 @app.route('/member/<int:member_id>')
@@ -5572,20 +10181,16 @@ def profile(member_id):
     normal_locs.sort(key=lambda loc: (loc.name or '').lower())
     locations_resp = critical_locs + normal_locs  # 告警状态的置顶
 
-    item_alert_counts = {status: 0 for status in _ITEM_ALERT_STOCK_STATUSES}
+    # 告警计数来自 status_alerts 物化表，样例取自上面已排好序的负责列表
+    alert_counts = _status_alert_counts(member.id)
+    item_alert_counts = alert_counts['item']
     item_alert_samples = {status: [] for status in _ITEM_ALERT_STOCK_STATUSES}
     for item in critical_items:
-        status = _normalize_item_stock_status(item.stock_status)
-        if not status:
-            continue
-        item_alert_counts[status] += 1
-        if len(item_alert_samples[status]) < 3:
-            item_alert_samples[status].append(item)
+        samples = item_alert_samples.get(_normalize_item_stock_status(item.stock_status))
+        if samples is not None and len(samples) < 3:
+            samples.append(item)
     item_alerts = []
-    for status in _ITEM_ALERT_STOCK_STATUSES:
-        count = item_alert_counts.get(status, 0)
-        if count <= 0:
-            continue
+    for status, count in _ordered_alert_counts(item_alert_counts, _ITEM_ALERT_STOCK_STATUSES).items():
         item_alerts.append({
             'status': status,
             'count': count,
@@ -5594,20 +10199,40 @@ def profile(member_id):
             'message': _item_alert_message(status, count),
             'sample_items': item_alert_samples.get(status, [])
         })
-    location_alert_counts = {status: 0 for status in _LOCATION_ALERT_STATUSES}
+    # 消耗预测由后台任务批量计算，这里只按负责物品读取即将用完的结果
+    alert_days = app.config.get('DEPLETION_ALERT_DAYS', 0)
+    forecast_candidates = {
+        it.id: it for it in all_items
+        if _normalize_item_stock_status(it.stock_status) not in ('用完', '舍弃')
+    }
+    if alert_days and forecast_candidates:
+        depleting = (
+            db.session.execute(
+                db.select(ItemDepletionForecast.item_id)
+                .where(
+                    ItemDepletionForecast.item_id.in_(list(forecast_candidates)),
+                    ItemDepletionForecast.projected_depletion_at <= datetime.utcnow() + timedelta(days=alert_days)
+                )
+                .order_by(ItemDepletionForecast.projected_depletion_at.asc())
+            ).scalars().all()
+        )
+        if depleting:
+            item_alerts.append({
+                'status': '预计用完',
+                'count': len(depleting),
+                'level': 'warning',
+                'action_label': '提前补货',
+                'message': f'按近期消耗，你有 {len(depleting)} 个物品预计在 {alert_days} 天内用完，建议提前补货。',
+                'sample_items': [forecast_candidates[item_id] for item_id in depleting[:3]]
+            })
+    location_alert_counts = alert_counts['location']
     location_alert_samples = {status: [] for status in _LOCATION_ALERT_STATUSES}
     for location in critical_locs:
-        status = _normalize_location_status(location.status)
-        if not status:
-            continue
-        location_alert_counts[status] += 1
-        if len(location_alert_samples[status]) < 3:
-            location_alert_samples[status].append(location)
+        samples = location_alert_samples.get(_normalize_location_status(location.status))
+        if samples is not None and len(samples) < 3:
+            samples.append(location)
     location_alerts = []
-    for status in _LOCATION_ALERT_STATUSES:
-        count = location_alert_counts.get(status, 0)
-        if count <= 0:
-            continue
+    for status, count in _ordered_alert_counts(location_alert_counts, _LOCATION_ALERT_STATUSES).items():
         location_alerts.append({
             'status': status,
             'count': count,
@@ -5630,35 +10255,43 @@ def profile(member_id):
     ).filter(
         or_(
             Event.owner_id == member.id,
-            Event.participant_links.any(EventParticipant.member_id == member.id)
-        )
+            Event.id.in_(
+                db.select(EventParticipant.event_id).where(EventParticipant.member_id == member.id)
+            )
+        ),
+        # 可见性在 SQL 中过滤，不再加载后逐个调用 can_view
+        _event_visibility_clause(current_user.id)
     ).order_by(Event.start_time.asc(), Event.created_at.desc())
     now = datetime.utcnow()
     for evt in event_query.all():
-        if not evt.can_view(current_user):
-            continue
-        if evt.start_time and evt.start_time < now:
+        if evt.start_time and evt.start_time < now and not _is_active_series(evt, now):
             events_past.append(evt)
         else:
             events_upcoming.append(evt)
 
+    # 借用中的物品：按借用人索引直接读取未归还记录
+    open_loans = _open_loans_query().filter(ItemLoan.borrower_id == member.id) \
+        .order_by(ItemLoan.checked_out_at.desc()).all()
+
     # 通知列表：他人对该成员负责的物品/位置的最近更新
     notifications = []
+    notification_unread_count = 0
     if is_self:
-        # 只查找该成员负责的物品和位置的日志（通过多对多关系判断负责权）
+        # 收件箱在写日志时已扇出，这里只读取成员自己的索引行
         notifications = (
-            Log.query
-            .filter(
-                or_(
-                    Log.item.has(Item.responsible_members.any(Member.id == member.id)),
-                    Log.location.has(Location.responsible_members.any(Member.id == member.id))
-                ),
-                Log.user_id != member.id
+            Notification.query
+            .options(
+                selectinload(Notification.user),
+                selectinload(Notification.item),
+                selectinload(Notification.location),
+                selectinload(Notification.event)
             )
-            .order_by(Log.timestamp.desc())
+            .filter(Notification.member_id == member.id)
+            .order_by(Notification.timestamp.desc(), Notification.id.desc())
             .limit(5)
             .all()
         )
+        notification_unread_count = _unread_notification_count(member.id)
     member_index, mention_lookup = build_member_lookup()
     profile_notes_html = None
     profile_meta, _ = _parse_profile_notes(member.notes)
@@ -5744,6 +10377,7 @@ def profile(member_id):
                            items_resp=items_resp,
                            locations_resp=locations_resp,
                            notifications=notifications,
+                           notification_unread_count=notification_unread_count,
                            user_logs=user_logs,
                            profile_notes_html=profile_notes_html,
                            feedback_entries=feedback_entries,
@@ -5755,6 +10389,8 @@ def profile(member_id):
                            location_alerts=location_alerts,
                            events_upcoming=events_upcoming,
                            events_past=events_past,
+                           open_loans=open_loans,
+                           now=now,
                            is_following=is_following,
                            profile_meta=profile_meta,
                            profile_social_links=profile_meta['social_links'],
@@ -5786,137 +10422,1468 @@ def edit_profile(member_id):
             url = _ensure_string(url).strip()
             if not url:
                 continue
-            if not re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://', url):
-                if url.startswith('www.'):
-                    url = 'https://' + url
-            label = _ensure_string(label).strip()
-            social_links.append({'label': label, 'url': url})
-        aff_loc_ids = request.form.getlist('affiliation_location_id')
-        aff_relations = request.form.getlist('affiliation_relation')
-        aff_notes = request.form.getlist('affiliation_note')
-        location_relations = []
-        for loc_id_raw, relation_raw, note_raw in zip(aff_loc_ids, aff_relations, aff_notes):
+            if not re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://', url):
+                if url.startswith('www.'):
+                    url = 'https://' + url
+            label = _ensure_string(label).strip()
+            social_links.append({'label': label, 'url': url})
+        aff_loc_ids = request.form.getlist('affiliation_location_id')
+        aff_relations = request.form.getlist('affiliation_relation')
+        aff_notes = request.form.getlist('affiliation_note')
+        location_relations = []
+        for loc_id_raw, relation_raw, note_raw in zip(aff_loc_ids, aff_relations, aff_notes):
+            try:
+                loc_id = int(loc_id_raw)
+            except (TypeError, ValueError):
+                continue
+            relation = _ensure_string(relation_raw).strip()
+            if relation not in _MEMBER_RELATION_TYPES:
+                relation = 'other'
+            note = _ensure_string(note_raw).strip()
+            location_relations.append({
+                'location_id': loc_id,
+                'relation': relation,
+                'note': note
+            })
+        interest_item_ids = request.form.getlist('interest_item_id')
+        interest_relations = request.form.getlist('interest_item_relation')
+        interest_notes = request.form.getlist('interest_item_note')
+        item_relations = []
+        for item_id_raw, relation_raw, note_raw in zip(interest_item_ids, interest_relations, interest_notes):
+            try:
+                item_id = int(item_id_raw)
+            except (TypeError, ValueError):
+                continue
+            relation = _ensure_string(relation_raw).strip()
+            if relation not in _MEMBER_ITEM_REL_TYPES:
+                relation = 'other'
+            note = _ensure_string(note_raw).strip()
+            item_relations.append({
+                'item_id': item_id,
+                'relation': relation,
+                'note': note
+            })
+        event_ids = request.form.getlist('event_relation_event_id')
+        event_relations_raw = request.form.getlist('event_relation_relation')
+        event_notes = request.form.getlist('event_relation_note')
+        event_relations = []
+        for event_id_raw, relation_raw, note_raw in zip(event_ids, event_relations_raw, event_notes):
+            try:
+                event_id = int(event_id_raw)
+            except (TypeError, ValueError):
+                continue
+            relation = _ensure_string(relation_raw).strip()
+            if relation not in _MEMBER_EVENT_REL_TYPES:
+                relation = 'other'
+            note = _ensure_string(note_raw).strip()
+            event_relations.append({
+                'event_id': event_id,
+                'relation': relation,
+                'note': note
+            })
+        profile_payload = {
+            'bio': bio,
+            'social_links': social_links,
+            'location_relations': location_relations,
+            'item_relations': item_relations,
+            'event_relations': event_relations
+        }
+        member.notes = _serialize_profile_notes(profile_payload)
+        # 如填写了新密码则更新密码
+        new_password = request.form.get('password')
+        if new_password and new_password.strip() != '':
+            member.set_password(new_password)
+        # 更新头像
+        new_photo_ref = None
+        remote_photo_keys = _collect_remote_object_keys('photo')
+        if remote_photo_keys:
+            new_photo_ref = remote_photo_keys[-1]
+        else:
+            image_file = request.files.get('photo')
+            if image_file and image_file.filename != '' and allowed_file(image_file.filename):
+                if determine_media_kind(image_file.filename) != 'image':
+                    flash('头像仅支持图片格式，请选择 JPG / PNG 等常见格式。', 'warning')
+                else:
+                    stored_name = save_uploaded_media(image_file)
+                    if stored_name:
+                        new_photo_ref = stored_name
+        pending_delete_photo = None
+        if new_photo_ref:
+            if member.photo and member.photo != new_photo_ref:
+                pending_delete_photo = member.photo
+            member.photo = new_photo_ref
+        member.last_modified = datetime.utcnow()
+        if pending_delete_photo:
+            enqueue_attachment_deletions([pending_delete_photo])
+        db.session.commit()
+        flash('个人信息已更新', 'success')
+        return redirect(url_for('profile', member_id=member_id))
+    locations = Location.query.order_by(func.lower(Location.name)).all()
+    items = Item.query.order_by(func.lower(Item.name)).all()
+    events = Event.query.order_by(func.lower(Event.title)).all()
+    return render_template('edit_profile.html',
+                           member=member,
+                           profile_meta=profile_meta,
+                           structured_notes=structured,
+                           relation_lookup=_MEMBER_RELATION_TYPES,
+                           item_relation_lookup=_MEMBER_ITEM_REL_TYPES,
+                           event_relation_lookup=_MEMBER_EVENT_REL_TYPES,
+                           locations=locations,
+                           items=items,
+                           events=events)
+
+@app.route('/message/<int:member_id>', methods=['POST'])
+@login_required
+def post_message(member_id):
+    # 提交留言
+    receiver = Member.query.get_or_404(member_id)
+    content = request.form.get('content')
+    if content and content.strip() != '':
+        append_feedback_entry(receiver, current_user, content.strip())
+        receiver.last_modified = datetime.utcnow()
+        db.session.commit()
+        flash('留言已发布', 'success')
+    return redirect(url_for('profile', member_id=member_id))
+
+
+@app.errorhandler(403)
+def forbidden(error):
+    description = getattr(error, 'description', None) or '无权访问该资源。'
+    if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
+        return jsonify({'error': 'forbidden', 'message': description}), 403
+    back_url = request.referrer if request.referrer else url_for('index')
+    return render_template('error_403.html', description=description, back_url=back_url), 403
+
+_TIMELINE_KINDS = {
+    'item': 'item_id',
+    'location': 'location_id',
+    'event': 'event_id',
+    'member': 'user_id',
+}
+_TIMELINE_DEFAULT_LIMIT = 20
+_TIMELINE_MAX_LIMIT = 100
+
+
+def _parse_timeline_cursor(raw):
+    """Decode a `<iso timestamp>,<log id>` keyset cursor."""
+    raw = _ensure_string(raw).strip()
+    if not raw:
+        return None
+    ts_raw, _, id_raw = raw.rpartition(',')
+    try:
+        return datetime.fromisoformat(ts_raw), int(id_raw)
+    except ValueError:
+        return None
+
+
+def _query_timeline_rows(model, column_name, entity_id, cursor, limit):
+    table = model.__table__
+    stmt = db.select(table).where(table.c[column_name] == entity_id)
+    if cursor:
+        cursor_ts, cursor_id = cursor
+        stmt = stmt.where(or_(
+            table.c.timestamp < cursor_ts,
+            and_(table.c.timestamp == cursor_ts, table.c.id < cursor_id)
+        ))
+    stmt = stmt.order_by(table.c.timestamp.desc(), table.c.id.desc()).limit(limit)
+    return db.session.execute(stmt).mappings().all()
+
+
+@app.route('/api/timeline/<string:kind>/<int:entity_id>')
+@login_required
+def entity_timeline(kind, entity_id):
+    """Newest-first log timeline for one item/location/event/member with keyset paging.
+
+    Pass the returned `nextCursor` as `?before=` for the next page. Live logs are
+    read first; once exhausted the same cursor continues into logs_archive, which
+    only holds rows older than anything still live.
+    """
+    column_name = _TIMELINE_KINDS.get(kind)
+    if not column_name:
+        abort(404)
+    if kind == 'member':
+        if entity_id != current_user.id:
+            abort(403)
+    elif kind == 'event':
+        event = Event.query.get_or_404(entity_id)
+        if not event.can_view(current_user):
+            abort(403)
+    before_raw = request.args.get('before')
+    cursor = _parse_timeline_cursor(before_raw)
+    if before_raw and cursor is None:
+        return jsonify({'error': 'invalid_cursor', 'message': '分页游标无效'}), 400
+    limit = request.args.get('limit', type=int) or _TIMELINE_DEFAULT_LIMIT
+    limit = max(1, min(limit, _TIMELINE_MAX_LIMIT))
+
+    rows = [(row, False) for row in _query_timeline_rows(Log, column_name, entity_id, cursor, limit + 1)]
+    if len(rows) <= limit:
+        archive_cursor = cursor
+        if rows:
+            archive_cursor = (rows[-1][0]['timestamp'], rows[-1][0]['id'])
+        rows.extend(
+            (row, True)
+            for row in _query_timeline_rows(
+                LogArchive, column_name, entity_id, archive_cursor, limit + 1 - len(rows)
+            )
+        )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    member_names = {}
+    user_ids = {row['user_id'] for row, _ in rows if row['user_id']}
+    if user_ids:
+        member_names = {
+            mem_id: (name or username)
+            for mem_id, name, username in db.session.query(
+                Member.id, Member.name, Member.username
+            ).filter(Member.id.in_(user_ids)).all()
+        }
+    entries = []
+    for row, archived in rows:
+        timestamp = row['timestamp']
+        entries.append({
+            'id': row['id'],
+            'timestamp': timestamp.isoformat() if timestamp else None,
+            'actionType': row['action_type'],
+            'details': row['details'],
+            'userId': row['user_id'],
+            'userName': member_names.get(row['user_id']),
+            'itemId': row['item_id'],
+            'locationId': row['location_id'],
+            'eventId': row['event_id'],
+            'archived': archived,
+        })
+    next_cursor = None
+    if has_more and rows and rows[-1][0]['timestamp']:
+        last = rows[-1][0]
+        next_cursor = f"{last['timestamp'].isoformat()},{last['id']}"
+    return jsonify({'entries': entries, 'nextCursor': next_cursor})
+
+
+_NOTIFICATION_DEFAULT_LIMIT = 20
+_NOTIFICATION_MAX_LIMIT = 100
+
+
+def _serialize_notification(notification):
+    actor = notification.user
+    return {
+        'id': notification.id,
+        'timestamp': notification.timestamp.isoformat() if notification.timestamp else None,
+        'read': notification.read_at is not None,
+        'actionType': notification.action_type,
+        'details': notification.details,
+        'userId': notification.user_id,
+        'userName': (actor.name or actor.username) if actor else None,
+        'itemId': notification.item_id,
+        'locationId': notification.location_id,
+        'eventId': notification.event_id,
+    }
+
+
+def _unread_notification_count(member_id):
+    return (
+        db.session.query(func.count(Notification.id))
+        .filter(Notification.member_id == member_id, Notification.read_at.is_(None))
+        .scalar()
+    ) or 0
+
+
+@app.route('/api/notifications')
+@login_required
+def list_notifications():
+    """Current user's inbox, newest first; `?before=<id>` pages, `?unread=1` filters."""
+    limit = request.args.get('limit', type=int) or _NOTIFICATION_DEFAULT_LIMIT
+    limit = max(1, min(limit, _NOTIFICATION_MAX_LIMIT))
+    query = Notification.query.options(selectinload(Notification.user)).filter(
+        Notification.member_id == current_user.id
+    )
+    if request.args.get('unread') in {'1', 'true', 'yes'}:
+        query = query.filter(Notification.read_at.is_(None))
+    before_id = request.args.get('before', type=int)
+    if before_id:
+        query = query.filter(Notification.id < before_id)
+    rows = query.order_by(Notification.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        'notifications': [_serialize_notification(row) for row in rows],
+        'nextCursor': rows[-1].id if has_more and rows else None,
+        'unreadCount': _unread_notification_count(current_user.id)
+    })
+
+
+@app.route('/api/notifications/count')
+@login_required
+def notification_count():
+    return jsonify({'unread': _unread_notification_count(current_user.id)})
+
+
+@app.route('/api/alerts/counts')
+@login_required
+def alert_counts():
+    """Open status alerts of one member (default: current user), grouped by status."""
+    member_id = request.args.get('member_id', type=int) or current_user.id
+    if member_id != current_user.id and db.session.get(Member, member_id) is None:
+        return jsonify({'error': 'member_not_found', 'message': '成员不存在'}), 404
+    counts = _status_alert_counts(member_id)
+    items = _ordered_alert_counts(counts['item'], _ITEM_ALERT_STOCK_STATUSES)
+    locations = _ordered_alert_counts(counts['location'], _LOCATION_ALERT_STATUSES)
+    return jsonify({
+        'memberId': member_id,
+        'items': items,
+        'locations': locations,
+        'total': sum(items.values()) + sum(locations.values())
+    })
+
+
+@app.route('/api/alerts/summary')
+@login_required
+def alert_summary():
+    """Lab-wide alert counts per status; `?status=` adds the members holding that status."""
+    counts = _status_alert_counts()
+    items = _ordered_alert_counts(counts['item'], _ITEM_ALERT_STOCK_STATUSES)
+    locations = _ordered_alert_counts(counts['location'], _LOCATION_ALERT_STATUSES)
+    payload = {
+        'items': items,
+        'locations': locations,
+        'total': sum(items.values()) + sum(locations.values())
+    }
+    status = (request.args.get('status') or '').strip()
+    if status:
+        if status not in _ITEM_ALERT_STATUS_PRIORITY and status not in _LOCATION_ALERT_STATUS_PRIORITY:
+            return jsonify({'error': 'invalid_status', 'message': '不是告警状态'}), 400
+        alerts = StatusAlert.__table__
+        rows = db.session.execute(
+            db.select(alerts.c.member_id, func.count().label('count'))
+            .where(alerts.c.status == status)
+            .group_by(alerts.c.member_id)
+            .order_by(func.count().desc(), alerts.c.member_id)
+        ).all()
+        names = dict(db.session.execute(
+            db.select(Member.id, func.coalesce(Member.name, Member.username))
+            .where(Member.id.in_([row.member_id for row in rows]))
+        ).all()) if rows else {}
+        payload['status'] = status
+        payload['members'] = [
+            {'memberId': row.member_id, 'name': names.get(row.member_id), 'count': row.count}
+            for row in rows
+        ]
+    return jsonify(payload)
+
+
+@app.route('/api/notifications/read', methods=['POST'])
+@login_required
+def mark_notifications_read():
+    """Mark `ids` (or everything with `all`) as read; form posts redirect back to the profile."""
+    payload = request.get_json(silent=True)
+    is_json = payload is not None
+    if not is_json:
+        payload = {
+            'all': request.form.get('all') in {'1', 'true', 'on'},
+            'ids': [val for val in request.form.getlist('ids') if val.isdigit()],
+        }
+    ids = _coerce_id_set(payload.get('ids'))
+    if ids is None:
+        return jsonify({'error': 'invalid_ids', 'message': 'ids 格式无效'}), 400
+    table = Notification.__table__
+    stmt = table.update().where(table.c.member_id == current_user.id, table.c.read_at.is_(None))
+    if not payload.get('all'):
+        if not ids:
+            return jsonify({'error': 'missing_ids', 'message': '请指定需要标记的通知'}), 400
+        stmt = stmt.where(table.c.id.in_(ids))
+    result = db.session.execute(stmt.values(read_at=datetime.utcnow()))
+    db.session.commit()
+    if not is_json:
+        flash('通知已标记为已读', 'success')
+        return redirect(url_for('profile', member_id=current_user.id))
+    return jsonify({'updated': result.rowcount or 0, 'unread': _unread_notification_count(current_user.id)})
+
+
+@app.cli.command('forecast-depletion')
+@click.option('--window-days', type=int, default=None, help='拟合所用的历史天数（默认读取 DEPLETION_FORECAST_WINDOW_DAYS）')
+@click.option('--show', type=int, default=10, help='输出最早用完的前 N 个物品')
+@cli_requires_schema
+def forecast_depletion_command(window_days, show):
+    """Recompute projected depletion dates from the quantity ledger."""
+    started = time.perf_counter()
+    try:
+        written = forecast_item_depletion(window_days=window_days)
+    except RuntimeError as exc:
+        raise click.ClickException(str(exc))
+    click.echo(f'已更新 {written} 个物品的消耗预测，用时 {time.perf_counter() - started:.2f}s')
+    soonest = (
+        ItemDepletionForecast.query.options(selectinload(ItemDepletionForecast.item))
+        .filter(ItemDepletionForecast.projected_depletion_at.isnot(None))
+        .order_by(ItemDepletionForecast.projected_depletion_at.asc())
+        .limit(max(0, show))
+        .all()
+    )
+    for forecast in soonest:
+        click.echo(
+            f"{forecast.item.name}\t约 {forecast.consumption_per_day:g}/天\t"
+            f"预计 {format_china_time(forecast.projected_depletion_at, '%Y-%m-%d')} 用完"
+        )
+
+
+@app.cli.command('overdue-loans')
+@click.option('--member', 'member_username', default=None, help='只列出该用户名的逾期借用')
+@cli_requires_schema
+def overdue_loans_command(member_username):
+    """List loans past their due date."""
+    now = datetime.utcnow()
+    query = _overdue_loans_query(now).order_by(ItemLoan.due_at.asc())
+    if member_username:
+        member = Member.query.filter_by(username=member_username).first()
+        if member is None:
+            raise click.ClickException(f'用户 {member_username} 不存在')
+        query = query.filter(ItemLoan.borrower_id == member.id)
+    loans = query.all()
+    for loan in loans:
+        borrower = loan.borrower
+        overdue_days = (now - loan.due_at).days
+        click.echo(
+            f"{loan.item.name}\t{borrower.name or borrower.username}\t"
+            f"应还 {format_china_time(loan.due_at)}\t逾期 {overdue_days} 天"
+        )
+    click.echo(f'共 {len(loans)} 条逾期借用')
+
+
+@app.cli.command('alert-digest')
+@click.option('--dry-run', is_flag=True, help='只输出各成员的告警汇总，不写入通知')
+@click.option('--rebuild', is_flag=True, help='先按当前状态重建 status_alerts 再汇总')
+@cli_requires_schema
+def alert_digest_command(dry_run, rebuild):
+    """Send each member a daily summary of their open status alerts."""
+    if rebuild:
+        written = rebuild_status_alerts()
+        db.session.commit()
+        click.echo(f'已重建 {written} 条状态告警')
+    if not dry_run:
+        click.echo(f'已发送 {send_alert_digest()} 份告警日报')
+        return
+    digest = build_alert_digest()
+    names = dict(db.session.execute(
+        db.select(Member.id, func.coalesce(Member.name, Member.username)).where(Member.id.in_(list(digest)))
+    ).all()) if digest else {}
+    for member_id, entries in digest.items():
+        click.echo(f"{names.get(member_id, member_id)}\t{_format_alert_digest(entries)}")
+    click.echo(f'共 {len(digest)} 位成员有待处理告警')
+
+
+@app.cli.command('compact-change-journal')
+@cli_requires_schema
+def compact_change_journal_command():
+    """Drop superseded change_journal rows (the newest row per entity is kept)."""
+    click.echo(f'已清理 {compact_change_journal()} 条被覆盖的变更记录')
+
+
+@app.cli.command('replay-audit-spool')
+@cli_requires_schema
+def replay_audit_spool_command():
+    """Insert audit-log records left in spool files by crashed processes."""
+    click.echo(f'已回放 {replay_audit_spool()} 条暂存的审计日志')
+
+
+@app.cli.command('attachment-deletions')
+@click.option('--drain', is_flag=True, help='立即处理到期的删除任务，直到队列中没有到期项')
+@click.option('--retry-dead', is_flag=True, help='把死信重新放回队列（重置重试次数）')
+@cli_requires_schema
+def attachment_deletions_command(drain, retry_dead):
+    """Inspect the attachment deletion queue and its dead letters."""
+    if retry_dead:
+        revived = AttachmentDeletion.query.filter(AttachmentDeletion.dead_at.isnot(None)).update(
+            {'dead_at': None, 'attempts': 0, 'next_attempt_at': datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.session.commit()
+        click.echo(f'已重新排队 {revived} 条死信')
+    if drain:
+        totals = Counter()
+        while True:
+            stats = drain_attachment_deletions()
+            totals.update(stats)
+            if not sum(stats.values()):
+                break
+        click.echo('已删除 {deleted} 个，仍被引用跳过 {skipped} 个，待重试 {retrying} 个，移入死信 {dead} 个'.format(
+            **{key: totals.get(key, 0) for key in ('deleted', 'skipped', 'retrying', 'dead')}
+        ))
+    counts = attachment_deletion_counts()
+    click.echo(f"待删除 {counts['pending']} 个，死信 {counts['dead']} 个")
+    for row in (
+        AttachmentDeletion.query.filter(AttachmentDeletion.dead_at.isnot(None))
+        .order_by(AttachmentDeletion.dead_at.desc()).limit(20)
+    ):
+        click.echo(f"{row.ref}\t{row.attempts} 次\t{row.last_error or ''}")
+
+
+@app.cli.command('archive-logs')
+@click.option('--days', type=int, default=None, help='归档早于该天数的日志（默认读取 LOG_ARCHIVE_AFTER_DAYS）')
+@cli_requires_schema
+def archive_logs_command(days):
+    """Move old logs into logs_archive."""
+    moved = _archive_old_logs(older_than_days=days)
+    click.echo(f'已归档 {moved} 条日志')
+
+
+# ---------------------------------------------------------------------------
+# 批量导入：CSV/XLSX 流式读取 + 逐行校验 + executemany 批量写入
+# ---------------------------------------------------------------------------
+_IMPORT_KINDS = ('items', 'locations')
+_IMPORT_BATCH_SIZE = 1000
+_IMPORT_MAX_REPORTED_ERRORS = 200
+_IMPORT_LIST_SPLIT_PATTERN = re.compile(r'[,，;；、\n]+')
+_IMPORT_TRUE_TOKENS = {'1', 'true', 'yes', 'y', 'on', '是', '公共', '公开'}
+_IMPORT_FALSE_TOKENS = {'0', 'false', 'no', 'n', 'off', '否', '私有', '不公开'}
+# 列名别名与 README「常见输入列名映射」保持一致；匹配时忽略大小写与首尾空白
+_IMPORT_COLUMN_ALIASES = {
+    'items': {
+        'name': ('物品名', '名称', 'item_name', 'name'),
+        'category': ('类别', '分类', 'category'),
+        'stock_status': ('库存状态', '状态', 'stock_status'),
+        'features': ('归属', '可见性', 'features'),
+        'value': ('价值', 'value'),
+        'quantity': ('数量', 'quantity'),
+        'unit': ('单位', 'unit'),
+        'purchase_date': ('购入日期', '购入时间', 'purchase_date'),
+        'notes': ('备注', 'notes'),
+        'purchase_link': ('采购链接', '购买链接', 'purchase_link'),
+        'detail_refs': ('参考信息', 'detail_refs'),
+        'detail_link': ('详情链接', 'detail_link'),
+        'locations': ('位置', '存放位置', '位置名', 'locations', 'location_name'),
+        'responsible': ('负责人', 'owner', 'responsible'),
+    },
+    'locations': {
+        'name': ('位置名', '空间名', '名称', 'location_name', 'name'),
+        'parent': ('上级位置', 'parent'),
+        'status': ('清洁状态', '位置状态', '状态', 'clean_status', 'status'),
+        'longitude': ('经度', 'lng', 'longitude'),
+        'latitude': ('纬度', 'lat', 'latitude'),
+        'is_public': ('是否公共', 'public', 'is_public'),
+        'notes': ('备注', 'notes'),
+        'detail_link': ('详情链接', 'detail_link'),
+        'detail_refs': ('参考信息', 'detail_refs'),
+        'responsible': ('负责人', 'owner', 'responsible'),
+    },
+}
+
+
+def _import_cell_text(value):
+    """Normalize a CSV/XLSX cell into stripped text (XLSX yields numbers and datetimes)."""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _iter_import_rows(stream, filename):
+    """Yield `(row_number, header_list | values_list)` lazily from a CSV or XLSX stream.
+
+    The first yielded row is the header. Rows are never materialized as a whole,
+    so memory stays flat regardless of file size.
+    """
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext in {'.xlsx', '.xlsm'}:
+        if load_workbook is None:
+            raise ValueError('导入 XLSX 需要安装 openpyxl，或先另存为 CSV')
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+        try:
+            sheet = workbook.worksheets[0]
+            for row_number, values in enumerate(sheet.iter_rows(values_only=True), start=1):
+                yield row_number, [_import_cell_text(value) for value in values]
+        finally:
+            workbook.close()
+        return
+    if ext not in {'.csv', '.txt', ''}:
+        raise ValueError('仅支持 CSV 或 XLSX 文件')
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        for row_number, values in enumerate(csv.reader(text_stream), start=1):
+            yield row_number, [_import_cell_text(value) for value in values]
+    finally:
+        text_stream.detach()
+
+
+def _build_import_header_map(headers, kind):
+    """Map canonical field names to column indexes using the alias table."""
+    alias_index = {}
+    for field, aliases in _IMPORT_COLUMN_ALIASES[kind].items():
+        for alias in aliases:
+            alias_index.setdefault(alias.lower(), field)
+    mapping = {}
+    for index, header in enumerate(headers):
+        field = alias_index.get(_ensure_string(header).strip().lower())
+        if field and field not in mapping:
+            mapping[field] = index
+    if 'name' not in mapping:
+        raise ValueError('缺少名称列（如 物品名/名称/name 或 位置名/空间名）')
+    return mapping
+
+
+def _split_import_list(raw):
+    return [token.strip() for token in _IMPORT_LIST_SPLIT_PATTERN.split(raw or '') if token.strip()]
+
+
+def _parse_import_float(raw, label):
+    if not raw:
+        return None
+    try:
+        return float(raw.replace(',', ''))
+    except ValueError:
+        raise ValueError(f'{label}不是有效数字：{raw}')
+
+
+class _ImportNameLookup:
+    """Name -> id index built with one query; duplicate names resolve to an error."""
+
+    def __init__(self, pairs):
+        self._ids = {}
+        self._ambiguous = set()
+        for key, ident in pairs:
+            self.add(key, ident)
+
+    def add(self, key, ident):
+        key = _ensure_string(key).strip().lower()
+        if not key:
+            return
+        existing = self._ids.get(key)
+        if existing is not None and existing != ident:
+            self._ambiguous.add(key)
+        else:
+            self._ids[key] = ident
+
+    def resolve(self, name, label):
+        key = name.strip().lower()
+        if key in self._ambiguous:
+            raise ValueError(f'{label}「{name}」存在重名，无法确定')
+        ident = self._ids.get(key)
+        if ident is None:
+            raise ValueError(f'{label}「{name}」不存在')
+        return ident
+
+
+def _import_member_lookup():
+    pairs = []
+    for member_id, username, name in db.session.query(Member.id, Member.username, Member.name).all():
+        pairs.append((username, member_id))
+        if name and name != username:
+            pairs.append((name, member_id))
+    return _ImportNameLookup(pairs)
+
+
+def _import_location_lookup():
+    return _ImportNameLookup(db.session.query(Location.name, Location.id).all())
+
+
+def _next_import_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+def _import_detail_refs(fields):
+    entries = _parse_item_detail_refs(fields.get('detail_refs'))
+    if fields.get('detail_link'):
+        entries.append({'label': '详情链接', 'value': fields['detail_link']})
+    serialized, _ = _serialize_item_detail_refs(entries)
+    return serialized
+
+
+def _prepare_item_import_row(fields, ids, lookups, user_id, now):
+    name = _limit_text(fields.get('name'), 100)
+    if not name:
+        raise ValueError('名称为空')
+    stock_raw = fields.get('stock_status')
+    stock_status = _normalize_item_stock_status(stock_raw) if stock_raw else '正常'
+    if not stock_status:
+        raise ValueError(f'库存状态无效：{stock_raw}（仅允许 {"/".join(_ITEM_STOCK_STATUS_CHOICES)}）')
+    feature_raw = fields.get('features')
+    features = _normalize_item_feature(feature_raw) if feature_raw else '公共'
+    if not features:
+        raise ValueError(f'归属无效：{feature_raw}（仅允许 公共/私人）')
+    purchase_date = None
+    if fields.get('purchase_date'):
+        try:
+            purchase_date = datetime.strptime(fields['purchase_date'][:10], '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError(f"购入日期格式应为 YYYY-MM-DD：{fields['purchase_date']}")
+    location_ids = {
+        lookups['locations'].resolve(loc_name, '位置') for loc_name in _split_import_list(fields.get('locations'))
+    }
+    member_ids = {
+        lookups['members'].resolve(member_name, '负责人') for member_name in _split_import_list(fields.get('responsible'))
+    }
+    if features == '私人' and not member_ids:
+        member_ids = {user_id}
+    item_id = next(ids)
+    record = {
+        'id': item_id,
+        'name': name,
+        'category': _limit_text(fields.get('category'), 50) or None,
+        'stock_status': stock_status,
+        'features': features,
+        'value': _parse_import_float(fields.get('value'), '价值'),
+        'quantity': _parse_import_float(fields.get('quantity'), '数量'),
+        'unit': _limit_text(fields.get('unit'), 20) or None,
+        'purchase_date': purchase_date,
+        'notes': fields.get('notes') or None,
+        'purchase_link': _limit_text(fields.get('purchase_link'), 200),
+        'detail_refs': _import_detail_refs(fields),
+        'last_modified': now,
+    }
+    links = {
+        item_locations: [{'item_id': item_id, 'location_id': loc_id} for loc_id in sorted(location_ids)],
+        item_members: [{'item_id': item_id, 'member_id': mem_id} for mem_id in sorted(member_ids)],
+    }
+    if record['quantity'] is not None:
+        # Core 批量写入绕过了 flush 监听，初始数量在此记入台账
+        links[ItemQuantityChange.__table__] = [{
+            'item_id': item_id,
+            'recorded_at': now,
+            'quantity': record['quantity'],
+            'delta': record['quantity'],
+            'member_id': user_id,
+        }]
+    return record, links
+
+
+def _prepare_location_import_row(fields, ids, lookups, user_id, now):
+    name = _limit_text(fields.get('name'), 100)
+    if not name:
+        raise ValueError('名称为空')
+    status_raw = fields.get('status')
+    status = _normalize_location_status(status_raw) if status_raw else '正常'
+    if not status:
+        raise ValueError(f'位置状态无效：{status_raw}（仅允许 {"/".join(_LOCATION_STATUS_CHOICES)}）')
+    public_raw = (fields.get('is_public') or '').strip().lower()
+    if public_raw and public_raw not in _IMPORT_TRUE_TOKENS | _IMPORT_FALSE_TOKENS:
+        raise ValueError(f'是否公共无法识别：{fields.get("is_public")}')
+    is_public = public_raw in _IMPORT_TRUE_TOKENS
+    latitude = _parse_import_float(fields.get('latitude'), '纬度')
+    longitude = _parse_import_float(fields.get('longitude'), '经度')
+    if (latitude is None) != (longitude is None):
+        raise ValueError('经纬度需同时填写')
+    if latitude is not None and not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('经纬度超出范围')
+    parent_id = None
+    if fields.get('parent'):
+        parent_id = lookups['locations'].resolve(fields['parent'], '上级位置')
+    member_ids = {
+        lookups['members'].resolve(member_name, '负责人') for member_name in _split_import_list(fields.get('responsible'))
+    }
+    if not member_ids and not is_public:
+        member_ids = {user_id}
+    location_id = next(ids)
+    # 同一文件中后出现的行可以引用前面新建的位置作为上级
+    lookups['locations'].add(name, location_id)
+    record = {
+        'id': location_id,
+        'name': name,
+        'parent_id': parent_id,
+        'status': status,
+        'latitude': latitude,
+        'longitude': longitude,
+        'geohash': _geohash_encode(latitude, longitude),
+        'coordinate_source': 'import' if latitude is not None else None,
+        'notes': fields.get('notes') or '',
+        'is_public': is_public,
+        'detail_refs': _import_detail_refs(fields),
+        'detail_link': _limit_text(fields.get('detail_link'), 200) or None,
+        'last_modified': now,
+    }
+    links = {
+        location_members: [{'location_id': location_id, 'member_id': mem_id} for mem_id in sorted(member_ids)],
+    }
+    return record, links
+
+
+def import_records(kind, stream, filename, user_id, dry_run=False, batch_size=_IMPORT_BATCH_SIZE):
+    """Stream a CSV/XLSX file into items or locations and return a report dict.
+
+    Rows are validated with the same normalizers as the forms. Valid rows are
+    buffered and written with one executemany per table per batch; ids are
+    preallocated so association rows can be inserted alongside. On SQLite the
+    write lock is taken before ids are read, so a concurrent insert cannot claim
+    them. The whole import is one transaction: any database error rolls
+    everything back. With
+    `dry_run=True` nothing is written and the report lists what would happen.
+    Raises ValueError for file-level problems (format, missing name column).
+    """
+    if kind not in _IMPORT_KINDS:
+        raise ValueError(f'不支持的导入类型：{kind}')
+    model = Item if kind == 'items' else Location
+    prepare_row = _prepare_item_import_row if kind == 'items' else _prepare_location_import_row
+    batch_size = max(1, int(batch_size or _IMPORT_BATCH_SIZE))
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    if not dry_run and db.engine.dialect.name == 'sqlite':
+        # 预分配的 id 取自 max(id)+1，先拿写锁再读，避免与并发新增撞主键
+        db.session.commit()
+        try:
+            db.session.connection().exec_driver_sql('BEGIN IMMEDIATE')
+        except Exception:
+            db.session.rollback()
+            raise
+    lookups = {'members': _import_member_lookup(), 'locations': _import_location_lookup()}
+    id_counter = itertools.count(_next_import_id(model))
+    report = {
+        'kind': kind,
+        'dry_run': bool(dry_run),
+        'rows': 0,
+        'imported': 0,
+        'error_count': 0,
+        'errors': [],
+    }
+    records = []
+    link_rows = {}
+
+    def flush():
+        if dry_run or not records:
+            records.clear()
+            link_rows.clear()
+            return
+        db.session.execute(model.__table__.insert(), records)
+        for table, rows in link_rows.items():
+            if rows:
+                db.session.execute(table.insert(), rows)
+        new_ids = [record['id'] for record in records]
+        _refresh_status_alerts(
+            db.session.connection(),
+            new_ids if kind == 'items' else (),
+            new_ids if kind == 'locations' else ()
+        )
+        _journal_changes(db.session.connection(), _SYNC_ENTITY_TYPES[model], new_ids, member_id=user_id, now=now)
+        records.clear()
+        link_rows.clear()
+
+    rows_iter = _iter_import_rows(stream, filename)
+    try:
+        header_row = next(rows_iter, None)
+        if header_row is None:
+            raise ValueError('文件为空')
+        header_map = _build_import_header_map(header_row[1], kind)
+        for row_number, values in rows_iter:
+            if not any(values):
+                continue
+            report['rows'] += 1
+            fields = {
+                field: values[index] if index < len(values) else ''
+                for field, index in header_map.items()
+            }
             try:
-                loc_id = int(loc_id_raw)
-            except (TypeError, ValueError):
+                record, links = prepare_row(fields, id_counter, lookups, user_id, now)
+            except ValueError as exc:
+                report['error_count'] += 1
+                if len(report['errors']) < _IMPORT_MAX_REPORTED_ERRORS:
+                    report['errors'].append({'row': row_number, 'message': str(exc)})
                 continue
-            relation = _ensure_string(relation_raw).strip()
-            if relation not in _MEMBER_RELATION_TYPES:
-                relation = 'other'
-            note = _ensure_string(note_raw).strip()
-            location_relations.append({
-                'location_id': loc_id,
-                'relation': relation,
-                'note': note
+            records.append(record)
+            for table, rows in links.items():
+                link_rows.setdefault(table, []).extend(rows)
+            report['imported'] += 1
+            if len(records) >= batch_size:
+                flush()
+        flush()
+        if not dry_run and report['imported']:
+            _bulk_insert_logs([{
+                'user_id': user_id,
+                'action_type': "批量导入物品" if kind == 'items' else "批量导入位置",
+                'details': f"从 {os.path.basename(filename or '') or '文件'} 导入 {report['imported']} 条记录，跳过 {report['error_count']} 行"
+            }])
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    report['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return report
+
+
+@app.route('/api/import/<string:kind>', methods=['POST'])
+@login_required
+def import_data(kind):
+    """Upload a CSV/XLSX file (`file` field); `dry_run=1` validates without writing."""
+    if kind not in _IMPORT_KINDS:
+        abort(404)
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'missing_file', 'message': '请上传 CSV 或 XLSX 文件'}), 400
+    dry_run = request.values.get('dry_run', '').strip().lower() in {'1', 'true', 'yes', 'on'}
+    try:
+        report = import_records(kind, upload.stream, upload.filename, current_user.id, dry_run=dry_run)
+    except ValueError as exc:
+        return jsonify({'error': 'invalid_file', 'message': str(exc)}), 400
+    except OperationalError:
+        return jsonify({'error': 'database_busy', 'message': '数据库繁忙，导入未写入，请稍后重试'}), 503
+    return jsonify(report)
+
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(_IMPORT_KINDS))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user', 'username', default='admin', show_default=True, help='记为导入操作者的成员用户名')
+@click.option('--dry-run', is_flag=True, help='只校验并输出报告，不写入数据库')
+@click.option('--batch-size', default=_IMPORT_BATCH_SIZE, show_default=True, type=int)
+@cli_requires_schema
+def import_data_command(kind, path, username, dry_run, batch_size):
+    """Import items or locations from a CSV/XLSX file."""
+    member = Member.query.filter_by(username=username).first()
+    if member is None:
+        raise click.ClickException(f'成员 {username} 不存在')
+    with open(path, 'rb') as handle:
+        try:
+            report = import_records(kind, handle, path, member.id, dry_run=dry_run, batch_size=batch_size)
+        except ValueError as exc:
+            raise click.ClickException(str(exc))
+    click.echo(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+# ---------------------------------------------------------------------------
+# 合成实验室数据与基准测试：生成可复现的大数据集，并记录核心路由的延迟/查询数/内存
+# ---------------------------------------------------------------------------
+_SYNTHETIC_SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗'
+_SYNTHETIC_GIVEN_NAMES = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂'
+_SYNTHETIC_ITEM_NOUNS = ('乙醇', '丙酮', '移液枪', '离心管', '培养皿', '示波器', '万用表', '烧杯', '滤纸', '手套',
+                         '显微镜', '电源', '试剂盒', '缓冲液', '硅胶', '注射器', '天平', '搅拌器', '温度计', '冷冻盒')
+_SYNTHETIC_ITEM_QUALIFIERS = ('分析纯', '一次性', '大号', '小号', '高精度', '备用', '进口', '国产', '无菌', '耐高温')
+_SYNTHETIC_LOCATION_NOUNS = ('楼', '层', '实验室', '柜', '架', '抽屉', '盒')
+_SYNTHETIC_EVENT_TOPICS = ('组会', '安全培训', '仪器维护', '文献分享', '开题答辩', '清洁日', '采购盘点', '学术报告')
+_SYNTHETIC_CATEGORIES = ('化学品', '耗材', '仪器', '工具', '生物样品', '办公用品')
+_SYNTHETIC_PASSWORD = 'synthetic'
+_SYNTHETIC_ATTACHMENT_DIR = 'synthetic'
+# 1x1 透明 PNG，作为本地附件桩文件
+_SYNTHETIC_PNG_BYTES = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=='
+)
+_SYNTHETIC_INSERT_BATCH = 2000
+
+
+def _synthetic_insert(table, rows, returning=False):
+    """Insert rows in executemany batches; optionally return generated ids in order."""
+    ids = []
+    for start in range(0, len(rows), _SYNTHETIC_INSERT_BATCH):
+        chunk = rows[start:start + _SYNTHETIC_INSERT_BATCH]
+        if returning:
+            ids.extend(db.session.execute(
+                table.insert().returning(table.c.id, sort_by_parameter_order=True), chunk
+            ).scalars().all())
+        else:
+            db.session.execute(table.insert(), chunk)
+    return ids
+
+
+def _synthetic_location_plan(rng, count, depth):
+    """Return parent indexes for `count` locations forming a tree at most `depth` levels deep."""
+    root_count = max(1, min(count, count // 50 or 1))
+    parents = [None] * root_count
+    levels = [0] * root_count
+    frontier = list(range(root_count))
+    for index in range(root_count, count):
+        # 偏向最近加入的节点作为父级，使树尽量长到目标深度
+        parent = frontier[-1 - int(rng.random() ** 2 * len(frontier))]
+        parents.append(parent)
+        levels.append(levels[parent] + 1)
+        if levels[-1] < depth - 1:
+            frontier.append(index)
+    return parents, levels
+
+
+def generate_synthetic_lab(members=50, items=2000, locations=300, events=200, depth=5,
+                           attachments=1, seed=42, days=365):
+    """Populate the database with a reproducible synthetic lab.
+
+    Rows are written with executemany batches in one transaction; member
+    usernames are `syn{seed}-NNNN`, so a seed can only be generated once.
+    Attachments are local stub images under ATTACHMENTS_FOLDER/synthetic/.
+    Returns a dict of inserted row counts.
+    """
+    rng = random.Random(seed)
+    prefix = f'syn{seed}-'
+    if db.session.query(Member.id).filter(Member.username.like(f'{prefix}%')).first():
+        raise ValueError(f'种子 {seed} 的合成数据已存在')
+    now = datetime.utcnow()
+    password_hash = generate_password_hash(_SYNTHETIC_PASSWORD)
+    counts = Counter()
+    journal_floor = _sync_entity_max_ids(db.session.connection())
+
+    def random_time(past_days=days, future_days=0):
+        return now + timedelta(seconds=rng.randint(-past_days * 86400, future_days * 86400))
+
+    member_rows = []
+    for index in range(members):
+        name = rng.choice(_SYNTHETIC_SURNAMES) + ''.join(rng.choice(_SYNTHETIC_GIVEN_NAMES) for _ in range(rng.randint(1, 2)))
+        member_rows.append({
+            'name': name,
+            'username': f'{prefix}{index:04d}',
+            'password_hash': password_hash,
+            'contact': f'{prefix}{index:04d}@example.com',
+            'notes': '',
+            'feedback_log': '',
+            'last_modified': random_time(),
+        })
+    member_ids = _synthetic_insert(Member.__table__, member_rows, returning=True)
+    counts['members'] = len(member_ids)
+    if not member_ids:
+        return dict(counts)
+
+    parents, levels = _synthetic_location_plan(rng, locations, max(1, depth))
+    location_ids = [None] * locations
+    for level in range(max(levels, default=-1) + 1):
+        indexes = [index for index in range(locations) if levels[index] == level]
+        rows = []
+        for index in indexes:
+            latitude = longitude = None
+            if rng.random() < 0.5:
+                latitude = round(31.2 + rng.uniform(-0.05, 0.05), 6)
+                longitude = round(121.4 + rng.uniform(-0.05, 0.05), 6)
+            rows.append({
+                'name': f'{index + 1}{_SYNTHETIC_LOCATION_NOUNS[min(level, len(_SYNTHETIC_LOCATION_NOUNS) - 1)]}',
+                'parent_id': location_ids[parents[index]] if parents[index] is not None else None,
+                'status': rng.choice(_LOCATION_STATUS_CHOICES),
+                'latitude': latitude,
+                'longitude': longitude,
+                'geohash': _geohash_encode(latitude, longitude),
+                'is_public': rng.random() < 0.3,
+                'notes': '',
+                'last_modified': random_time(),
             })
-        interest_item_ids = request.form.getlist('interest_item_id')
-        interest_relations = request.form.getlist('interest_item_relation')
-        interest_notes = request.form.getlist('interest_item_note')
-        item_relations = []
-        for item_id_raw, relation_raw, note_raw in zip(interest_item_ids, interest_relations, interest_notes):
-            try:
-                item_id = int(item_id_raw)
-            except (TypeError, ValueError):
-                continue
-            relation = _ensure_string(relation_raw).strip()
-            if relation not in _MEMBER_ITEM_REL_TYPES:
-                relation = 'other'
-            note = _ensure_string(note_raw).strip()
-            item_relations.append({
+        for index, location_id in zip(indexes, _synthetic_insert(Location.__table__, rows, returning=True)):
+            location_ids[index] = location_id
+    counts['locations'] = len(location_ids)
+    location_member_rows = [
+        {'location_id': location_id, 'member_id': member_id}
+        for location_id in location_ids
+        for member_id in rng.sample(member_ids, min(len(member_ids), rng.randint(1, 2)))
+    ]
+    _synthetic_insert(location_members, location_member_rows)
+
+    item_rows = []
+    for index in range(items):
+        item_rows.append({
+            'name': f'{rng.choice(_SYNTHETIC_ITEM_QUALIFIERS)}{rng.choice(_SYNTHETIC_ITEM_NOUNS)} #{index + 1}',
+            'category': rng.choice(_SYNTHETIC_CATEGORIES),
+            'stock_status': rng.choices(_ITEM_STOCK_STATUS_CHOICES, weights=(70, 12, 8, 6, 4))[0],
+            'features': rng.choice(sorted(_ALLOWED_ITEM_FEATURES)),
+            'value': round(rng.uniform(5, 5000), 2),
+            'quantity': rng.randint(1, 50),
+            'unit': rng.choice(('瓶', '包', '台', '个', '盒')),
+            'purchase_date': random_time().date(),
+            'notes': '',
+            'purchase_link': '',
+            'last_modified': random_time(),
+        })
+    item_ids = _synthetic_insert(Item.__table__, item_rows, returning=True)
+    counts['items'] = len(item_ids)
+    leaf_pool = location_ids or [None]
+    _synthetic_insert(item_locations, [
+        {'item_id': item_id, 'location_id': location_id}
+        for item_id in item_ids
+        for location_id in set(rng.choice(leaf_pool) for _ in range(rng.randint(1, 2)))
+        if location_id is not None
+    ])
+    _synthetic_insert(item_members, [
+        {'item_id': item_id, 'member_id': member_id}
+        for item_id in item_ids
+        for member_id in rng.sample(member_ids, min(len(member_ids), rng.randint(1, 3)))
+    ])
+    loan_rows = []
+    for item_id, row in zip(item_ids, item_rows):
+        # 少量已归还的历史记录，借出状态的物品再配一条未归还记录
+        for _ in range(rng.choices((0, 1, 2), weights=(85, 10, 5))[0]):
+            out_at = random_time()
+            loan_rows.append({
                 'item_id': item_id,
-                'relation': relation,
-                'note': note
+                'borrower_id': rng.choice(member_ids),
+                'checked_out_at': out_at,
+                'due_at': out_at + timedelta(days=_LOAN_DEFAULT_DAYS),
+                'returned_at': min(now, out_at + timedelta(days=rng.randint(1, 20))),
+                'previous_stock_status': row['stock_status'],
             })
-        event_ids = request.form.getlist('event_relation_event_id')
-        event_relations_raw = request.form.getlist('event_relation_relation')
-        event_notes = request.form.getlist('event_relation_note')
-        event_relations = []
-        for event_id_raw, relation_raw, note_raw in zip(event_ids, event_relations_raw, event_notes):
-            try:
-                event_id = int(event_id_raw)
-            except (TypeError, ValueError):
-                continue
-            relation = _ensure_string(relation_raw).strip()
-            if relation not in _MEMBER_EVENT_REL_TYPES:
-                relation = 'other'
-            note = _ensure_string(note_raw).strip()
-            event_relations.append({
+        if row['stock_status'] == '借出':
+            out_at = random_time(past_days=30)
+            loan_rows.append({
+                'item_id': item_id,
+                'borrower_id': rng.choice(member_ids),
+                'checked_out_at': out_at,
+                'due_at': out_at + timedelta(days=_LOAN_DEFAULT_DAYS),
+                'returned_at': None,
+                'previous_stock_status': '正常',
+            })
+    _synthetic_insert(ItemLoan.__table__, loan_rows)
+    counts['item_loans'] = len(loan_rows)
+    counts['status_alerts'] = rebuild_status_alerts()
+    quantity_rows = []
+    for item_id, row in zip(item_ids, item_rows):
+        if rng.random() > 0.6:
+            continue
+        # 倒推数量历史：按时间顺序消耗，偶尔补货，最后一条等于当前数量
+        stamps = sorted(random_time(past_days=min(days, 90)) for _ in range(rng.randint(2, 8)))
+        deltas = [
+            rng.randint(10, 30) if rng.random() < 0.1 else -round(rng.uniform(0.2, 3), 1)
+            for _ in stamps
+        ]
+        level = float(row['quantity'])
+        for stamp, delta in reversed(list(zip(stamps, deltas))):
+            quantity_rows.append({
+                'item_id': item_id,
+                'recorded_at': stamp,
+                'quantity': round(level, 2),
+                'delta': delta,
+                'member_id': rng.choice(member_ids),
+            })
+            level -= delta
+    _synthetic_insert(ItemQuantityChange.__table__, quantity_rows)
+    counts['item_quantity_changes'] = len(quantity_rows)
+
+    event_rows = []
+    for index in range(events):
+        start = random_time(future_days=60)
+        event_rows.append({
+            'title': f'{rng.choice(_SYNTHETIC_EVENT_TOPICS)} 第{index + 1}期',
+            'description': '',
+            'visibility': rng.choices(('public', 'internal', 'personal'), weights=(5, 4, 1))[0],
+            'owner_id': rng.choice(member_ids),
+            'start_time': start,
+            'end_time': start + timedelta(hours=rng.randint(1, 4)),
+            'feedback_log': '',
+            'allow_participant_edit': False,
+            'created_at': start - timedelta(days=7),
+            'updated_at': start - timedelta(days=rng.randint(0, 7)),
+        })
+    event_ids = _synthetic_insert(Event.__table__, event_rows, returning=True)
+    counts['events'] = len(event_ids)
+    participant_rows = []
+    for event_id, row in zip(event_ids, event_rows):
+        invited = set(rng.sample(member_ids, min(len(member_ids), rng.randint(2, 12))))
+        invited.add(row['owner_id'])
+        for member_id in invited:
+            participant_rows.append({
                 'event_id': event_id,
-                'relation': relation,
-                'note': note
+                'member_id': member_id,
+                'role': 'owner' if member_id == row['owner_id'] else 'participant',
+                'status': 'confirmed',
+                'joined_at': row['created_at'],
             })
-        profile_payload = {
-            'bio': bio,
-            'social_links': social_links,
-            'location_relations': location_relations,
-            'item_relations': item_relations,
-            'event_relations': event_relations
+    _synthetic_insert(EventParticipant.__table__, participant_rows)
+    counts['event_participants'] = len(participant_rows)
+    event_location_rows = [
+        {'event_id': event_id, 'location_id': rng.choice(location_ids)} for event_id in event_ids
+    ] if location_ids else []
+    event_item_rows = [
+        {'event_id': event_id, 'item_id': item_id}
+        for event_id in event_ids
+        for item_id in rng.sample(item_ids, min(len(item_ids), rng.randint(0, 4)))
+    ]
+    _synthetic_insert(event_locations, event_location_rows)
+    _synthetic_insert(event_items, event_item_rows)
+    event_windows = {
+        event_id: (row['start_time'], row['end_time']) for event_id, row in zip(event_ids, event_rows)
+    }
+    reservation_rows = [
+        {
+            'event_id': link['event_id'],
+            'resource_type': resource_type,
+            'resource_id': link[key],
+            'start_time': event_windows[link['event_id']][0],
+            'end_time': event_windows[link['event_id']][1],
         }
-        member.notes = _serialize_profile_notes(profile_payload)
-        # 如填写了新密码则更新密码
-        new_password = request.form.get('password')
-        if new_password and new_password.strip() != '':
-            member.set_password(new_password)
-        # 更新头像
-        new_photo_ref = None
-        remote_photo_keys = _collect_remote_object_keys('photo')
-        if remote_photo_keys:
-            new_photo_ref = remote_photo_keys[-1]
-        else:
-            image_file = request.files.get('photo')
-            if image_file and image_file.filename != '' and allowed_file(image_file.filename):
-                if determine_media_kind(image_file.filename) != 'image':
-                    flash('头像仅支持图片格式，请选择 JPG / PNG 等常见格式。', 'warning')
-                else:
-                    stored_name = save_uploaded_media(image_file)
-                    if stored_name:
-                        new_photo_ref = stored_name
-        pending_delete_photo = None
-        if new_photo_ref:
-            if member.photo and member.photo != new_photo_ref:
-                pending_delete_photo = member.photo
-            member.photo = new_photo_ref
-        member.last_modified = datetime.utcnow()
-        db.session.commit()
-        if pending_delete_photo:
-            remove_uploaded_file(pending_delete_photo)
-        flash('个人信息已更新', 'success')
-        return redirect(url_for('profile', member_id=member_id))
-    locations = Location.query.order_by(func.lower(Location.name)).all()
-    items = Item.query.order_by(func.lower(Item.name)).all()
-    events = Event.query.order_by(func.lower(Event.title)).all()
-    return render_template('edit_profile.html',
-                           member=member,
-                           profile_meta=profile_meta,
-                           structured_notes=structured,
-                           relation_lookup=_MEMBER_RELATION_TYPES,
-                           item_relation_lookup=_MEMBER_ITEM_REL_TYPES,
-                           event_relation_lookup=_MEMBER_EVENT_REL_TYPES,
-                           locations=locations,
-                           items=items,
-                           events=events)
+        for resource_type, key, links in (
+            ('item', 'item_id', event_item_rows), ('location', 'location_id', event_location_rows)
+        )
+        for link in links
+    ]
+    _synthetic_insert(Reservation.__table__, reservation_rows)
+    counts['reservations'] = len(reservation_rows)
 
-@app.route('/message/<int:member_id>', methods=['POST'])
-@login_required
-def post_message(member_id):
-    # 提交留言
-    receiver = Member.query.get_or_404(member_id)
-    content = request.form.get('content')
-    if content and content.strip() != '':
-        append_feedback_entry(receiver, current_user, content.strip())
-        receiver.last_modified = datetime.utcnow()
-        db.session.commit()
-        flash('留言已发布', 'success')
-    return redirect(url_for('profile', member_id=member_id))
+    def feedback_stream(count):
+        entries = []
+        for _ in range(count):
+            sender = rng.randrange(len(member_ids))
+            entries.append(json.dumps({
+                'ts': random_time().replace(tzinfo=UTC).isoformat(),
+                'sid': member_ids[sender],
+                'sn': member_rows[sender]['name'],
+                'content': f"@{member_rows[rng.randrange(len(member_rows))]['name']} {rng.choice(('辛苦了!!', '这个还有吗??', '已补货', '谢谢'))}",
+            }, ensure_ascii=False))
+        return '\n'.join(entries)
+
+    member_table = Member.__table__
+    db.session.execute(
+        member_table.update().where(member_table.c.id == db.bindparam('member_id')).values(feedback_log=db.bindparam('log')),
+        [{'member_id': member_id, 'log': feedback_stream(rng.randint(0, 8))} for member_id in member_ids]
+    )
+    event_table = Event.__table__
+    db.session.execute(
+        event_table.update().where(event_table.c.id == db.bindparam('event_id')).values(
+            feedback_log=db.bindparam('log'),
+            # 保留生成的更新时间，避免 onupdate 把所有事项改成当前时间
+            updated_at=event_table.c.updated_at
+        ),
+        [{'event_id': event_id, 'log': feedback_stream(rng.randint(0, 5))} for event_id in event_ids]
+    )
+    message_rows = [
+        {
+            'sender_id': rng.choice(member_ids),
+            'receiver_id': rng.choice(member_ids),
+            'content': rng.choice(('明天组会记得带样品', '仪器预约改到下午', '试剂已放回原位')),
+            'timestamp': random_time(),
+        }
+        for _ in range(members * 5)
+    ]
+    _synthetic_insert(Message.__table__, message_rows)
+    counts['messages'] = len(message_rows)
+
+    attachment_rows = []
+    if attachments > 0:
+        use_local_stub = not app.config.get('USE_OSS')
+        stub_dir = os.path.join(app.config['ATTACHMENTS_FOLDER'], _SYNTHETIC_ATTACHMENT_DIR)
+        if use_local_stub:
+            os.makedirs(stub_dir, exist_ok=True)
+        for owner_key, owner_ids in (('item_id', item_ids), ('location_id', location_ids), ('event_id', event_ids)):
+            for owner_id in owner_ids:
+                for position in range(rng.randint(0, attachments)):
+                    filename = f'{_SYNTHETIC_ATTACHMENT_DIR}/{prefix}{owner_key[0]}{owner_id}-{position}.png'
+                    if use_local_stub:
+                        with open(os.path.join(app.config['ATTACHMENTS_FOLDER'], filename), 'wb') as handle:
+                            handle.write(_SYNTHETIC_PNG_BYTES)
+                    attachment_rows.append({owner_key: owner_id, 'filename': filename, 'created_at': now})
+        for row in attachment_rows:
+            for key in ('item_id', 'location_id', 'event_id'):
+                row.setdefault(key, None)
+        _synthetic_insert(Attachment.__table__, attachment_rows)
+    counts['attachments'] = len(attachment_rows)
+
+    log_entries = []
+    for item_id in item_ids:
+        for _ in range(rng.randint(0, 3)):
+            log_entries.append({
+                'timestamp': random_time(),
+                'user_id': rng.choice(member_ids),
+                'item_id': item_id,
+                'action_type': rng.choice(('新增物品', '修改物品', '批量修改物品')),
+                'details': '合成数据',
+            })
+    for location_id in location_ids:
+        log_entries.append({
+            'timestamp': random_time(),
+            'user_id': rng.choice(member_ids),
+            'location_id': location_id,
+            'action_type': '修改位置',
+            'details': '合成数据',
+        })
+    for start in range(0, len(log_entries), _SYNTHETIC_INSERT_BATCH):
+        counts['logs'] += _bulk_insert_logs(log_entries[start:start + _SYNTHETIC_INSERT_BATCH])
+    # 绕过 ORM 写入成员不会触发 before_flush，需手动让成员查找缓存失效
+    _bump_cache_version(db.session.connection(), _MEMBER_LOOKUP_CACHE_KEY)
+    counts['change_journal'] = _journal_existing_rows(db.session.connection(), journal_floor)
+    db.session.commit()
+    return dict(counts)
+
+
+@app.cli.command('generate-synthetic-lab')
+@click.option('--members', default=50, show_default=True, type=int)
+@click.option('--items', default=2000, show_default=True, type=int)
+@click.option('--locations', default=300, show_default=True, type=int)
+@click.option('--events', default=200, show_default=True, type=int)
+@click.option('--depth', default=5, show_default=True, type=int, help='位置树的最大层数')
+@click.option('--attachments', default=1, show_default=True, type=int, help='每个物品/位置/事项最多的桩附件数')
+@click.option('--seed', default=42, show_default=True, type=int, help='随机种子，相同参数与种子生成相同数据')
+@cli_requires_schema
+def generate_synthetic_lab_command(members, items, locations, events, depth, attachments, seed):
+    """Fill the database with a reproducible synthetic lab for audits and benchmarks."""
+    started = time.perf_counter()
+    try:
+        counts = generate_synthetic_lab(
+            members=max(1, members), items=max(0, items), locations=max(0, locations),
+            events=max(0, events), depth=depth, attachments=attachments, seed=seed
+        )
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    click.echo(json.dumps(counts, ensure_ascii=False))
+    click.echo(f'完成，用时 {time.perf_counter() - started:.1f}s；成员密码均为 {_SYNTHETIC_PASSWORD}')
+
+
+# 基准路由：(名称, endpoint, 需要样本 ID 的参数 -> 模型名, 额外查询参数)
+_BENCHMARK_ROUTES = (
+    ('index', 'index', None, {}),
+    ('items', 'items', None, {}),
+    ('item_detail', 'item_detail', ('item_id', 'Item'), {}),
+    ('locations', 'locations_list', None, {}),
+    ('location_detail', 'view_location', ('loc_id', 'Location'), {}),
+    ('members', 'members_list', None, {}),
+    ('profile', 'profile', ('member_id', 'Member'), {}),
+    ('events', 'events_overview', None, {}),
+    ('event_detail', 'event_detail', ('event_id', 'Event'), {}),
+    ('api_item_search', 'search_items', None, {'q': '乙醇'}),
+    ('api_location_search', 'search_locations', None, {'q': '实验室'}),
+    ('api_nearby', 'nearby_locations', None, {'lat': 31.2, 'lng': 121.4, 'radius': 3000}),
+    ('api_notifications', 'list_notifications', None, {}),
+    ('api_item_timeline', 'entity_timeline', ('entity_id', 'Item'), {'kind': 'item'}),
+    ('api_location_availability', 'resource_availability', ('id', 'Location'), {'type': 'location'}),
+)
+_BENCHMARK_RESULTS_DIR = os.path.join(app.instance_path, 'benchmarks')
 
 
-@app.errorhandler(403)
-def forbidden(error):
-    description = getattr(error, 'description', None) or '无权访问该资源。'
-    if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
-        return jsonify({'error': 'forbidden', 'message': description}), 403
-    back_url = request.referrer if request.referrer else url_for('index')
-    return render_template('error_403.html', description=description, back_url=back_url), 403
+def _percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def _current_git_commit():
+    try:
+        output = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+            capture_output=True, text=True, timeout=5, check=True
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return output.stdout.strip() or None
+
+
+def _benchmark_targets():
+    targets = []
+    for name, endpoint, sample, params in _BENCHMARK_ROUTES:
+        arguments = dict(params)
+        if sample:
+            argument, model_name = sample
+            model = globals()[model_name]
+            query = db.session.query(model.id)
+            if model is Event:
+                # 私人/内部事项对基准用户可能不可见，只取公开事项
+                query = query.filter(Event.visibility == 'public')
+            total = query.count()
+            if not total:
+                continue
+            # 取按 ID 排序的中位记录，避免总是落在最早/最新的数据上
+            arguments[argument] = query.order_by(model.id).offset(total // 2).limit(1).scalar()
+        targets.append((name, url_for(endpoint, **arguments)))
+    return targets
+
+
+def run_benchmark(username='admin', runs=20, warmup=2, response_cache=False):
+    """Drive the core routes with the test client and summarise latency, queries and memory."""
+    member = Member.query.filter_by(username=username).first()
+    if member is None:
+        raise ValueError(f'成员 {username} 不存在')
+    with app.test_request_context():
+        targets = _benchmark_targets()
+    previous = {
+        key: app.config.get(key)
+        for key in ('BENLAB_PROFILING', 'PROFILING_SLOW_SAMPLE_RATE', 'RESPONSE_CACHE_BACKEND')
+    }
+    app.config.update(BENLAB_PROFILING=True, PROFILING_SLOW_SAMPLE_RATE=0.0)
+    if not response_cache:
+        app.config['RESPONSE_CACHE_BACKEND'] = 'off'
+    results = []
+    try:
+        client = app.test_client()
+        with client.session_transaction() as flask_session:
+            flask_session['_user_id'] = str(member.id)
+            flask_session['_fresh'] = True
+        for name, url in targets:
+            durations = []
+            query_counts = []
+            status = None
+            for attempt in range(warmup + runs):
+                with client:
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    elapsed = time.perf_counter() - started
+                    profile = g.get('_benlab_profile')
+                    status = response.status_code
+                # CLI 的应用上下文跨请求复用，需手动丢弃会话，否则身份映射会让后续请求少查库
+                db.session.remove()
+                if attempt >= warmup:
+                    durations.append(elapsed * 1000)
+                    query_counts.append(profile.sql_count if profile else 0)
+            tracemalloc.start()
+            client.get(url)
+            _current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            db.session.remove()
+            durations.sort()
+            query_counts.sort()
+            results.append({
+                'name': name,
+                'url': url,
+                'status': status,
+                'p50_ms': round(_percentile(durations, 0.5), 2),
+                'p95_ms': round(_percentile(durations, 0.95), 2),
+                'mean_ms': round(sum(durations) / len(durations), 2),
+                'queries': _percentile(query_counts, 0.5),
+                'peak_alloc_kb': round(peak / 1024, 1),
+            })
+    finally:
+        app.config.update(previous)
+    dataset = {
+        'members': db.session.query(func.count(Member.id)).scalar(),
+        'items': db.session.query(func.count(Item.id)).scalar(),
+        'locations': db.session.query(func.count(Location.id)).scalar(),
+        'events': db.session.query(func.count(Event.id)).scalar(),
+        'logs': db.session.query(func.count(Log.id)).scalar(),
+    }
+    max_rss_kb = None
+    if resource is not None:
+        max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'commit': _current_git_commit(),
+        'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'runs': runs,
+        'warmup': warmup,
+        'response_cache': response_cache,
+        'dataset': dataset,
+        'max_rss_kb': max_rss_kb,
+        'routes': results,
+    }
+
+
+def _format_benchmark_table(report, baseline=None):
+    baseline_routes = {route['name']: route for route in (baseline or {}).get('routes', [])}
+    lines = [f"{'route':<22}{'status':>7}{'p50 ms':>10}{'p95 ms':>10}{'queries':>9}{'peak KB':>10}"]
+    for route in report['routes']:
+        line = (
+            f"{route['name']:<22}{route['status']:>7}{route['p50_ms']:>10.1f}{route['p95_ms']:>10.1f}"
+            f"{route['queries']:>9}{route['peak_alloc_kb']:>10.1f}"
+        )
+        previous = baseline_routes.get(route['name'])
+        if previous and previous.get('p50_ms'):
+            change = (route['p50_ms'] - previous['p50_ms']) / previous['p50_ms'] * 100
+            line += f"  p50 {change:+.0f}% queries {route['queries'] - previous['queries']:+d}"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+@app.cli.command('benchmark')
+@click.option('--user', 'username', default='admin', show_default=True, help='以该成员身份访问')
+@click.option('--runs', default=20, show_default=True, type=int)
+@click.option('--warmup', default=2, show_default=True, type=int)
+@click.option('--response-cache', is_flag=True, help='保留响应缓存（默认关闭以测量真实渲染开销）')
+@click.option('--output', type=click.Path(dir_okay=False), default=None,
+              help='结果文件路径（默认 instance/benchmarks/<时间>-<提交>.json）')
+@click.option('--compare', 'compare_path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='与之前的结果文件对比')
+@cli_requires_schema
+def benchmark_command(username, runs, warmup, response_cache, output, compare_path):
+    """Benchmark the core pages and APIs and store the results as JSON."""
+    try:
+        report = run_benchmark(username=username, runs=max(1, runs), warmup=max(0, warmup), response_cache=response_cache)
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    if not output:
+        stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(_BENCHMARK_RESULTS_DIR, f"{stamp}-{report['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as handle:
+        json.dump(report, handle, ensure_ascii=False, indent=2)
+    baseline = None
+    if compare_path:
+        with open(compare_path, encoding='utf-8') as handle:
+            baseline = json.load(handle)
+    click.echo(_format_benchmark_table(report, baseline))
+    click.echo(f'结果已写入 {output}')
+
 
 @app.route('/export/<string:datatype>')
 @login_required
@@ -5941,108 +11908,203 @@ def export_data(datatype):
     return send_file(filename, as_attachment=True, mimetype='text/csv', download_name=filename)
 
 
-@app.context_processor
-def inject_attachment_helpers():
-    def _resolve_media_entry(ref):
-        if not ref:
+class _FragmentCache:
+    """Size-bounded LRU of rendered template fragments with hit/miss counters."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+_fragment_cache = _FragmentCache(app.config['FRAGMENT_CACHE_MAX_ENTRIES'])
+
+
+def fragment_cache(kind, owner_id, refs, *variant, caller=None):
+    """Jinja call-block helper caching the enclosed markup.
+
+    `{% call fragment_cache('item-gallery', item.id, item.attachment_filenames) %}...{% endcall %}`
+    Keyed by kind, owner id, a digest of the raw attachment refs (the list's
+    version) and any extra variant values; the body is only rendered on a miss.
+    While pages embed signed OSS URLs the key also rolls over with their lifetime.
+    """
+    if caller is None:
+        return Markup('')
+    if not app.config['FRAGMENT_CACHE_MAX_ENTRIES']:
+        return Markup(caller())
+    digest = hashlib.sha1(
+        '\x1f'.join(str(part) for part in list(refs or []) + ['\x1e'] + list(variant)).encode('utf-8')
+    ).hexdigest()
+    signed_window = _signed_url_window_seconds()
+    key = (kind, owner_id, digest, int(time.time() // signed_window) if signed_window else 0)
+    cached = _fragment_cache.get(key)
+    if cached is None:
+        cached = Markup(caller())
+        _fragment_cache.set(key, cached)
+    return cached
+
+
+@app.route('/api/write-queue/stats')
+@login_required
+def write_queue_stats():
+    """Writer batch sizes and per-mutation queue wait/latency; 404 when the queue is off."""
+    if _write_queue is None:
+        return jsonify({'error': 'write_queue_disabled', 'message': '未开启 SQLITE_WRITE_QUEUE'}), 404
+    return jsonify(_write_queue.stats())
+
+
+@app.route('/api/cache/stats')
+@login_required
+def cache_stats():
+    return jsonify({
+        'fragments': _fragment_cache.stats(),
+        'rich_text': {'entries': len(_rich_text_cache), 'max_entries': _RICH_TEXT_CACHE_SIZE},
+    })
+
+
+def _resolve_media_entry(ref):
+    if not ref:
+        return None, None
+    if _is_external_media(ref):
+        return _normalize_external_url(ref), 'external'
+    if app.config.get('USE_OSS'):
+        key = _normalize_attachment_ref(ref)
+        if not key:
             return None, None
-        if _is_external_media(ref):
-            return _normalize_external_url(ref), 'external'
-        if app.config.get('USE_OSS'):
-            key = _normalize_attachment_ref(ref)
-            if not key:
-                return None, None
-            return _build_oss_url(key), 'oss'
-        root, rel_path = _resolve_local_attachment_ref(ref)
-        if root and rel_path:
-            return url_for('uploaded_attachment', filename=rel_path), 'local'
-        return url_for('uploaded_attachment', filename=ref), 'local'
-
-    def resolve_media_url(ref):
-        resolved, _source = _resolve_media_entry(ref)
-        return resolved
-
-    def media_display_name(ref):
-        if not ref:
-            return ''
-        token = str(ref)
-        token = token.split('?', 1)[0]
-        token = token.split('#', 1)[0]
-        return os.path.basename(token)
-
-    def _build_media_entries(sources):
-        entries = []
-        seen = set()
-        for fname in sources or []:
-            if not fname or fname in seen:
-                continue
-            seen.add(fname)
-            resolved, source = _resolve_media_entry(fname)
-            if not resolved:
-                continue
-            entries.append({
-                'url': resolved,
-                'kind': determine_media_kind(fname),
-                'filename': fname,
-                'display_name': media_display_name(fname),
-                'is_remote': _is_external_media(fname),
-                'source': source
-            })
-        return entries
+        return _build_oss_url(key), 'oss'
+    root, rel_path = _resolve_local_attachment_ref(ref)
+    if root and rel_path:
+        return url_for('uploaded_attachment', filename=rel_path), 'local'
+    return url_for('uploaded_attachment', filename=ref), 'local'
 
-    def item_media_entries(item):
-        if not item:
-            return []
-        return _build_media_entries(getattr(item, 'attachment_filenames', []) or [])
 
-    def location_media_entries(location):
-        if not location:
-            return []
-        return _build_media_entries(getattr(location, 'attachment_filenames', []) or [])
+def _resolve_media_url(ref):
+    resolved, _source = _resolve_media_entry(ref)
+    return resolved
 
-    def event_media_entries(event):
-        if not event:
-            return []
-        filenames = []
-        for att in getattr(event, 'attachments', []) or []:
-            if att.filename:
-                filenames.append(att.filename)
-        return _build_media_entries(filenames)
-
-    def uploaded_media_url(filename):
-        return resolve_media_url(filename)
-
-    def item_attachment_urls(item):
-        return [entry['url'] for entry in item_media_entries(item) if entry['kind'] == 'image']
-
-    def location_attachment_urls(location):
-        return [entry['url'] for entry in location_media_entries(location) if entry['kind'] == 'image']
-
-    def uploaded_attachment_url(filename):
-        return uploaded_media_url(filename)
-
-    return dict(
-        item_media_entries=item_media_entries,
-        location_media_entries=location_media_entries,
-        event_media_entries=event_media_entries,
-        uploaded_media_url=uploaded_media_url,
-        uploaded_attachment_url=uploaded_attachment_url,
-        item_attachment_urls=item_attachment_urls,
-        location_attachment_urls=location_attachment_urls,
-        media_kind=determine_media_kind,
-        media_kind_labels=MEDIA_KIND_LABELS,
-        media_display_name=media_display_name,
-        direct_upload_config=_build_direct_upload_config(),
-        feature_intent=_feature_intent,
-        normalize_item_stock_status=_normalize_item_stock_status,
-        stock_status_intent=_stock_status_intent,
-        is_item_alert_status=_is_item_alert_status,
-        item_alert_action_label=_item_alert_action_label,
-        item_alert_level=_item_alert_level,
-        normalize_location_status=_normalize_location_status,
-        location_status_intent=_location_status_intent,
-        is_location_dirty=_is_location_dirty_status,
-    )
+
+def _media_display_name(ref):
+    if not ref:
+        return ''
+    token = str(ref)
+    token = token.split('?', 1)[0]
+    token = token.split('#', 1)[0]
+    return os.path.basename(token)
+
+
+def _build_media_entries(sources):
+    entries = []
+    seen = set()
+    for fname in sources or []:
+        if not fname or fname in seen:
+            continue
+        seen.add(fname)
+        resolved, source = _resolve_media_entry(fname)
+        if not resolved:
+            continue
+        entries.append({
+            'url': resolved,
+            'kind': determine_media_kind(fname),
+            'filename': fname,
+            'display_name': _media_display_name(fname),
+            'is_remote': _is_external_media(fname),
+            'source': source
+        })
+    return entries
+
+
+def _item_media_entries(item):
+    if not item:
+        return []
+    return _build_media_entries(getattr(item, 'attachment_filenames', []) or [])
+
+
+def _location_media_entries(location):
+    if not location:
+        return []
+    return _build_media_entries(getattr(location, 'attachment_filenames', []) or [])
+
+
+def _event_media_entries(event):
+    if not event:
+        return []
+    filenames = []
+    for att in getattr(event, 'attachments', []) or []:
+        if att.filename:
+            filenames.append(att.filename)
+    return _build_media_entries(filenames)
+
+
+def _item_attachment_urls(item):
+    return [entry['url'] for entry in _item_media_entries(item) if entry['kind'] == 'image']
+
+
+def _location_attachment_urls(location):
+    return [entry['url'] for entry in _location_media_entries(location) if entry['kind'] == 'image']
+
+
+# 模板辅助函数与请求无关，注册为 Jinja 全局一次即可，避免每次渲染重新构建闭包
+app.jinja_env.globals.update(
+    item_media_entries=_item_media_entries,
+    location_media_entries=_location_media_entries,
+    event_media_entries=_event_media_entries,
+    uploaded_media_url=_resolve_media_url,
+    uploaded_attachment_url=_resolve_media_url,
+    item_attachment_urls=_item_attachment_urls,
+    location_attachment_urls=_location_attachment_urls,
+    media_kind=determine_media_kind,
+    media_kind_labels=MEDIA_KIND_LABELS,
+    media_display_name=_media_display_name,
+    fragment_cache=fragment_cache,
+    feature_intent=_feature_intent,
+    normalize_item_stock_status=_normalize_item_stock_status,
+    stock_status_intent=_stock_status_intent,
+    is_item_alert_status=_is_item_alert_status,
+    item_alert_action_label=_item_alert_action_label,
+    item_alert_level=_item_alert_level,
+    normalize_location_status=_normalize_location_status,
+    location_status_intent=_location_status_intent,
+    is_location_dirty=_is_location_dirty_status,
+)
+
+
+@app.context_processor
+def inject_attachment_helpers():
+    # 仅注入依赖请求/配置的值；直传配置按配置项缓存，不再每次渲染重新生成
+    return dict(direct_upload_config=_build_direct_upload_config())
 
 if __name__ == "__main__":
     host = os.getenv("HOST", "0.0.0.0")